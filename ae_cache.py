@@ -0,0 +1,227 @@
+"""
+daly_lab_ae_pipeline
+ae_cache
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Summary of code:
+    1. After the first parse of a Digital Wave .txt file, the waveform block
+       is stored as a .npy file plus a small .json header in a cache folder.
+    2. Later loads memory map the cached array, no text parsing is done.
+    3. Entries are found by source path, size and mtime, and shared between
+       copies of the same file through a content hash of the file.
+    4. The cache folder is size bounded, least recently used entries are
+       evicted first. Entries can be invalidated per file or all at once.
+    5. Derived arrays of other modules (thumbnails, spectra) live in
+       subfolders of the cache and count against the same bound, each .npy
+       file is an entry used last at its mtime.
+
+Set AE_CACHE_DIR to move the cache, e.g. to a shared scratch disk.
+
+"""
+import numpy as np
+import hashlib
+import json
+import os
+import time
+
+
+CACHE_DIR = os.environ.get('AE_CACHE_DIR', os.path.join(
+    os.path.expanduser('~'), '.cache', 'daly_lab_ae_pipeline'))
+CACHE_MAX_BYTES = 20 * 2**30 # evict down to this total size
+
+
+def source_key(ae_file):
+    """ cheap key from source path, size and mtime (no file content read) """
+    stat = os.stat(ae_file)
+    key = f'{os.path.abspath(ae_file)}|{stat.st_size}|{stat.st_mtime_ns}'
+
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def content_hash(ae_file, block_size=2**20):
+    """ hash of the full file content, identifies copies of the same file """
+    h = hashlib.blake2b(digest_size=16)
+    with open(ae_file, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def entry_paths(content, cache_dir):
+    """ .npy waveform block and .json header for a content hash """
+    return (os.path.join(cache_dir, content + '.npy'),
+            os.path.join(cache_dir, content + '.json'))
+
+
+def cache_content(ae_file, cache_dir=CACHE_DIR):
+    """ content hash of ae_file, from its path alias when there is one """
+    alias = os.path.join(cache_dir, source_key(ae_file) + '.key')
+    if os.path.exists(alias):
+        with open(alias) as f:
+            return f.read().strip()
+
+    # same file may be cached under another path or mtime
+    return content_hash(ae_file)
+
+
+def load_cached_signals(ae_file, cache_dir=CACHE_DIR, content=None):
+    """ memory map of the cached [channel][event][sample] signals of
+        ae_file, None if not in the cache. content (cache_content) is looked
+        up if not given. fs etc. are read from the .txt header line by the
+        caller, the .json header is not needed. """
+    alias = os.path.join(cache_dir, source_key(ae_file) + '.key')
+    if content is None:
+        content = cache_content(ae_file, cache_dir)
+    npy_file, header_file = entry_paths(content, cache_dir)
+    try:
+        signals = np.load(npy_file, mmap_mode='r') # zero copy
+    except FileNotFoundError: # not cached, or evicted meanwhile
+        return None
+    if not os.path.exists(alias):
+        write_atomic(alias, content)
+    if os.path.exists(header_file):
+        os.utime(header_file) # mark as recently used for eviction
+
+    return signals
+
+
+def store_cached_signals(ae_file, signals, fs, channel_num, sig_length,
+                         cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES,
+                         content=None):
+    """ add parsed [channel][event][sample] signals of ae_file to cache,
+        content is the hash from the lookup before parsing if there was one """
+    os.makedirs(cache_dir, exist_ok=True)
+    if content is None:
+        content = content_hash(ae_file)
+    npy_file, header_file = entry_paths(content, cache_dir)
+    tmp_file = npy_file + f'.{os.getpid()}.tmp'
+    with open(tmp_file, 'wb') as f:
+        np.save(f, np.ascontiguousarray(signals))
+    os.replace(tmp_file, npy_file)
+    header = {'source': os.path.abspath(ae_file),
+              'size': os.path.getsize(ae_file),
+              'mtime': os.path.getmtime(ae_file),
+              'fs': int(fs),
+              'channel_num': int(channel_num),
+              'sig_length': int(sig_length),
+              'created': time.time()}
+    write_atomic(header_file, json.dumps(header))
+    write_atomic(os.path.join(cache_dir, source_key(ae_file) + '.key'),
+                 content)
+    evict_cache(cache_dir, max_bytes, keep=content)
+
+    return npy_file
+
+
+def write_atomic(file_name, text):
+    """ write small text file so readers never see a partial file """
+    tmp_file = file_name + f'.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as f:
+        f.write(text)
+    os.replace(tmp_file, file_name)
+
+
+def cache_entries(cache_dir=CACHE_DIR):
+    """ list of (content hash, bytes, last used) for all cached files,
+        subfolder entries by their path relative to cache_dir """
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for name in os.listdir(cache_dir):
+        folder = os.path.join(cache_dir, name)
+        if os.path.isdir(folder): # thumbnails, spectra
+            for file_name in os.listdir(folder):
+                if file_name.endswith('.npy'):
+                    path = os.path.join(folder, file_name)
+                    entries.append((os.path.join(name, file_name),
+                                    os.path.getsize(path),
+                                    os.path.getmtime(path)))
+            continue
+        if not name.endswith('.npy'):
+            continue
+        content = name[:-4]
+        npy_file, header_file = entry_paths(content, cache_dir)
+        try:
+            last_used = os.path.getmtime(header_file)
+        except OSError: # header missing, treat entry as oldest
+            last_used = 0
+        entries.append((content, os.path.getsize(npy_file), last_used))
+
+    return entries
+
+
+def remove_entry(content, cache_dir=CACHE_DIR):
+    """ delete an entry and every path alias that points at it """
+    if os.path.dirname(content): # subfolder entry, a single file
+        os.remove(os.path.join(cache_dir, content))
+        return
+    for file_name in entry_paths(content, cache_dir):
+        if os.path.exists(file_name):
+            os.remove(file_name)
+    for name in os.listdir(cache_dir):
+        if name.endswith('.key'):
+            alias = os.path.join(cache_dir, name)
+            with open(alias) as f:
+                if f.read().strip() == content:
+                    os.remove(alias)
+
+
+def evict_cache(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, keep=None):
+    """ remove least recently used entries until cache fits in max_bytes """
+    entries = sorted(cache_entries(cache_dir), key=lambda entry: entry[2])
+    total = sum(entry[1] for entry in entries)
+    for content, size, _ in entries:
+        if total <= max_bytes:
+            break
+        if content == keep:
+            continue
+        remove_entry(content, cache_dir)
+        print(f"cache entry evicted : {content} ({size/2**20:.1f} MB)")
+        total -= size
+
+    return total
+
+
+def evict_derived(name, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """ evict down to max_bytes after the subfolder entry name (a .npy in
+        a subfolder of cache_dir) was written, keeping that entry """
+    return evict_cache(cache_dir, max_bytes,
+                       keep=os.path.relpath(name, cache_dir))
+
+
+def invalidate_cache(ae_file=None, cache_dir=CACHE_DIR):
+    """ drop the cache entry of ae_file, or the whole cache if None """
+    if not os.path.isdir(cache_dir):
+        return
+    if ae_file is None:
+        for content, _, _ in cache_entries(cache_dir):
+            remove_entry(content, cache_dir)
+        return
+    alias = os.path.join(cache_dir, source_key(ae_file) + '.key')
+    if os.path.exists(alias):
+        with open(alias) as f:
+            remove_entry(f.read().strip(), cache_dir)
+    else:
+        remove_entry(content_hash(ae_file), cache_dir)
+
+
+if __name__ == '__main__':
+
+    entries = cache_entries()
+    print(f'cache folder : {CACHE_DIR}')
+    for content, size, last_used in entries:
+        if os.path.dirname(content): # thumbnails, spectra
+            source = os.path.dirname(content)
+        elif os.path.exists(entry_paths(content, CACHE_DIR)[1]):
+            with open(entry_paths(content, CACHE_DIR)[1]) as f:
+                source = json.load(f)['source']
+        else:
+            source = 'header missing'
+        print("{:s}  {:>8.1f} MB  {:s}  {:s}".format(
+            content, size/2**20, time.ctime(last_used), source))
+    print("total : {:>8.1f} MB of {:>8.1f} MB".format(
+        sum(entry[1] for entry in entries)/2**20, CACHE_MAX_BYTES/2**20))
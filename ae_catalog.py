@@ -0,0 +1,271 @@
+"""
+daly_lab_ae_pipeline
+ae_catalog
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Summary of code:
+    1. A catalog is one folder holding the processed datasets of a whole
+       campaign. Each ingested dataset is an experiment with a number, a
+       name and free metadata (e.g. load=3) in experiments.json.
+    2. The per hit columns of all experiments (event, sensor, toa, peak
+       polarity, features, ...) are appended to one .npd table, hits.npd,
+       with the experiment number as a column. The waveforms (and other per
+       hit arrays) of each experiment are a .npd folder of their own in
+       waves/, so experiments can have different signal lengths.
+    3. Ingesting only appends: new rows are written at the end of the hit
+       columns, the waveforms go to a new folder and experiments.json is
+       replaced last. A crash before that leaves rows that are cut off the
+       next time the catalog is opened. Columns an experiment does not have
+       are filled with nan (-1 for integers).
+    4. query() selects hits across experiments from the memory mapped hit
+       columns (experiment numbers / names, event, sensor and a value or
+       (low, high) range of any column) and reads only the waveforms of the
+       selected rows.
+
+One writer at a time, queries can run while nothing is ingested.
+
+Example:
+    python ae_catalog.py campaign_catalog 3_filtered_AE_toa_peak_polarity/*.npz
+
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import numpy as np
+from ae_cache import source_key
+from ae_io import (COLUMN_DTYPES, append_column_dataset,
+                   column_dataset_rows, column_file, column_header,
+                   dequantize_values, load_column_dataset, load_dataset,
+                   truncate_column_dataset, value_mask,
+                   write_column_dataset)
+
+
+CATALOG_VERSION = 1
+
+
+def fill_value(dtype):
+    """ value of a column for rows of experiments that do not have it """
+    return np.nan if np.dtype(dtype).kind in 'fc' else -1
+
+
+def add_column(name, key, dtype, rows):
+    """ new column of a .npd folder, rows filled with fill_value """
+    array = np.full(rows, fill_value(dtype), dtype=dtype)
+    with open(column_file(name, key), 'wb') as f:
+        f.write(column_header(array.dtype, array.shape))
+        f.write(array.tobytes())
+
+
+class Catalog:
+    """ campaign wide store of processed datasets, see module docstring """
+    def __init__(self, path):
+        self.path = path
+        self.hits = os.path.join(path, 'hits.npd')
+        self.index = os.path.join(path, 'experiments.json')
+        os.makedirs(os.path.join(path, 'waves'), exist_ok=True)
+        self.experiments = []
+        if os.path.exists(self.index):
+            with open(self.index) as f:
+                self.experiments = json.load(f)['experiments']
+        # rows of an ingest that did not finish are not part of the catalog
+        rows = column_dataset_rows(self.hits)
+        if rows is not None and rows > self.rows:
+            truncate_column_dataset(self.hits, self.rows)
+            print("catalog : {:>5d} rows of an unfinished ingest cut".format(
+                rows - self.rows))
+
+    @property
+    def rows(self):
+        return sum(experiment['rows'] for experiment in self.experiments)
+
+    def __len__(self):
+        return len(self.experiments)
+
+    def waves_folder(self, number):
+        return os.path.join(self.path, 'waves', '{:d}.npd'.format(number))
+
+    def ingest(self, dataset_file, name=None, **metadata):
+        """ append a processed dataset as a new experiment, returns its
+            number. A dataset already in the catalog is not added again. """
+        key = source_key(dataset_file)
+        for experiment in self.experiments:
+            if experiment['source_key'] == key:
+                print("already in catalog : {:s} (experiment {:d})".format(
+                    dataset_file, experiment['experiment']))
+                return experiment['experiment']
+        data = load_dataset(dataset_file)
+        number = len(self.experiments)
+        rows = len(data['event'])
+
+        # waveforms (and other per row arrays) of this experiment only,
+        # waveforms as integers when exact
+        waves = {k: v for k, v in data.items() if np.ndim(v) == 2}
+        write_column_dataset(self.waves_folder(number), waves, quantize=True)
+
+        # dataset wide values (fs, settings) and file names are metadata
+        hits = {'experiment': np.full(rows, number)}
+        experiment = {'experiment': number,
+                      'name': name or os.path.splitext(
+                          os.path.basename(dataset_file.rstrip('/\\')))[0],
+                      'dataset': os.path.abspath(dataset_file),
+                      'source_key': key,
+                      'ingested': datetime.datetime.now().isoformat(),
+                      'first_row': self.rows,
+                      'rows': rows,
+                      'waves': sorted(waves)}
+        for k, v in data.items():
+            if k == 'parent_txt':
+                experiment[k] = np.unique(np.asarray(v, dtype=str)).tolist()
+            elif np.ndim(v) == 0:
+                experiment[k] = v.item()
+            elif np.ndim(v) == 1 and np.asarray(v).dtype.kind in 'biuf':
+                hits[k] = v
+            elif k not in waves:
+                print(f'column {k} not cataloged')
+        experiment.update(metadata)
+        self.append_hits(hits)
+
+        # the experiment exists once the index lists it
+        self.experiments.append(experiment)
+        tmp_file = self.index + f'.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'catalog_version': CATALOG_VERSION,
+                       'experiments': self.experiments}, f, indent=1)
+        os.replace(tmp_file, self.index)
+        print("experiment {:>3d} : {:>6d} hits from {:s}".format(
+            number, rows, dataset_file))
+
+        return number
+
+    def append_hits(self, hits):
+        """ append hit columns, the column sets of old and new rows are
+            padded to each other with fill values """
+        if column_dataset_rows(self.hits) is None:
+            write_column_dataset(self.hits, hits)
+            return
+        truncate_column_dataset(self.hits, self.rows)
+        columns = load_column_dataset(self.hits)
+        columns.pop('format_version', None)
+        rows = len(hits['experiment'])
+        for key, value in hits.items():
+            if key not in columns: # first experiment with this column
+                add_column(self.hits, key, np.dtype(
+                    COLUMN_DTYPES.get(key, np.asarray(value).dtype)),
+                    self.rows)
+        hits = dict(hits)
+        for key, column in columns.items():
+            if key not in hits:
+                hits[key] = np.full(rows, fill_value(column.dtype),
+                                    dtype=column.dtype)
+        del columns # memory maps closed before the files grow
+        append_column_dataset(self.hits, hits)
+
+    def experiment_numbers(self, selection=None, **metadata):
+        """ numbers of experiments by number / name (one, a list or a
+            (low, high) range of numbers) and metadata values or ranges """
+        numbers = np.array([e['experiment'] for e in self.experiments],
+                           dtype=np.int64)
+        mask = np.ones(len(numbers), dtype=bool)
+        if selection is not None:
+            names = np.array([e['name'] for e in self.experiments])
+            is_name = isinstance(selection, str) or (
+                isinstance(selection, list) and selection
+                and isinstance(selection[0], str))
+            mask &= value_mask(names if is_name else numbers, selection)
+        for key, selection in metadata.items():
+            values = np.array([e.get(key) for e in self.experiments])
+            mask &= value_mask(values, selection)
+
+        return numbers[mask]
+
+    def query(self, columns=None, experiment=None, event=None, sensor=None,
+              **ranges):
+        """ dict of arrays of the hits of the selected experiments, events
+            and sensors whose columns are in ranges (value, list or (low,
+            high)). columns can be hit columns, waveform columns or
+            experiment metadata (e.g. 'fs', 'name'), event, sensor and
+            experiment are always returned. """
+        hits = load_column_dataset(self.hits)
+        hits.pop('format_version', None)
+        if not hits:
+            return {}
+        columns = list(hits) if columns is None else list(columns)
+        mask = np.ones(self.rows, dtype=bool)
+        if experiment is not None:
+            mask &= np.isin(hits['experiment'][:self.rows],
+                            self.experiment_numbers(experiment))
+        for key, selection in (('event', event), ('sensor', sensor),
+                               *ranges.items()):
+            if selection is not None:
+                mask &= value_mask(hits[key][:self.rows], selection)
+        rows = np.flatnonzero(mask)
+
+        result = {}
+        for key in dict.fromkeys(['experiment', 'event', 'sensor'] +
+                                 columns):
+            if key in hits:
+                result[key] = np.asarray(hits[key][rows])
+            elif any(key in e['waves'] for e in self.experiments):
+                result[key] = self.query_waves(key, rows,
+                                               hits['experiment'][rows])
+            else: # experiment metadata, one value per row
+                values = np.array([e.get(key) for e in self.experiments])
+                result[key] = values[hits['experiment'][rows]]
+        print("catalog query : {:>6d} of {:>6d} hits".format(len(rows),
+                                                           self.rows))
+
+        return result
+
+    def query_waves(self, key, rows, experiments):
+        """ waveform column key of the given catalog rows, only those rows
+            are read from the memory mapped waveform folders """
+        result = np.zeros((0, 0))
+        for number in np.unique(experiments):
+            entry = self.experiments[number]
+            if key not in entry['waves']:
+                raise KeyError(f'experiment {number} has no {key} column')
+            selected = experiments == number
+            folder = load_column_dataset(self.waves_folder(number),
+                                         {key, key + '_decimals'})
+            part = folder[key][rows[selected] - entry['first_row']]
+            if key + '_decimals' in folder:
+                part = dequantize_values(part, int(folder[key + '_decimals']))
+            if not result.size:
+                result = np.zeros((len(rows),) + part.shape[1:], part.dtype)
+            elif part.shape[1:] != result.shape[1:]:
+                raise ValueError(f'{key} rows of experiment {number} have '
+                                 f'shape {part.shape[1:]}, others '
+                                 f'{result.shape[1:]}, query experiments '
+                                 'with one signal length at a time')
+            result[selected] = part
+
+        return result
+
+    def summary(self):
+        """ one line per experiment """
+        for e in self.experiments:
+            print("{:>4d}  {:<40s}  {:>7d} hits  fs : {}".format(
+                e['experiment'], e['name'], e['rows'], e.get('fs')))
+        print("catalog : {:d} experiments, {:d} hits".format(len(self),
+                                                            self.rows))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Add processed datasets to a campaign catalog')
+    parser.add_argument('catalog', help='catalog folder (created if missing)')
+    parser.add_argument('datasets', nargs='*',
+                        help='datasets (.npz, .npd or .json) or glob patterns')
+    args = parser.parse_args()
+
+    catalog = Catalog(args.catalog)
+    for pattern in args.datasets:
+        for dataset_file in sorted(glob.glob(pattern)) or [pattern]:
+            catalog.ingest(dataset_file)
+    catalog.summary()
@@ -0,0 +1,139 @@
+"""
+daly_lab_ae_pipeline
+ae_dataset
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Summary of code:
+    1. AEDataset holds a processed dataset as array columns (waves, event,
+       sensor, parent_txt, toa, ...) with one row per waveform.
+    2. An (event, sensor) -> row index is built once, so the waveforms of an
+       event are found without scanning the event column.
+    3. Rows can be selected by event, sensor or parent file in one vectorized
+       step, and event_waves() gives a [event][channel][sample] view of the
+       waveforms (no copy for datasets written by the pipeline).
+    4. The sampling frequency of the acquisition (fs column written by
+       create_dataset) gives the sample interval, dt(), and the time axis.
+
+"""
+import numpy as np
+from ae_io import load_dataset, row_mask, save_dataset
+
+
+class AEDataset:
+    """ array backed AE dataset with an (event, sensor) -> row index """
+    def __init__(self, columns):
+        self.columns = {key: np.asarray(value)
+                        for key, value in columns.items()}
+        event = self.columns['event']
+        sensor = self.columns['sensor']
+        # sorted unique events / sensors, grid[event idx, sensor idx] = row
+        self.events, event_idx = np.unique(event, return_inverse=True)
+        self.sensors, sensor_idx = np.unique(sensor, return_inverse=True)
+        self.grid = np.full((len(self.events), len(self.sensors)), -1)
+        self.grid[event_idx, sensor_idx] = np.arange(len(event))
+        self.event_lookup = {ev: idx for idx, ev in
+                             enumerate(self.events.tolist())}
+        self.sensor_lookup = {sen: idx for idx, sen in
+                              enumerate(self.sensors.tolist())}
+
+    @classmethod
+    def load(cls, dataset_file, columns=None, event=None, sensor=None,
+             parent_txt=None):
+        """ AEDataset from a .npz, .npd or .json dataset file, optionally
+            only some columns and the selected rows (see mask) """
+        return cls(load_dataset(dataset_file, columns, event, sensor,
+                                parent_txt))
+
+    def save(self, source_file, label, fmt='.npz'):
+        """ save next to source_file, returns the dataset file name """
+        return save_dataset(source_file, self, label, fmt)
+
+    # dict-like access to the columns, e.g. dataset['toa']
+    def __getitem__(self, key):
+        return self.columns[key]
+
+    def __setitem__(self, key, value):
+        value = np.asarray(value)
+        if len(value) != len(self):
+            raise ValueError(f'column {key} has {len(value)} rows, '
+                             f'dataset has {len(self)}')
+        self.columns[key] = value
+
+    def __contains__(self, key):
+        return key in self.columns
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns['event'])
+
+    def keys(self):
+        return self.columns.keys()
+
+    def items(self):
+        return self.columns.items()
+
+    def dt(self, default=10**-7):
+        """ sample interval (s) from the fs metadata, default if missing """
+        return 1 / float(self['fs']) if 'fs' in self else default
+
+    def time(self, waves='waves'):
+        """ sample times (us) of the waveforms """
+        return np.arange(self[waves].shape[1]) * self.dt() * 10**6
+
+    def row(self, event, sensor):
+        """ row of one waveform, -1 if that event has no such sensor """
+        return self.grid[self.event_lookup[event], self.sensor_lookup[sensor]]
+
+    def event_rows(self, event):
+        """ rows of all waveforms of an event, ordered by sensor """
+        rows = self.grid[self.event_lookup[event]]
+
+        return rows[rows >= 0]
+
+    def mask(self, event=None, sensor=None, parent_txt=None):
+        """ boolean row mask, each argument is one value, a list or a range
+            (event=(first, last) selects an inclusive event range) """
+        return row_mask(self.columns, event, sensor, parent_txt)
+
+    def select(self, event=None, sensor=None, parent_txt=None):
+        """ new AEDataset with only the selected rows """
+        mask = self.mask(event, sensor, parent_txt)
+
+        return AEDataset({key: value[mask] if value.ndim > 0 else value
+                          for key, value in self.columns.items()})
+
+    def event_waves(self):
+        """ waveforms as [event][channel][sample] for complete datasets """
+        if (self.grid < 0).any():
+            raise ValueError('not every event has every sensor')
+        waves = self['waves']
+        grid = self.grid
+        if grid.size == 0:
+            return waves.reshape(grid.shape + waves.shape[1:])
+        # rows laid out as base + event*event_step + channel*sensor_step
+        # (true for create_dataset output) give a strided view, else a copy
+        event_step = grid[1, 0] - grid[0, 0] if len(grid) > 1 else 0
+        sensor_step = grid[0, 1] - grid[0, 0] if grid.shape[1] > 1 else 0
+        expected = grid[0, 0] + \
+            np.arange(grid.shape[0])[:, None] * event_step + \
+            np.arange(grid.shape[1])[None, :] * sensor_step
+        if np.array_equal(grid, expected) and waves.ndim == 2 and \
+                waves.flags.c_contiguous:
+            row_stride = waves.strides[0]
+            return np.lib.stride_tricks.as_strided(
+                waves[grid[0, 0]:],
+                shape=(grid.shape[0], grid.shape[1], waves.shape[1]),
+                strides=(event_step * row_stride, sensor_step * row_stride,
+                         waves.strides[1]),
+                writeable=False)
+
+        return waves[grid]
+
+    def event_column(self, key):
+        """ any column as [event][channel], e.g. toa per event and sensor """
+        return self[key][self.grid]
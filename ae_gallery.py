@@ -0,0 +1,243 @@
+"""
+daly_lab_ae_pipeline
+ae_gallery
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Summary of code:
+    1. Every event is pre-rendered as a small image, the min/max envelope of
+       each channel stacked top to bottom, straight into numpy arrays (no
+       matplotlib per event). Chunks of events are rendered in a process
+       pool.
+    2. The thumbnails of a file are kept as one .npy in the thumbnails
+       folder of the ae_cache directory, keyed by source path, size, mtime
+       and thumbnail size, so triaging the same file again reuses them.
+       They count against the size bound of the cache (ae_cache eviction).
+    3. GalleryViewer shows a page of thumbnails (5 x 5 events by default).
+       Click a thumbnail (or hover and press 'n' / 'k') to mark it noise /
+       keep, Enter / Space / Right goes to the next page, Left / Backspace
+       back to the previous one. Decisions of a page are journaled when the
+       page is left.
+    4. The height of a channel in a thumbnail shrinks with the number of
+       channels (thumb_height), so a thumbnail stays about the same size.
+
+"""
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from ae_cache import CACHE_DIR, evict_derived, source_key
+from ae_metrics import record_wait
+
+
+THUMB_WIDTH = 160 # pixels (envelope bins) per thumbnail
+THUMB_HEIGHT = 40 # pixels per channel, at most
+NEXT_KEYS = ('enter', ' ', 'right', 'pagedown')
+PREVIOUS_KEYS = ('left', 'backspace', 'pageup')
+
+
+def thumb_height(channel_num, height=THUMB_HEIGHT, min_height=10):
+    """ pixels per channel, about 4 * height pixels per thumbnail """
+    return min(height, max(min_height, 4 * height // max(channel_num, 1)))
+
+
+def render_thumbnails(signals, width=THUMB_WIDTH, height=THUMB_HEIGHT):
+    """ [event][channel*height][width] uint8 envelope images (255 on the
+        trace) of [channel][event][sample] signals, one scale per event """
+    signals = np.asarray(signals, dtype=np.float64)
+    channel_num, event_num, sig_length = signals.shape
+    width = min(width, sig_length)
+    edges = np.linspace(0, sig_length, width + 1).astype(int)[:-1]
+    lo = np.minimum.reduceat(signals, edges, axis=2) # [channel][event][bin]
+    hi = np.maximum.reduceat(signals, edges, axis=2)
+    scale = np.abs(signals).max(axis=(0, 2)) if sig_length else \
+        np.ones(event_num)
+    scale = np.where(scale > 0, scale, 1)[None, :, None]
+    # +scale on the top pixel row, -scale on the bottom one
+    top = np.rint((1 - hi / scale) / 2 * (height - 1)).astype(int)
+    bottom = np.rint((1 - lo / scale) / 2 * (height - 1)).astype(int)
+    rows = np.arange(height)[:, None]
+    image = (rows >= top[..., None, :]) & (rows <= bottom[..., None, :])
+    image = image.transpose(1, 0, 2, 3).reshape(event_num,
+                                                channel_num * height, width)
+
+    return image.astype(np.uint8) * 255
+
+
+def thumbnail_file(ae_file, width=THUMB_WIDTH, height=THUMB_HEIGHT,
+                   cache_dir=CACHE_DIR):
+    """ cache file of the thumbnails of ae_file at this size """
+    return os.path.join(cache_dir, 'thumbnails', '{:s}_{:d}x{:d}.npy'.format(
+        source_key(ae_file), width, height))
+
+
+def cached_thumbnails(ae_file, signals, width=THUMB_WIDTH, height=None,
+                      workers=None, chunk_events=512, cache_dir=CACHE_DIR):
+    """ thumbnails of all events of ae_file, rendered in a process pool on
+        the first call and memory mapped from the cache after that, height
+        per channel from thumb_height if not given """
+    if height is None:
+        height = thumb_height(len(signals))
+    name = thumbnail_file(ae_file, width, height, cache_dir)
+    event_num = signals.shape[1]
+    if os.path.exists(name):
+        thumbs = np.load(name, mmap_mode='r')
+        if len(thumbs) == event_num:
+            os.utime(name) # recently used, evicted last
+            print("thumbnails reused : {:s}".format(name))
+            return thumbs
+    start = time.perf_counter()
+    chunks = [signals[:, ev_idx:ev_idx+chunk_events]
+              for ev_idx in range(0, event_num, chunk_events)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        thumbs = list(pool.map(render_thumbnails, chunks,
+                               [width] * len(chunks), [height] * len(chunks)))
+    thumbs = np.concatenate(thumbs) if thumbs else \
+        np.zeros((0, len(signals) * height, width), dtype=np.uint8)
+    os.makedirs(os.path.dirname(name), exist_ok=True)
+    tmp_file = name + f'.{os.getpid()}.tmp'
+    with open(tmp_file, 'wb') as f:
+        np.save(f, thumbs)
+    os.replace(tmp_file, name)
+    evict_derived(name, cache_dir)
+    print("thumbnails rendered : {:>5d} events in {:.1f} s".format(
+        event_num, time.perf_counter() - start))
+
+    return thumbs
+
+
+class GalleryViewer:
+    """ one figure with a rows x cols grid of event thumbnails """
+    def __init__(self, channel_num, shape, rows=5, cols=5, figsize=(16, 12)):
+        self.fig, axes = plt.subplots(rows, cols, figsize=figsize,
+                                      squeeze=False)
+        self.axes = list(axes.ravel())
+        self.images = []
+        for ax in self.axes:
+            self.images.append(ax.imshow(np.zeros(shape, dtype=np.uint8),
+                                         cmap='gray_r', vmin=0, vmax=255,
+                                         aspect='auto',
+                                         interpolation='nearest'))
+            for ch_idx in range(1, channel_num): # channel separators
+                ax.axhline(ch_idx * shape[0] / channel_num - 0.5,
+                           color='0.7', linewidth=0.5)
+            ax.set_xticks([])
+            ax.set_yticks([])
+        self.title = self.fig.suptitle('', fontsize=14)
+        self.fig.tight_layout(rect=(0, 0, 1, 0.96))
+        self.last_input = None
+        canvas = self.fig.canvas
+        canvas.mpl_connect('key_press_event', self.on_input)
+        canvas.mpl_connect('button_press_event', self.on_input)
+        manager = plt.get_current_fig_manager()
+        if hasattr(getattr(manager, 'window', None), 'showMaximized'):
+            manager.window.showMaximized()
+        plt.show(block=False)
+
+    def show_page(self, title, thumbs, labels, is_noise):
+        """ put a page of thumbnails on screen, unused tiles are hidden """
+        for idx, (ax, image) in enumerate(zip(self.axes, self.images)):
+            ax.set_visible(idx < len(thumbs))
+            if idx < len(thumbs):
+                image.set_data(thumbs[idx])
+                ax.set_title(labels[idx], fontsize=9)
+                self.mark(idx, is_noise[idx])
+        self.title.set_text(title)
+        self.fig.canvas.draw_idle()
+        self.fig.canvas.flush_events()
+
+    def mark(self, idx, noise):
+        """ red frame and title for noise, plain for keep """
+        ax = self.axes[idx]
+        color = 'r' if noise else '0.6'
+        for spine in ax.spines.values():
+            spine.set_color(color)
+            spine.set_linewidth(3 if noise else 1)
+        ax.title.set_color('r' if noise else 'k')
+
+    def tile(self, event):
+        """ index of the thumbnail under the mouse, None if there is none """
+        if event.inaxes in self.axes and event.inaxes.get_visible():
+            return self.axes.index(event.inaxes)
+        return None
+
+    def on_input(self, event):
+        self.last_input = event
+        self.fig.canvas.stop_event_loop()
+
+    def wait_input(self):
+        """ block until a key press or mouse click in the figure """
+        self.last_input = None
+        while self.last_input is None:
+            if not plt.fignum_exists(self.fig.number):
+                raise KeyboardInterrupt('viewer window closed')
+            self.fig.canvas.start_event_loop(timeout=0.5)
+
+        return self.last_input
+
+    def close(self):
+        plt.close(self.fig)
+
+
+def gallery_review(thumbs, ev, review, channel_num, peaks=None, journal=None,
+                   rows=5, cols=5):
+    """ noise decision for events ev[review] page by page, returns a dict
+        ev_idx -> is_noise. Events in the journal are not shown again. """
+    is_noise = {}
+    if journal is not None:
+        for ev_idx in review:
+            if int(ev[ev_idx]) in journal:
+                is_noise[ev_idx] = journal[int(ev[ev_idx])]
+        print("num events from journal : {:>5d}".format(len(is_noise)))
+    pending = [ev_idx for ev_idx in review if ev_idx not in is_noise]
+    if not pending:
+        return is_noise
+    per_page = rows * cols
+    pages = [pending[start:start+per_page]
+             for start in range(0, len(pending), per_page)]
+    marks = [np.zeros(len(page), dtype=bool) for page in pages]
+    viewer = GalleryViewer(channel_num, thumbs.shape[1:], rows, cols)
+    page = 0
+    try:
+        while page < len(pages):
+            idx = pages[page]
+            labels = ['{:d}'.format(int(ev[ev_idx])) if peaks is None else
+                      '{:d}  {:.3f} V'.format(int(ev[ev_idx]), peaks[ev_idx])
+                      for ev_idx in idx]
+            viewer.show_page("Page {:d}/{:d} | click or 'n'/'k' to mark "
+                             "NOISE / KEEP | Enter next, Left back".format(
+                                 page+1, len(pages)),
+                             thumbs[idx], labels, marks[page])
+            start = time.perf_counter()
+            while True:
+                event = viewer.wait_input()
+                tile = viewer.tile(event)
+                if event.name == 'button_press_event':
+                    if tile is not None:
+                        marks[page][tile] = ~marks[page][tile]
+                        viewer.mark(tile, marks[page][tile])
+                        viewer.fig.canvas.draw_idle()
+                elif event.key in ('n', 'k') and tile is not None:
+                    marks[page][tile] = event.key == 'n'
+                    viewer.mark(tile, marks[page][tile])
+                    viewer.fig.canvas.draw_idle()
+                elif event.key in NEXT_KEYS or (event.key in PREVIOUS_KEYS
+                                                and page > 0):
+                    break
+            # page time spread over its events for ae_metrics
+            for _ in idx:
+                record_wait((time.perf_counter() - start) / len(idx))
+            for ev_idx, noise in zip(idx, marks[page]):
+                is_noise[ev_idx] = bool(noise)
+                if journal is not None:
+                    journal.record(int(ev[ev_idx]), bool(noise))
+            page += 1 if event.key in NEXT_KEYS else -1
+    finally: # closed window / Ctrl-C, recorded pages stay on disk
+        viewer.close()
+        if journal is not None:
+            journal.close()
+
+    return is_noise
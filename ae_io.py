@@ -0,0 +1,512 @@
+"""
+daly_lab_ae_pipeline
+ae_io
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Summary of code:
+    1. Reading and writing of the datasets passed between pipeline stages.
+    2. Datasets are saved as .npz (default) or the original .json format.
+    3. In a .npz dataset the waveforms are one 2-D float array, event, sensor,
+       toa and peak_polarity are typed columns and parent_txt is stored once.
+    4. Existing .json datasets can be converted to .npz (run this file).
+    5. A .npd dataset is a folder with one .npy file per column. Rows can be
+       appended to it in place (live_tail.py), the .npy headers are padded to
+       a fixed size so only the shape is rewritten on append.
+    6. Loading can be limited to some columns and to the rows of an event
+       range, sensor or parent file. The small columns used for the row
+       selection are read first, the waveforms of an uncompressed .npz and
+       of a .npd are memory mapped so only the selected rows are read.
+    7. Waveforms read from the Digital Wave text have a fixed number of
+       decimals. In a .npz they are stored as int16 / int32 counts of
+       10**-decimals (found from the data, exactly reversible) with a
+       waves_decimals member, and decoded back to float on load. Finished
+       datasets can also be block compressed (compress_dataset).
+    8. Acquisition parameters (fs, sig_length) are carried as 0-d members,
+       stored once per dataset, so later stages do not assume 10 MHz / 1024.
+
+"""
+import numpy as np
+import json
+import os
+import struct
+import zipfile
+from tkinter import filedialog
+from tkinter import Tk
+
+
+FORMAT_VERSION = 2 # 2: waves may be stored quantized
+COLUMN_DTYPES = {'waves': np.float64,
+                 'waves_filtered': np.float64,
+                 'event': np.int64,
+                 'sensor': np.int64,
+                 'toa': np.float64,
+                 'toa_confidence': np.float64,
+                 'peak_polarity': np.float64,
+                 'amplitude_db': np.float64,
+                 'energy': np.float64,
+                 'rms': np.float64,
+                 'counts': np.int64,
+                 'rise_time': np.float64,
+                 'duration': np.float64,
+                 'counts_to_peak': np.int64,
+                 'location': np.float64,
+                 'location_residual': np.float64,
+                 'cluster': np.int64,
+                 'neighbors': np.int64,
+                 'neighbor_similarity': np.float64,
+                 'peak_frequency': np.float64,
+                 'frequency_centroid': np.float64,
+                 'fs': np.float64, # 0-d, one value per dataset
+                 'sig_length': np.int64,
+                 'experiment': np.int64}
+COLUMN_HEADER_BYTES = 128 # fixed .npy header size of .npd columns
+QUANTIZED_COLUMNS = ('waves', 'waves_filtered') # stored as int if exact
+# 0-d values of the whole dataset, loaded with any selection of columns
+METADATA_KEYS = ('fs', 'sig_length', 'preprocess_settings')
+QUANTIZE_MAX_DECIMALS = 6
+
+
+def dataset_name(source_file, label, fmt='.npz'):
+    """ output dataset file name, e.g. file.txt -> file_filter.npz """
+    return os.path.splitext(source_file)[0] + '_' + label + fmt
+
+
+def json_default(obj):
+    """ lets json.dump write numpy arrays and numpy scalars """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f'{type(obj)} is not JSON serializable')
+
+
+def save_dataset(source_file, dataset, label, fmt='.npz'):
+    """ save dictionary dataset next to source_file as .npz or .json """
+    name = dataset_name(source_file, label, fmt)
+    if fmt == '.npz':
+        write_npz_dataset(name, dataset)
+    elif fmt == '.npd':
+        write_column_dataset(name, dataset)
+    elif fmt == '.json':
+        with open(name, "w") as outfile:
+            json.dump(dict(dataset), outfile, default=json_default)
+    else:
+        raise ValueError(f'unknown dataset format {fmt}')
+    print("dataset {:s} saved  : {:>5s}".format(fmt, name))
+
+    return name
+
+
+def write_npz_dataset(name, dataset, quantize=True, compress=False):
+    """ write dataset dict as .npz with typed columns, parent_txt once,
+        waveforms as integers when that is exact """
+    arrays = {'format_version': np.array(FORMAT_VERSION)}
+    for key, value in dataset.items():
+        if key == 'parent_txt':
+            arrays[key] = pack_parent_txt(value)
+        else:
+            arrays[key] = np.asarray(value, dtype=COLUMN_DTYPES.get(key))
+        if quantize and key in QUANTIZED_COLUMNS:
+            quantize_column(arrays, key)
+    if compress: # smaller, but members can no longer be memory mapped
+        np.savez_compressed(name, **arrays)
+    else:
+        np.savez(name, **arrays)
+
+
+def quantize_column(arrays, key):
+    """ replace arrays[key] by integer counts and a key_decimals member
+        when that is exact, leave it as it is otherwise """
+    decimals, largest = quantize_decimals(lambda: array_chunks(arrays[key]))
+    dtype = quantized_dtype(largest)
+    if dtype is not None:
+        arrays[key] = quantize_values(arrays[key], decimals, dtype)
+        arrays[key + '_decimals'] = np.array(decimals)
+
+
+def array_chunks(values, chunk=2**22):
+    """ flat chunks of an array, bounds the temporaries of a full pass """
+    flat = np.asarray(values).reshape(-1)
+    for start in range(0, flat.size, chunk):
+        yield flat[start:start+chunk]
+
+
+def quantize_decimals(chunks, max_decimals=QUANTIZE_MAX_DECIMALS):
+    """ fewest decimals d for which every value v of chunks() is exactly
+        rint(v * 10**d) / 10**d, and the largest |rint(v * 10**d)|.
+        (None, None) if there is no such d. """
+    for decimals in range(max_decimals + 1):
+        scale = 10.0**decimals
+        largest = 0
+        for chunk in chunks():
+            if chunk.dtype.kind != 'f':
+                return None, None
+            counts = np.rint(chunk * scale)
+            if not np.array_equal(counts / scale, chunk): # also fails on nan
+                break
+            if counts.size:
+                largest = max(largest, np.abs(counts).max())
+        else:
+            return decimals, largest
+
+    return None, None
+
+
+def quantized_dtype(largest):
+    """ smallest of int16 / int32 holding counts up to largest """
+    if largest is None:
+        return None
+    for dtype in (np.int16, np.int32):
+        if largest <= np.iinfo(dtype).max:
+            return dtype
+
+    return None
+
+
+def quantize_values(values, decimals, dtype):
+    """ values as integer counts of 10**-decimals """
+    return np.rint(values * 10.0**decimals).astype(dtype)
+
+
+def dequantize_values(counts, decimals):
+    """ float values of integer counts, exact inverse of quantize_values """
+    return counts / 10.0**decimals
+
+
+def compress_dataset(dataset_file):
+    """ rewrite a .npz dataset block compressed (zip deflate), in place """
+    with np.load(dataset_file) as npz:
+        arrays = {key: npz[key] for key in npz.files}
+    temp_file = dataset_file + '.tmp.npz'
+    np.savez_compressed(temp_file, **arrays)
+    before, after = os.path.getsize(dataset_file), os.path.getsize(temp_file)
+    os.replace(temp_file, dataset_file)
+    print("compressed : {:s} ({:.1f} -> {:.1f} MB)".format(
+        dataset_file, before / 2**20, after / 2**20))
+
+    return dataset_file
+
+
+def pack_parent_txt(parent_txt):
+    """ one string when every row comes from the same file, else per row """
+    if isinstance(parent_txt, str):
+        return np.array(parent_txt)
+    parent_txt = np.asarray(parent_txt, dtype=str)
+    unique = np.unique(parent_txt)
+    if len(unique) == 1:
+        return np.array(unique[0])
+
+    return parent_txt
+
+
+def row_mask(data, event=None, sensor=None, parent_txt=None):
+    """ boolean row mask, each argument is one value, a list or a range
+        (event=(first, last) selects an inclusive event range) """
+    mask = np.ones(len(data['event']), dtype=bool)
+    for key, selection in (('event', event), ('sensor', sensor),
+                           ('parent_txt', parent_txt)):
+        if selection is not None:
+            mask &= value_mask(data[key], selection)
+
+    return mask
+
+
+def value_mask(values, selection):
+    """ values equal to selection (one value or a list), or in the
+        inclusive range of a (low, high) tuple """
+    if isinstance(selection, tuple):
+        return (values >= selection[0]) & (values <= selection[1])
+
+    return np.isin(values, selection)
+
+
+def load_dataset(dataset_file, columns=None, event=None, sensor=None,
+                 parent_txt=None, mmap=True):
+    """ loads .npz, .npd or .json dataset into dict of numpy arrays. Only
+        the given columns (all if None, event, sensor and the METADATA_KEYS
+        always) and the rows of the given event (range), sensor and
+        parent_txt are returned. """
+    print(f"Loading in Dataset from {dataset_file}")
+    keys = None if columns is None else \
+        set(columns) | {'event', 'sensor'} | set(METADATA_KEYS)
+    if keys is not None and parent_txt is not None:
+        keys.add('parent_txt')
+    if keys is not None: # quantization step of quantized columns
+        keys |= {key + '_decimals' for key in keys}
+    if os.path.isdir(dataset_file): # .npd folder, columns memory mapped
+        data = load_column_dataset(dataset_file, keys)
+    elif dataset_file.endswith('.json'): # text, has to be parsed in full
+        with open(dataset_file) as file:
+            data = json.load(file)
+        sig_length = data.get('sig_length')
+        data = {key: np.array(value) for key, value in data.items()
+                if keys is None or key in keys}
+        for key in QUANTIZED_COLUMNS: # [] of a dataset without rows
+            if key in data and data[key].size == 0 and sig_length:
+                data[key] = data[key].reshape(0, int(sig_length))
+    else:
+        data = load_npz_dataset(dataset_file, keys, mmap)
+    data.pop('format_version', None)
+    # per row view of the single parent file name, no copies
+    if data.get('parent_txt') is not None and data['parent_txt'].ndim == 0:
+        data['parent_txt'] = np.broadcast_to(data['parent_txt'],
+                                             (len(data['event']),))
+    if (event, sensor, parent_txt) != (None, None, None):
+        # only the selected rows of memory mapped columns are read
+        mask = row_mask(data, event, sensor, parent_txt)
+        data = {key: value[mask] if value.ndim > 0 else value
+                for key, value in data.items()}
+        if columns is not None and 'parent_txt' not in columns:
+            data.pop('parent_txt', None) # only needed for the selection
+    for key in QUANTIZED_COLUMNS: # integer counts back to float, after the
+        if key + '_decimals' in data: # row selection so only those rows
+            data[key] = dequantize_values(data[key],
+                                          int(data.pop(key + '_decimals')))
+    print(f"Successfully loaded in {os.path.splitext(dataset_file)[1]} file.\n")
+
+    return data
+
+
+def load_npz_dataset(name, keys=None, mmap=True):
+    """ members of a .npz dataset (all if keys is None), large members of
+        an uncompressed file memory mapped (copy on write) """
+    data = {}
+    with np.load(name) as npz: # members are only read when indexed
+        for key in npz.files:
+            if keys is not None and key not in keys:
+                continue
+            array = npz_member_memmap(name, npz.zip, key) if mmap else None
+            data[key] = npz[key] if array is None else array
+
+    return data
+
+
+def npz_member_memmap(name, zf, key, min_bytes=2**20):
+    """ memory map of member key of a .npz file, None if the member is
+        compressed, small or not a plain numeric array """
+    info = zf.getinfo(key + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED or info.file_size < min_bytes:
+        return None
+    with open(name, 'rb') as f:
+        # data starts after the local file header, its name and extra field
+        f.seek(info.header_offset)
+        local = struct.unpack('<4s5H3I2H', f.read(30))
+        f.seek(info.header_offset + 30 + local[9] + local[10])
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if fortran_order or dtype.hasobject or not shape:
+        return None
+
+    return np.memmap(name, dtype, 'c', offset, shape)
+
+
+def column_header(dtype, shape):
+    """ .npy v1.0 header padded to COLUMN_HEADER_BYTES, so it can be
+        rewritten in place when the first dimension grows """
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}"\
+        .format(np.lib.format.dtype_to_descr(np.dtype(dtype)), tuple(shape))
+    header = header.ljust(COLUMN_HEADER_BYTES - 11) + '\n'
+
+    return np.lib.format.MAGIC_PREFIX + bytes([1, 0]) + \
+        struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+def column_file(name, key):
+    return os.path.join(name, key + '.npy')
+
+
+def read_column_header(column):
+    """ (dtype, shape) of a .npd column file """
+    with open(column, 'rb') as f:
+        np.lib.format.read_magic(f)
+        shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+
+    return dtype, shape
+
+
+def write_column_dataset(name, dataset, quantize=False):
+    """ write dataset dict as a .npd folder, one .npy file per column,
+        waveforms as integers when that is exact if quantize """
+    os.makedirs(name, exist_ok=True)
+    arrays = {'format_version': np.array(FORMAT_VERSION)}
+    for key, value in dataset.items():
+        if key == 'parent_txt':
+            arrays[key] = pack_parent_txt(value)
+        elif np.ndim(value) == 0: # metadata such as fs stays 0-d, a (1,)
+            # column would count as 1 row and cut the others on append
+            arrays[key] = np.asarray(value, dtype=COLUMN_DTYPES.get(key))
+        else:
+            arrays[key] = np.ascontiguousarray(
+                value, dtype=COLUMN_DTYPES.get(key))
+        if quantize and key in QUANTIZED_COLUMNS: # not appendable then
+            quantize_column(arrays, key)
+    for file_name in os.listdir(name): # drop columns of an older dataset
+        if file_name.endswith('.npy') and file_name[:-4] not in arrays:
+            os.remove(os.path.join(name, file_name))
+    for key, array in arrays.items():
+        with open(column_file(name, key), 'wb') as f:
+            f.write(column_header(array.dtype, array.shape))
+            f.write(array.tobytes())
+
+
+def load_column_dataset(name, keys=None):
+    """ memory mapped columns of a .npd folder (all if keys is None) """
+    data = {}
+    for file_name in sorted(os.listdir(name)):
+        if file_name.endswith('.npy') and \
+                (keys is None or file_name[:-4] in keys):
+            data[file_name[:-4]] = np.load(os.path.join(name, file_name),
+                                           mmap_mode='r')
+
+    return data
+
+
+def column_dataset_rows(name):
+    """ rows every column of a .npd folder has, None if there is none """
+    if not os.path.isdir(name):
+        return None
+    shapes = [read_column_header(column_file(name, key))[1]
+              for key in load_column_dataset(name)
+              if key not in ('format_version', 'parent_txt')]
+    rows = [shape[0] for shape in shapes
+            if len(shape) > 0] # 0-d metadata has no rows
+
+    return min(rows) if rows else None
+
+
+def truncate_column_dataset(name, rows):
+    """ cut every row column of a .npd folder to its first rows rows """
+    for key in load_column_dataset(name):
+        column = column_file(name, key)
+        dtype, shape = read_column_header(column)
+        if key in ('format_version', 'parent_txt') or len(shape) == 0 or \
+                shape[0] == rows: # 0-d metadata has no rows
+            continue
+        shape = (rows,) + shape[1:]
+        with open(column, 'r+b') as f:
+            f.write(column_header(dtype, shape))
+            f.truncate(COLUMN_HEADER_BYTES +
+                       int(np.prod(shape)) * dtype.itemsize)
+
+
+def append_column_dataset(name, dataset):
+    """ append the rows of dataset to a .npd folder, created if missing.
+        Cost is proportional to the new rows only. """
+    rows = column_dataset_rows(name)
+    if rows is None:
+        write_column_dataset(name, dataset)
+        return
+    # columns left longer than the others by an interrupted append
+    truncate_column_dataset(name, rows)
+    for key, value in dataset.items():
+        if key == 'parent_txt' and \
+                np.unique(np.asarray(value, dtype=str)).size <= 1:
+            continue # stored once, all rows come from the same file
+        if np.ndim(value) == 0: # metadata such as fs, written with the
+            continue # first rows
+        column = column_file(name, key)
+        dtype, shape = read_column_header(column)
+        array = np.ascontiguousarray(value, dtype=dtype)
+        if array.shape[1:] != shape[1:]:
+            raise ValueError(f'column {key} has rows of shape '
+                             f'{array.shape[1:]}, dataset has {shape[1:]}')
+        with open(column, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            f.write(array.tobytes())
+            f.seek(0) # header last, a crash before this leaves old shape
+            f.write(column_header(dtype, (shape[0] + len(array),) +
+                                  shape[1:]))
+            f.flush()
+
+
+def convert_json_dataset(json_file):
+    """ converts an existing .json dataset into a .npz dataset """
+    with open(json_file) as file:
+        data = json.load(file)
+    name = os.path.splitext(json_file)[0] + '.npz'
+    write_npz_dataset(name, data)
+    print("converted : {:s} -> {:s}".format(json_file, name))
+
+    return name
+
+
+class NpzWriter:
+    """
+    Writes a .npz file member by member. Large arrays can be copied in from
+    spooled binary files so they are never held in memory all at once.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.zf = zipfile.ZipFile(name, 'w', zipfile.ZIP_STORED,
+                                  allowZip64=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.zf.close()
+
+    def write_array(self, key, array):
+        """ add an in-memory array as member key """
+        with self.zf.open(key + '.npy', 'w', force_zip64=True) as member:
+            np.lib.format.write_array(member, np.asanyarray(array))
+
+    def write_spooled(self, key, shape, dtype, spools, block_size=2**24,
+                      quantize=False):
+        """ add member key whose raw C-order bytes are in spools, in order.
+            With quantize, float values are stored as integer counts when
+            that is exact (one extra pass over the spools). """
+        decimals = None
+        if quantize:
+            decimals, largest = quantize_decimals(
+                lambda: spool_chunks(spools, dtype, block_size))
+            if quantized_dtype(largest) is None:
+                decimals = None
+        stored = dtype if decimals is None else quantized_dtype(largest)
+        header = {'descr': np.lib.format.dtype_to_descr(np.dtype(stored)),
+                  'fortran_order': False,
+                  'shape': tuple(shape)}
+        with self.zf.open(key + '.npy', 'w', force_zip64=True) as member:
+            np.lib.format.write_array_header_1_0(member, header)
+            for chunk in spool_chunks(spools, dtype, block_size):
+                if decimals is not None:
+                    chunk = quantize_values(chunk, decimals, stored)
+                member.write(chunk.tobytes())
+        if decimals is not None:
+            self.write_array(key + '_decimals', np.array(decimals))
+
+
+def spool_chunks(spools, dtype, block_size=2**24):
+    """ values of binary spool files as arrays of block_size bytes """
+    block_size -= block_size % np.dtype(dtype).itemsize
+    for spool in spools:
+        spool.seek(0)
+        for block in iter(lambda: spool.read(block_size), b''):
+            yield np.frombuffer(block, dtype=dtype)
+
+
+def select_json_files():
+    """ User selects .json datasets to convert """
+    root = Tk()
+    json_files = filedialog.askopenfilenames(
+        title="Select .json datasets", filetypes=(("Json files", "*.json"),
+                                                  ("All files", "*.*")))
+    root.destroy()
+
+    return list(json_files)
+
+
+if __name__ == '__main__':
+
+    # Convert archived *_filter.json / *_toa.json / *_peak_polarity.json
+    for json_file in select_json_files():
+        convert_json_dataset(json_file)
@@ -0,0 +1,119 @@
+"""
+daly_lab_ae_pipeline
+ae_journal
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Summary of code:
+    1. DecisionJournal appends every manual decision (noise/filter, TOA,
+       peak polarity) to a small .jsonl file next to the input as soon as it
+       is made. Lines are flushed at once, fsync is batched.
+    2. Restarting a stage on the same input replays the journal, so labeled
+       events are skipped and the session continues at the first unlabeled
+       event. A line cut short by a crash is dropped on replay.
+    3. When the stage has saved its dataset the journal is compacted, i.e.
+       the decisions now live in the dataset and the journal is removed.
+
+"""
+import json
+import os
+import time
+from ae_io import dataset_name, json_default
+
+
+class DecisionJournal:
+    """ append-only record of manual decisions, one json line each """
+    def __init__(self, source_file, stage, fsync_every=25, fsync_seconds=5):
+        self.name = dataset_name(source_file, stage + '_journal', '.jsonl')
+        self.fsync_every = fsync_every
+        self.fsync_seconds = fsync_seconds
+        self.header = {'stage': stage,
+                       'source': os.path.abspath(source_file),
+                       'size': os.path.getsize(source_file)}
+        self.decisions = {}
+        if os.path.exists(self.name):
+            self.replay()
+        else:
+            self.start()
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def start(self):
+        """ new journal holding only the header line """
+        self.file = open(self.name, 'w')
+        self.file.write(json.dumps(self.header) + '\n')
+        self.sync()
+
+    def replay(self):
+        """ read back earlier decisions, then reopen for appending """
+        with open(self.name, 'rb') as f:
+            lines = f.readlines()
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            header = None
+        if header != self.header: # journal of another input, keep it aside
+            os.replace(self.name, self.name + '.old')
+            print(f"journal does not match input, moved to {self.name}.old")
+            self.start()
+            return
+        good_bytes = len(lines[0])
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError: # partial last line of an interrupted write
+                break
+            if not line.endswith(b'\n'):
+                break
+            self.decisions[entry['key']] = entry['value']
+            good_bytes += len(line)
+        self.file = open(self.name, 'a')
+        self.file.truncate(good_bytes)
+        print("journal replayed : {:>5d} decisions from {:s}".format(
+            len(self.decisions), self.name))
+
+    def __contains__(self, key):
+        return key in self.decisions
+
+    def __getitem__(self, key):
+        return self.decisions[key]
+
+    def __len__(self):
+        return len(self.decisions)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record(self, key, value):
+        """ append one decision, fsync every fsync_every decisions or so """
+        self.decisions[key] = value
+        self.file.write(json.dumps({'key': key, 'value': value},
+                                   default=json_default) + '\n')
+        self.file.flush() # survives the program dying, fsync covers the OS
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every or \
+                time.monotonic() - self.last_sync >= self.fsync_seconds:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        """ sync and close, the journal stays on disk for a later resume """
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def compact(self):
+        """ call once the stage output is saved, removes the journal """
+        self.close()
+        os.remove(self.name)
+        print(f"journal compacted : {self.name}")
@@ -0,0 +1,158 @@
+"""
+daly_lab_ae_pipeline
+ae_metrics
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Summary of code:
+    1. RunMetrics records wall time and CPU time of the main stages of a
+       run (file read, dataset build, labeling, save), and the time the
+       user spends on each event in the manual viewers. After each stage
+       the peak RSS of the whole process so far is stored (ru_maxrss, a
+       running maximum over this and all earlier stages), the tracemalloc
+       peak is the one of the stage alone.
+    2. Stages are marked with `with stage('file read'):` in the pipeline
+       code. Outside of an active RunMetrics these hooks do nothing.
+    3. The numbers are written as a JSON sidecar next to the text log
+       (*_metrics.json). cProfile (*_profile.prof) and tracemalloc (traced
+       peak per stage) can be switched on per run.
+
+"""
+import cProfile
+import ctypes
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+import numpy as np
+
+
+ACTIVE = None # RunMetrics of the current run, set by RunMetrics.__enter__
+
+
+def peak_rss():
+    """ peak resident memory of this process in bytes, None if unknown """
+    if sys.platform == 'win32': # no resource module on Windows
+        class Counters(ctypes.Structure):
+            _fields_ = [('cb', ctypes.c_ulong),
+                        ('PageFaultCount', ctypes.c_ulong),
+                        ('PeakWorkingSetSize', ctypes.c_size_t),
+                        ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t),
+                        ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        try:
+            ctypes.windll.psapi.GetProcessMemoryInfo(
+                ctypes.windll.kernel32.GetCurrentProcess(),
+                ctypes.byref(counters), counters.cb)
+        except (AttributeError, OSError):
+            return None
+        return counters.PeakWorkingSetSize
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class RunMetrics:
+    """ per-stage timing / memory of one run, use as a context manager """
+    def __init__(self, script, profile=False, trace_memory=False):
+        self.script = script
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.waits = []
+        self.profiler = cProfile.Profile() if profile else None
+
+    def __enter__(self):
+        global ACTIVE
+        ACTIVE = self
+        self.start = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global ACTIVE
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.wall = time.perf_counter() - self.wall
+        self.cpu = time.process_time() - self.cpu
+        if self.trace_memory:
+            tracemalloc.stop()
+        ACTIVE = None
+
+    @contextmanager
+    def stage(self, name):
+        """ record wall / cpu time and memory of the enclosed block """
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        waits = len(self.waits)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            record = {'stage': name,
+                      'wall_seconds': time.perf_counter() - wall,
+                      'cpu_seconds': time.process_time() - cpu,
+                      # process wide high water mark, not this stage alone
+                      'process_peak_rss_bytes': peak_rss()}
+            if len(self.waits) > waits: # user input inside this stage
+                record['wait_seconds'] = float(np.sum(self.waits[waits:]))
+            if self.trace_memory:
+                record['traced_peak_bytes'] = \
+                    tracemalloc.get_traced_memory()[1]
+            self.stages.append(record)
+
+    def wait_summary(self):
+        """ statistics of the per-event user wait times """
+        if not self.waits:
+            return None
+        waits = np.asarray(self.waits)
+        return {'events': len(waits),
+                'total_seconds': float(waits.sum()),
+                'mean_seconds': float(waits.mean()),
+                'median_seconds': float(np.median(waits)),
+                'p95_seconds': float(np.percentile(waits, 95)),
+                'max_seconds': float(waits.max())}
+
+    def save(self, log_base):
+        """ write log_base_metrics.json (and log_base_profile.prof) """
+        metrics = {'script': self.script,
+                   'started': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                            time.localtime(self.start)),
+                   'wall_seconds': self.wall,
+                   'cpu_seconds': self.cpu,
+                   'process_peak_rss_bytes': peak_rss(),
+                   'stages': self.stages,
+                   'user_wait': self.wait_summary()}
+        if self.profiler is not None:
+            metrics['profile'] = log_base + '_profile.prof'
+            self.profiler.dump_stats(metrics['profile'])
+        with open(log_base + '_metrics.json', 'w') as f:
+            json.dump(metrics, f, indent=1)
+
+        return log_base + '_metrics.json'
+
+
+def stage(name):
+    """ hook around a pipeline stage, no-op when no run is being measured """
+    return ACTIVE.stage(name) if ACTIVE is not None else nullcontext()
+
+
+def record_wait(seconds):
+    """ time the user took on one event in a manual viewer """
+    if ACTIVE is not None:
+        ACTIVE.waits.append(seconds)
@@ -0,0 +1,248 @@
+"""
+daly_lab_ae_pipeline
+ae_viewer
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Summary of code:
+    1. EventViewer keeps one matplotlib figure open for a whole labeling
+       session, each new event only updates the line data and axis limits.
+    2. TOA / peak polarity markers are animated artists drawn with blitting,
+       so moving a marker does not redraw the waveforms.
+    3. Prefetcher prepares the traces of the next events (decimated min/max
+       envelope and axis limits) in a background thread while the current
+       event is on screen.
+    4. Any number of channels: past MAX_ROWS the channels are laid out as
+       small multiples, MAX_ROWS per column, with fonts scaled to the grid
+       and fewer points per trace.
+
+"""
+import numpy as np
+import matplotlib.pyplot as plt
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ae_metrics import record_wait
+
+
+MAX_ROWS = 8 # channels per column of an EventViewer
+
+def decimate_trace(x, y, max_points=2000):
+    """ min/max envelope of a trace with at most max_points points """
+    if len(y) <= max_points:
+        return x, y
+    bins = max_points // 2
+    size = len(y) // bins
+    y_bins = y[:bins*size].reshape(bins, size)
+    x_bins = x[:bins*size].reshape(bins, size)
+    # each bin becomes its min and max, in the order they occur
+    lo, hi = np.argmin(y_bins, axis=1), np.argmax(y_bins, axis=1)
+    first = np.minimum(lo, hi)
+    second = np.maximum(lo, hi)
+    rows = np.arange(bins)
+    idx = np.stack([first, second], axis=1)
+    x_dec = x_bins[rows[:, None], idx].ravel()
+    y_dec = y_bins[rows[:, None], idx].ravel()
+
+    return x_dec, y_dec
+
+
+def trace_points(channel_num):
+    """ points per trace, the whole event stays near 16000 points """
+    return min(2000, max(400, 16000 // max(channel_num, 1)))
+
+
+def prepare_traces(time, waves, max_points=None, pad=0.05):
+    """ decimated (x, y) and y limits for each waveform of an event """
+    if max_points is None:
+        max_points = trace_points(len(waves))
+    traces, ylims = [], []
+    for wave in waves:
+        wave = np.asarray(wave)
+        traces.append(decimate_trace(time, wave, max_points))
+        lo, hi = wave.min(), wave.max()
+        margin = max(hi - lo, 1e-12) * pad
+        ylims.append((lo - margin, hi + margin))
+
+    return traces, ylims
+
+
+class Prefetcher:
+    """ prepares items ahead of time in a background thread """
+    def __init__(self, prepare, keys, depth=3):
+        self.prepare = prepare
+        self.keys = list(keys)
+        self.depth = depth
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.futures = {}
+        for idx in range(min(depth, len(self.keys))):
+            self.schedule(idx)
+
+    def schedule(self, idx):
+        if idx < len(self.keys) and idx not in self.futures:
+            self.futures[idx] = self.pool.submit(self.prepare, self.keys[idx])
+
+    def get(self, idx):
+        """ result for keys[idx], and start preparing the ones after it """
+        self.schedule(idx)
+        for ahead in range(idx+1, idx+1+self.depth):
+            self.schedule(ahead)
+
+        return self.futures.pop(idx).result()
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class EventViewer:
+    """ one reusable figure with a line (and optional marker) per channel,
+        figsize is the size of one column of channels """
+    def __init__(self, channel_num, marker=None, xlabel='Time ($\\mu$s)',
+                 ylabel='Amplitude', xlim=None, fontsize=30,
+                 figsize=(10, 10), max_rows=MAX_ROWS):
+        rows = min(channel_num, max_rows)
+        cols = -(-channel_num // rows) # ceil
+        # fonts sized for 2 channels, smaller as the rows get thinner
+        fontsize = max(8, fontsize * min(1, 2 / rows) ** 0.5)
+        self.fig, axes = plt.subplots(rows, cols,
+                                      figsize=(figsize[0] * cols, figsize[1]),
+                                      sharex=True, squeeze=False)
+        # channels run down the columns, unused axes are hidden
+        self.axes = list(axes.T.ravel()[:channel_num])
+        for ax in axes.T.ravel()[channel_num:]:
+            ax.set_visible(False)
+        self.lines = [ax.plot([], [], 'b')[0] for ax in self.axes]
+        self.marker = marker
+        self.markers, self.labels = [], []
+        for ch_idx, ax in enumerate(self.axes):
+            if ch_idx < rows: # first column only
+                ax.set_ylabel(ylabel, fontsize=fontsize)
+            ax.tick_params(axis='x', labelsize=fontsize)
+            ax.tick_params(axis='y', labelsize=fontsize)
+            if marker is not None: # blitted, not part of the background
+                line = ax.axvline if marker == 'vline' else ax.axhline
+                self.markers.append(line(0, color='b', linestyle='--',
+                                         animated=True, visible=False))
+                self.labels.append(ax.text(0.98, 0.95, '', ha='right',
+                                           va='top', fontsize=fontsize,
+                                           transform=ax.transAxes,
+                                           animated=True))
+        for col in range(cols): # bottom axes in use of each column
+            bottom = self.axes[min((col + 1) * rows, channel_num) - 1]
+            bottom.set_xlabel(xlabel, fontsize=fontsize)
+            bottom.xaxis.set_tick_params(labelbottom=True)
+        if xlim is not None:
+            self.axes[0].set_xlim(xlim)
+        self.xlim = xlim
+        self.title = self.fig.suptitle('', fontsize=fontsize)
+        self.fig.tight_layout()
+        self.background = None
+        self.last_input = None
+        self.event_wait = None # user time on the event on screen
+        canvas = self.fig.canvas
+        canvas.mpl_connect('draw_event', self.on_draw)
+        canvas.mpl_connect('key_press_event', self.on_input)
+        canvas.mpl_connect('button_press_event', self.on_input)
+        manager = plt.get_current_fig_manager()
+        if hasattr(getattr(manager, 'window', None), 'showMaximized'):
+            manager.window.showMaximized()
+        plt.show(block=False)
+
+    def show(self, title, traces, ylims):
+        """ put a new event on screen, traces/ylims from prepare_traces """
+        self.flush_wait()
+        self.event_wait = 0
+        for ax, line, (x, y), ylim in zip(self.axes, self.lines, traces,
+                                          ylims):
+            line.set_data(x, y)
+            ax.set_ylim(ylim)
+        if self.xlim is None and traces:
+            self.axes[0].set_xlim(traces[0][0][0], traces[0][0][-1])
+        for marker, label in zip(self.markers, self.labels):
+            marker.set_visible(False)
+            label.set_text('')
+        self.title.set_text(title)
+        self.fig.canvas.draw_idle()
+        self.fig.canvas.flush_events()
+
+    def on_draw(self, event):
+        """ full redraws refresh the blit background and the markers """
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_animated()
+
+    def draw_animated(self):
+        for artist in self.markers + self.labels:
+            artist.axes.draw_artist(artist)
+
+    def blit(self):
+        """ redraw only the markers on top of the cached background """
+        canvas = self.fig.canvas
+        if self.background is None:
+            canvas.draw()
+            return
+        canvas.restore_region(self.background)
+        self.draw_animated()
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+    def set_marker(self, ch_idx, value, text):
+        marker = self.markers[ch_idx]
+        if self.marker == 'vline':
+            marker.set_xdata([value, value])
+        else:
+            marker.set_ydata([value, value])
+        marker.set_visible(True)
+        self.labels[ch_idx].set_text(text)
+        self.blit()
+
+    def hide_marker(self, ch_idx):
+        self.markers[ch_idx].set_visible(False)
+        self.labels[ch_idx].set_text('')
+        self.blit()
+
+    def flush_wait(self):
+        """ report the user time of the previous event to ae_metrics """
+        if self.event_wait is not None:
+            record_wait(self.event_wait)
+        self.event_wait = None
+
+    def on_input(self, event):
+        self.last_input = event
+        self.fig.canvas.stop_event_loop()
+
+    def wait_input(self):
+        """ block until a key press or mouse click in the figure """
+        self.last_input = None
+        start = time.perf_counter()
+        while self.last_input is None:
+            if not plt.fignum_exists(self.fig.number):
+                raise KeyboardInterrupt('viewer window closed')
+            self.fig.canvas.start_event_loop(timeout=0.5)
+        if self.event_wait is not None:
+            self.event_wait += time.perf_counter() - start
+
+        return self.last_input
+
+    def wait_key(self):
+        """ block until a key is pressed, returns the key """
+        while True:
+            event = self.wait_input()
+            if event.name == 'key_press_event':
+                return event.key
+
+    def wait_button(self):
+        """ like plt.waitforbuttonpress: True for a key, False for a click """
+        return self.wait_input().name == 'key_press_event'
+
+    def select_point(self, ch_idx):
+        """ block until the user clicks inside axes ch_idx, returns (x, y) """
+        while True:
+            event = self.wait_input()
+            if event.name == 'button_press_event' and \
+                    event.inaxes is self.axes[ch_idx]:
+                return event.xdata, event.ydata
+
+    def close(self):
+        self.flush_wait()
+        plt.close(self.fig)
@@ -0,0 +1,238 @@
+"""
+daly_lab_ae_pipeline
+batch_process
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Summary of code:
+    1. Headless processing of many Digital Wave .txt files, no display needed.
+    2. Each file is run through the automatic stages of the pipeline in a
+       process pool: parse, AUTO filtering, automatic TOA and automatic peak
+       polarity (optionally band-pass preprocessing before the pickers, hit
+       features and spectral features after them), writing the same
+       datasets as the interactive scripts.
+    3. Every file gets its own *_log.txt (and *_metrics.json with per-stage
+       timing and memory) next to it, progress is printed as files finish,
+       and a failing file does not stop the rest of the batch.
+    4. With --compress the noise and final .npz datasets are block
+       compressed for archiving (intermediate datasets stay memory mappable).
+
+Example:
+    python batch_process.py "D:/campaign/ae/*.txt" --toa AIC --workers 8
+
+"""
+import matplotlib
+matplotlib.use('Agg') # headless, must come before pyplot is imported
+import argparse
+import datetime
+import glob
+import io
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from filter_ae import filter_ae_txt_file
+from compute_toa import compute_toa
+from compute_peak_polarity import compute_peak_polarity
+from compute_features import compute_features
+from compute_spectra import compute_spectra
+from preprocess import preprocess
+from ae_io import compress_dataset, save_dataset
+from ae_metrics import RunMetrics, stage
+
+
+VERSION = '1.0'
+HEADLESS_FILTER_METHODS = ('AUTO',) # MANUAL, HYBRID, GALLERY open viewers
+
+
+def find_txt_files(paths):
+    """ expand directories and glob patterns into a sorted list of .txt """
+    txt_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            txt_files += glob.glob(os.path.join(path, '*.txt'))
+        else:
+            txt_files += glob.glob(path)
+    # skip logs written by earlier runs of the pipeline
+    txt_files = [f for f in txt_files if not f.endswith('_log.txt')]
+
+    return sorted(set(txt_files))
+
+
+def process_ae_file(ae_file, filter_method='AUTO', toa_method='AIC',
+                    peak_polarity_method='AUTO', fmt='.npz', use_cache=False,
+                    features=False, band=None, compress=False,
+                    spectra=False):
+    """ runs the automatic stages on one file, returns (ok, seconds, log) """
+    if filter_method not in HEADLESS_FILTER_METHODS: # would wait for input
+        raise ValueError(f'filter method {filter_method} needs a user, '
+                         f'batch runs {", ".join(HEADLESS_FILTER_METHODS)}')
+    start = time.perf_counter()
+    output_buffer = io.StringIO()
+    ok = True
+    metrics = RunMetrics('batch_process')
+    with redirect_stdout(output_buffer), metrics:
+        current_datetime = datetime.datetime.now()
+        print(current_datetime)
+        print('daly_lab_ae_pipeline')
+        print('batch_process')
+        print(f"version: {VERSION}")
+        print('')
+        print('')
+
+        print("INPUTS")
+        print(f'selected .txt file: {ae_file}')
+        print(f'selected filter method: {filter_method}')
+        print(f'selected TOA method: {toa_method}')
+        print(f'selected peak polarity method: {peak_polarity_method}')
+        print(f'compute features: {features}')
+        print(f'compute spectral features: {spectra}')
+        print(f'band-pass (fraction of fs): {band}')
+        print(f'compress final datasets: {compress}')
+        print('')
+        try:
+            print('FILTERING')
+            noise_dataset, filter_dataset = filter_ae_txt_file(
+                ae_file, method=filter_method, use_cache=use_cache)
+            print('')
+
+            print('OUTPUT')
+            with stage('save'):
+                noise_file = save_dataset(ae_file, noise_dataset, 'noise',
+                                          fmt)
+                dataset_file = save_dataset(ae_file, filter_dataset, 'filter',
+                                            fmt)
+            del noise_dataset, filter_dataset
+            print('')
+
+            waves = 'waves'
+            if band is not None: # pickers work on the band-passed waves
+                print('PREPROCESSING')
+                dataset_file = preprocess(dataset_file, band=band)
+                waves = 'waves_filtered'
+                print('')
+
+            if toa_method is not None:
+                print('TIME-OF-ARRIVAL')
+                dataset_file = compute_toa(dataset_file, method=toa_method,
+                                           waves=waves)
+                print('')
+
+                if peak_polarity_method is not None:
+                    print('PEAK POLARITY')
+                    dataset_file = compute_peak_polarity(
+                        dataset_file, method=peak_polarity_method,
+                        waves=waves)
+                    print('')
+
+            if features:
+                print('FEATURES')
+                dataset_file = compute_features(dataset_file)
+                print('')
+
+            if spectra:
+                print('SPECTRA')
+                dataset_file = compute_spectra(dataset_file, waves)
+                print('')
+
+            if compress and fmt == '.npz':
+                print('COMPRESSION')
+                with stage('compression'):
+                    compress_dataset(noise_file)
+                    compress_dataset(dataset_file)
+                print('')
+        except Exception: # keep the batch going, the log has the details
+            ok = False
+            print('FAILED')
+            print(traceback.format_exc())
+
+        print('PROGRAM END')
+
+    log_base = os.path.splitext(ae_file)[0] + '_' + \
+        current_datetime.strftime("%Y-%m-%d_%H-%M-%S")
+    log_name = log_base + '_log.txt'
+    with open(log_name, 'w') as file:
+        file.write(output_buffer.getvalue())
+    metrics.save(log_base)
+
+    return ok, time.perf_counter() - start, log_name
+
+
+def process_batch(txt_files, workers=None, **kwargs):
+    """ process files in parallel, prints progress, returns failed files """
+    workers = workers or os.cpu_count()
+    failed = []
+    start = time.perf_counter()
+    print(f'processing {len(txt_files)} files on {workers} workers')
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_ae_file, ae_file, **kwargs): ae_file
+                   for ae_file in txt_files}
+        for done, future in enumerate(as_completed(futures), start=1):
+            ae_file = futures[future]
+            try:
+                ok, seconds, log_name = future.result()
+            except Exception as e: # worker died, e.g. out of memory
+                ok, seconds, log_name = False, 0, repr(e)
+            if not ok:
+                failed.append(ae_file)
+            print("[{:>4d}/{:>4d}] {:s}  {:s}  ({:.1f} s)  {:s}".format(
+                done, len(txt_files), 'OK    ' if ok else 'FAILED',
+                ae_file, seconds, log_name), flush=True)
+    print("batch completed in {:.1f} s, {:d} failed".format(
+        time.perf_counter() - start, len(failed)))
+    for ae_file in failed:
+        print(f'failed: {ae_file}')
+
+    return failed
+
+
+def none_if_off(method):
+    """ command line 'NONE' turns a stage off """
+    return None if method.upper() == 'NONE' else method.upper()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Headless batch processing of Digital Wave .txt files')
+    parser.add_argument('paths', nargs='+',
+                        help='directories and/or glob patterns of .txt files')
+    parser.add_argument('--filter', default='AUTO', type=str.upper,
+                        choices=HEADLESS_FILTER_METHODS,
+                        help='filter method (AUTO)')
+    parser.add_argument('--toa', default='AIC',
+                        help='TOA method: AIC, STALTA or NONE')
+    parser.add_argument('--peak-polarity', default='AUTO',
+                        help='peak polarity method: AUTO or NONE')
+    parser.add_argument('--bandpass', type=float, nargs=2, default=None,
+                        metavar=('LOW', 'HIGH'),
+                        help='band-pass before picking, fractions of fs')
+    parser.add_argument('--features', action='store_true',
+                        help='add AE hit feature columns (compute_features)')
+    parser.add_argument('--spectra', action='store_true',
+                        help='add spectral feature columns (compute_spectra)')
+    parser.add_argument('--format', default='.npz', choices=['.npz', '.json'])
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes, defaults to the number of cores')
+    parser.add_argument('--use-cache', action='store_true',
+                        help='reuse parsed waveforms from ae_cache')
+    parser.add_argument('--compress', action='store_true',
+                        help='block compress the noise and final .npz')
+    args = parser.parse_args()
+
+    txt_files = find_txt_files(args.paths)
+    failed = process_batch(txt_files, workers=args.workers,
+                           filter_method=args.filter,
+                           toa_method=none_if_off(args.toa),
+                           peak_polarity_method=none_if_off(
+                               args.peak_polarity),
+                           fmt=args.format,
+                           use_cache=args.use_cache,
+                           features=args.features,
+                           band=args.bandpass,
+                           compress=args.compress,
+                           spectra=args.spectra)
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,224 @@
+"""
+daly_lab_ae_pipeline
+benchmark
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Summary of code:
+    1. Synthetic Digital Wave files (synthetic_ae.py) are written once per
+       scale (events x channels x sig_length) into a data folder and reused.
+    2. Every pipeline stage is timed on each scale: read_ae_file,
+       create_dataset, save_dict_as_json / load_json_file, .npz save / load,
+       AUTO filter features, AIC and STA/LTA TOA pickers, automatic peak
+       polarity, hit features, localization and similarity. Wall time, CPU time and
+       peak traced memory (tracemalloc, separate run) are recorded.
+    3. Results are saved as JSON with the git commit and library versions,
+       and can be compared against an earlier result file.
+
+Example:
+    python benchmark.py --events 100 1000 10000 --compare old_results.json
+
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from contextlib import redirect_stdout
+from synthetic_ae import write_ae_txt
+from filter_ae import (create_dataset, event_features, read_ae_file,
+                       save_dict_as_json)
+from compute_toa import automatic_toa_selection
+from compute_peak_polarity import automatic_peak_polarity_selection
+from compute_features import hit_features
+from localize import localize_events
+from similarity import top_k_similarity
+from ae_io import load_dataset, save_dataset
+
+
+VERSION = '1.0'
+# stages skipped above this many events (json of 1e5 events is many GB)
+STAGE_MAX_EVENTS = {'save_dict_as_json': 10**4,
+                    'load_json_file': 10**4}
+# all event pairs grow as events**2, similarity is timed on this many
+SIMILARITY_EVENTS = 500
+
+
+def git_commit():
+    """ commit of the code being benchmarked, None outside a git checkout """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(stage, memory=True):
+    """ wall / cpu seconds of stage(), peak traced bytes from a second run """
+    with redirect_stdout(io.StringIO()): # stage prints are not timed output
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = stage()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        peak = None
+        if memory:
+            del result
+            tracemalloc.start()
+            result = stage()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    return result, {'seconds': wall, 'cpu_seconds': cpu, 'peak_bytes': peak}
+
+
+def synthetic_file(data_dir, event_num, channel_num, sig_length):
+    """ synthetic .txt of this scale, written on first use """
+    ae_file = os.path.join(data_dir, 'synthetic_{:d}ev_{:d}ch_{:d}.txt'.format(
+        event_num, channel_num, sig_length))
+    if not os.path.exists(ae_file):
+        os.makedirs(data_dir, exist_ok=True)
+        write_ae_txt(ae_file, event_num, channel_num, sig_length)
+
+    return ae_file
+
+
+def benchmark_scale(ae_file, memory=True, limits=STAGE_MAX_EVENTS):
+    """ times every stage on one synthetic file, returns list of results """
+    results = []
+
+    def run(name, stage, event_num):
+        if event_num > limits.get(name, np.inf):
+            print("{:<28s} skipped above {:d} events".format(name,
+                                                             limits[name]))
+            return None
+        result, timing = measure(stage, memory)
+        timing.update({'stage': name, 'events': event_num,
+                       'events_per_second': event_num /
+                       max(timing['seconds'], 10**-9)})
+        results.append(timing)
+        print("{:<28s} {:>9.3f} s  {:>10.0f} events/s  {:>9s} MB".format(
+            name, timing['seconds'], timing['events_per_second'],
+            '-' if timing['peak_bytes'] is None else
+            '{:.1f}'.format(timing['peak_bytes'] / 2**20)), flush=True)
+        return result
+
+    with open(ae_file) as f: # number of events from the header line
+        event_num = int(f.readline().split()[1])
+    signals, ev, fs, channel_num, sig_length = run(
+        'read_ae_file', lambda: read_ae_file(ae_file), event_num)
+    dt = 1 / fs
+    dataset = run('create_dataset',
+                  lambda: create_dataset(ae_file, ev, signals, fs, sig_length),
+                  event_num)
+    json_file = os.path.splitext(ae_file)[0] + '_bench.json'
+    run('save_dict_as_json',
+        lambda: save_dict_as_json(ae_file, dataset, 'bench'), event_num)
+    if os.path.exists(json_file):
+        run('load_json_file', lambda: load_dataset(json_file), event_num)
+        os.remove(json_file)
+    npz_file = run('save_dataset_npz',
+                   lambda: save_dataset(ae_file, dataset, 'bench'), event_num)
+    run('load_dataset_npz', lambda: load_dataset(npz_file), event_num)
+    os.remove(npz_file)
+    run('event_features', lambda: event_features(signals, fs), event_num)
+    waves = dataset['waves']
+    toa, _ = run('toa_aic',
+                 lambda: automatic_toa_selection(waves, 'AIC', dt), event_num)
+    run('toa_stalta',
+        lambda: automatic_toa_selection(waves, 'STALTA', dt), event_num)
+    run('peak_polarity_auto',
+        lambda: automatic_peak_polarity_selection(waves, toa, dt), event_num)
+    run('hit_features', lambda: hit_features(waves, toa, dt), event_num)
+    # two sensors on a line, else sensors spread over a 100 mm plate
+    positions = np.random.default_rng(0).uniform(
+        0, 100, (channel_num, 1 if channel_num == 2 else 2))
+    run('localize', lambda: localize_events(
+        toa.reshape(channel_num, event_num).T, positions, 5.0), event_num)
+    similarity_events = min(event_num, SIMILARITY_EVENTS)
+    run('similarity', lambda: top_k_similarity(
+        waves.reshape(channel_num, event_num, -1)[:, :similarity_events]
+        .transpose(1, 0, 2)), similarity_events)
+    for result in results:
+        result.update({'channels': channel_num, 'sig_length': sig_length})
+
+    return results
+
+
+def compare_results(results, baseline_file):
+    """ prints time ratios against an earlier benchmark result file """
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    old = {(r['stage'], r['events'], r['channels'], r['sig_length']): r
+           for r in baseline['results']}
+    print('')
+    print(f"compared with {baseline_file} (commit {baseline.get('commit')})")
+    for r in results:
+        key = (r['stage'], r['events'], r['channels'], r['sig_length'])
+        if key not in old:
+            continue
+        ratio = r['seconds'] / max(old[key]['seconds'], 10**-9)
+        print("{:<28s} {:>8d} ev  {:>9.3f} s -> {:>9.3f} s  x{:.2f}{:s}".format(
+            r['stage'], r['events'], old[key]['seconds'], r['seconds'], ratio,
+            '  SLOWER' if ratio > 1.2 else ''))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark every pipeline stage on synthetic AE files')
+    parser.add_argument('--events', type=int, nargs='+',
+                        default=[100, 1000, 10000],
+                        help='events per synthetic file (up to 1e6)')
+    parser.add_argument('--channels', type=int, nargs='+', default=[2])
+    parser.add_argument('--sig-length', type=int, default=1024)
+    parser.add_argument('--data-dir', default=os.path.join(
+        tempfile.gettempdir(), 'ae_benchmark'),
+        help='where the synthetic .txt files are kept between runs')
+    parser.add_argument('--output', default=None,
+                        help='result .json, default benchmark_<date>.json')
+    parser.add_argument('--compare', default=None,
+                        help='earlier result .json to compare against')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the tracemalloc run of each stage')
+    parser.add_argument('--no-limits', action='store_true',
+                        help='also run json stages on large files')
+    args = parser.parse_args()
+
+    current_datetime = datetime.datetime.now()
+    results = []
+    for channel_num in args.channels:
+        for event_num in args.events:
+            print('')
+            print("SCALE  {:d} events  {:d} channels  {:d} samples".format(
+                event_num, channel_num, args.sig_length))
+            ae_file = synthetic_file(args.data_dir, event_num, channel_num,
+                                     args.sig_length)
+            results += benchmark_scale(ae_file, not args.no_memory,
+                                       {} if args.no_limits else
+                                       STAGE_MAX_EVENTS)
+
+    output = args.output or 'benchmark_' + \
+        current_datetime.strftime("%Y-%m-%d_%H-%M-%S") + '.json'
+    with open(output, 'w') as f:
+        json.dump({'version': VERSION,
+                   'commit': git_commit(),
+                   'created': current_datetime.isoformat(),
+                   'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'platform': platform.platform(),
+                   'cpu_count': os.cpu_count(),
+                   'results': results}, f, indent=1)
+    print('')
+    print(f'benchmark results saved : {output}')
+    if args.compare:
+        compare_results(results, args.compare)
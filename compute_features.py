@@ -0,0 +1,155 @@
+"""
+daly_lab_ae_pipeline
+compute_features
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Run this code after computing the TOAs (features are also computed without
+a toa column, the first threshold crossing is then used as the arrival).
+
+Summary of code:
+    1. User prompted to select ae .npz/.json file of filtered waveforms
+    2. Standard AE hit features are computed for all waveforms at once over
+       the (n, sig_length) waves array: peak amplitude in dB, energy, RMS,
+       threshold-crossing counts, rise time, duration and counts-to-peak
+    3. Dataset is saved with one new column per feature
+
+"""
+import numpy as np
+import io
+import os
+from contextlib import redirect_stdout
+import datetime
+import time
+from ae_dataset import AEDataset
+from ae_metrics import RunMetrics, stage
+from compute_toa import select_json_file
+
+
+FEATURE_THRESHOLD = 0.01 # V, same crossing level as AUTO filtering
+REFERENCE_VOLTAGE = 10**-6 # V, 0 dB of the amplitude in dB (dB_AE)
+FEATURE_KEYS = ['amplitude_db', 'energy', 'rms', 'counts', 'rise_time',
+                'duration', 'counts_to_peak']
+
+
+def hit_features(signals, toa=None, dt=10**-7, threshold=FEATURE_THRESHOLD,
+                 chunk=4096):
+    """ AE hit features of every waveform, batched over the waves array.
+        Times in us, energy in V^2 us, amplitude in dB re REFERENCE_VOLTAGE.
+        The arrival is the toa (us) when known, else the first crossing """
+    signals = np.asarray(signals, dtype=np.float64)
+    n, sig_length = signals.shape
+    dt_us = dt * 10**6
+    features = {key: np.zeros(n, dtype=np.int64 if 'counts' in key
+                              else np.float64) for key in FEATURE_KEYS}
+    if toa is None:
+        toa = np.zeros(n)
+    toa_idx = np.round(np.asarray(toa, dtype=np.float64) / dt_us).astype(int)
+    samples = np.arange(sig_length)
+    for start in range(0, n, chunk): # bounds memory
+        waves = signals[start:start+chunk]
+        stop = start + len(waves)
+        rectified = np.abs(waves)
+        peak_idx = np.argmax(rectified, axis=1)
+        peak = rectified[np.arange(len(waves)), peak_idx]
+        # first and last threshold crossing of the rectified waveform
+        above = rectified > threshold
+        crossed = above.any(axis=1)
+        first = np.argmax(above, axis=1)
+        last = sig_length - 1 - np.argmax(above[:, ::-1], axis=1)
+        onset = np.where(toa_idx[start:stop] > 0, toa_idx[start:stop],
+                         np.where(crossed, first, peak_idx))
+        # positive-going crossings, counted from the onset
+        rising = (waves[:, 1:] > threshold) & (waves[:, :-1] <= threshold)
+        rising &= samples[None, 1:] >= onset[:, None]
+        to_peak = rising & (samples[None, 1:] <= peak_idx[:, None])
+
+        features['amplitude_db'][start:stop] = 20 * np.log10(
+            np.maximum(peak, 10**-12) / REFERENCE_VOLTAGE)
+        features['energy'][start:stop] = np.sum(waves**2, axis=1) * dt_us
+        features['rms'][start:stop] = np.sqrt(np.mean(waves**2, axis=1))
+        features['counts'][start:stop] = np.sum(rising, axis=1)
+        features['counts_to_peak'][start:stop] = np.sum(to_peak, axis=1)
+        features['rise_time'][start:stop] = np.clip(
+            peak_idx - onset, 0, None) * dt_us
+        features['duration'][start:stop] = np.where(
+            crossed, np.clip(last - onset, 0, None), 0) * dt_us
+
+    return features
+
+
+def compute_features(ae_dataset_file, fmt=None, dt=None,
+                     threshold=FEATURE_THRESHOLD):
+    """ Add AE hit feature columns to a dataset, dt from the dataset fs if
+        not given """
+    with stage('file read'):
+        dataset = AEDataset.load(ae_dataset_file)
+    dt = dt or dataset.dt()
+    toa = dataset['toa'] if 'toa' in dataset else None
+    if toa is None:
+        print('no toa column, arrival taken at the first threshold crossing')
+
+    start = time.perf_counter()
+    with stage('features'):
+        features = hit_features(dataset['waves'], toa, dt, threshold)
+    seconds = time.perf_counter() - start
+    print("features of {:>5d} waveforms in {:.3f} s ({:.0f} hits/s)".format(
+        len(dataset), seconds, len(dataset) / max(seconds, 10**-9)))
+    for key, value in features.items():
+        dataset[key] = value
+
+    if fmt is None: # keep the format of the input dataset
+        fmt = os.path.splitext(ae_dataset_file)[1]
+    with stage('save'):
+        features_file = dataset.save(ae_dataset_file, 'features', fmt)
+
+    return features_file
+
+
+if __name__ == '__main__':
+
+    VERSION='1.0'
+    THRESHOLD = FEATURE_THRESHOLD # V
+    PROFILE = False # cProfile the run, *_profile.prof next to the log
+    TRACE_MEMORY = False # tracemalloc peak per stage in *_metrics.json
+
+    # Create a StringIO object to capture the output
+    output_buffer = io.StringIO()
+
+    # Redirect the standard output to the buffer, time the stages
+    metrics = RunMetrics('compute_features', PROFILE, TRACE_MEMORY)
+    with redirect_stdout(output_buffer), metrics:
+        # header
+        current_datetime = datetime.datetime.now()
+        print(current_datetime)
+        print('daly_lab_ae_pipeline')
+        print('compute_features')
+        print(f"version: {VERSION}")
+        print("Nick Tulshibagwale")
+        print("Daly Lab, Mechanical Eng. Department")
+        print("University of California, Santa Barbara")
+        print('')
+        print('')
+
+        print("INPUTS")
+        ae_dataset_file = select_json_file()
+        print(f'selected dataset file: {ae_dataset_file}')
+        print(f'selected threshold: {THRESHOLD} V')
+        print('')
+
+        print('FEATURES')
+        features_dataset = compute_features(ae_dataset_file,
+                                            threshold=THRESHOLD)
+        print('')
+
+
+        print('PROGRAM END')
+
+    # Output log
+    captured_output = output_buffer.getvalue()
+    log_name = current_datetime.strftime("%Y-%m-%d_%H-%M-%S")
+    with open(log_name+'_log.txt', 'w') as file:
+        file.write(captured_output)
+    metrics.save(log_name) # timing / memory sidecar of the log
@@ -9,8 +9,9 @@ Date: February 02, 2024
 Run this code after computing the TOAs.
 
 Summary of code:
-    1. User prompted to select ae .json file of filtered waveforms
-    2. User loops through all waveforms and selects peak polarity
+    1. User prompted to select ae .npz/.json file of filtered waveforms
+    2. User loops through all waveforms and selects peak polarity, or it is
+       found automatically as the first significant extremum after the TOA
     3. Dataset is saved along with Peak Polarity value
 
 """
@@ -20,131 +21,153 @@ from tkinter import filedialog
 from tkinter import Tk
 import json 
 import io
+import os
 from contextlib import redirect_stdout
 import datetime
+import time
+from ae_io import json_default
+from ae_dataset import AEDataset
+from ae_journal import DecisionJournal
+from ae_metrics import RunMetrics, stage
+from ae_viewer import EventViewer, Prefetcher, prepare_traces
 
-def load_json_file(json_file):
-    """ Loads in .json file from file path. """
-    print(f"Loading in Dataset from {json_file}")
-    with open(json_file) as file:
-        data = json.load(file)
-    for key in data.keys():
-        data[key]  = np.array(data[key])
-    print("Successfully loaded in .json file.\n")
-    
-    return data
 
 def tellme(s): # print statements to user for instructions
     plt.title(s, fontsize=30)
     plt.draw()
     
         
-def manual_peak_polarity_selection(signals, event, sensor):
-    """ User selects Peak Polarity on all signals """
-    peak_polarity=[]
+def manual_peak_polarity_selection(dataset, journal=None, waves='waves'):
+    """ User selects Peak Polarity on all signals, waves column to show """
+    signals = dataset[waves]
+    time_us = dataset.time(waves) # from the fs of the dataset
     
     # create peak polarity array of same dimension 
     peak_polarity=np.zeros(len(signals))
 
-    for ii, ev in enumerate(list(set(event))): # loop through all events once
-        # obtain the indices for that event
-        indices = [jj for jj,x in enumerate(event) if x == ev]
-                            
-        plt.figure(figsize=(10,10))
-        ax1 = plt.subplot(211)
-        ax1.plot(TIME,signals[indices[0]],'b')
-        ax1.set_xlabel('Time ($\mu$s)', fontsize=30)
-        ax1.set_ylabel('Amplitude', fontsize=30)
-        ax1.tick_params(axis='x', labelsize=30) 
-        ax1.tick_params(axis='y', labelsize=30) 
-        #ax1.set_xlim([TIME[0],TIME[270]])
-        #ax1.set_ylim([min(signals[indices[0]][0:270])-0.003,
-        #              max(signals[indices[0]][0:270])+0.003])
-
-        #minimum = min(signals[indices[0]][100:300])
-        #maximum = min(signals[indices[0]][100:300])
-
-                              
-        #ax1.set_ylim([,0.03])
-        
-        ax2 = plt.subplot(212)
-        ax2.plot(TIME,signals[indices[1]],'b')
-        ax2.set_xlabel('Time ($\mu$s)', fontsize=30)
-        ax2.set_ylabel('Amplitude', fontsize=30)
-        ax2.tick_params(axis='x', labelsize=30) 
-        ax2.tick_params(axis='y', labelsize=30) 
-        #ax2.set_xlim([TIME[0],TIME[270]])
-        #ax2.set_ylim([min(signals[indices[1]][0:270])-0.003,
-        #              max(signals[indices[1]][0:270])+0.003])
-        plt.tight_layout()
-        
-        figManager = plt.get_current_fig_manager()
-        figManager.window.showMaximized() 
-        
-        for index, ax in enumerate([ax1, ax2]):
-            plt.sca(ax)  # Set the current axis for ginput
-        
-            # Compute Peak Polarity for the current subplot
-            while True:
-                pts = []
-                while len(pts) < 1:
-                    #tellme('Select signal start time with mouse')
-                    tellme("")
-                    pts = np.asarray(plt.ginput(1, timeout=-1))
+    # events labeled before a restart come from the journal, not the screen
+    pending = []
+    for ev in dataset.events:
+        if journal is not None and int(ev) in journal:
+            peak_polarity[dataset.event_rows(ev)] = journal[int(ev)]
+        else:
+            pending.append(ev)
+    if journal is not None:
+        print("num events from journal : {:>5d}".format(
+            len(dataset.events) - len(pending)))
+    if not pending:
+        return peak_polarity
+
+    # one figure for the whole session, next events prepared in background
+    viewer = EventViewer(len(dataset.sensors), marker='hline')
+    prefetcher = Prefetcher(lambda ev: prepare_traces(
+        time_us, signals[dataset.event_rows(ev)]), pending)
+    try:
+        for ii, ev in enumerate(pending): # loop through all events once
+            # obtain the indices for that event, ordered by sensor
+            indices = dataset.event_rows(ev)
+            viewer.show(f'Event: {ev}', *prefetcher.get(ii))
         
-                w_start = pts[:, 1][0]
-                ph = ax.axhline(w_start, color='b', linestyle='--', label=f'amp = {np.round(w_start, 3)} V')
-                ax.legend(fontsize=34)
-                #tellme('Hit spacebar to accept. Left click to repeat selection.')
-                tellme("")
-                if plt.waitforbuttonpress():
-                    break
-                ph.remove()
-
-            # if user selected super far to the left
-            #if w_start < 2:
-            #    peak_polarity[indices[index]]=(0) # indicating unknown start value
-            #else:
-            peak_polarity[indices[index]]=(w_start)
-            print("event : {:>5d}  channel : {:>5d}  peak_polarity : {:>5f}".format(ev, index+1, w_start))
+            for index, row in enumerate(indices):
+                # Compute Peak Polarity for the current subplot
+                while True:
+                    _, w_start = viewer.select_point(index)
+                    viewer.set_marker(index, w_start,
+                                      f'amp = {np.round(w_start, 3)} V')
+                    #Hit any key to accept. Left click to repeat selection.
+                    if viewer.wait_button():
+                        break
+                    viewer.hide_marker(index)
+
+                peak_polarity[row]=(w_start)
+                print("event : {:>5d}  channel : {:>5d}  peak_polarity : {:>5f}".format(ev, index+1, w_start))
+            if journal is not None: # on disk before the next event
+                journal.record(int(ev), peak_polarity[indices])
+    finally: # closed window / Ctrl-C, recorded events stay on disk
+        prefetcher.close()
+        viewer.close()
+        if journal is not None:
+            journal.close()
             
-        plt.close('all')
-            
-    peak_polarity=list(peak_polarity)
+    return peak_polarity
+    
+   
+def automatic_peak_polarity_selection(signals, toa, dt=10**-7, k=5,
+                                      chunk=4096):
+    """ First significant extremum after TOA, all waveforms at once, 0
+        where the toa is unknown (0) """
+    signals = np.asarray(signals, dtype=np.float64)
+    toa_idx = np.round(np.asarray(toa) * 10**-6 / dt).astype(int)
+    peak_polarity = np.zeros(len(signals))
+    for start in range(0, len(signals), chunk): # bounds memory
+        waves = signals[start:start+chunk]
+        onset = np.clip(toa_idx[start:start+chunk], 0, waves.shape[1]-1)
+        rows = np.arange(len(waves))
+        samples = np.arange(waves.shape[1])[None, :]
+        # no arrival to measure from, same as the manual convention
+        known = toa_idx[start:start+chunk] > 0
+        # noise floor from the pre-trigger window
+        window = np.maximum(onset, 1)
+        pre = samples < window[:, None]
+        noise = np.sqrt(np.sum(waves**2 * pre, axis=1) / window)
+        # first threshold crossing at or after the arrival
+        above = (np.abs(waves) > k * noise[:, None]) & \
+            (samples >= onset[:, None])
+        found = above.any(axis=1) & known
+        first = np.argmax(above, axis=1)
+        # follow the crossing up to its extremum (slope changes sign)
+        sign = np.sign(waves[rows, first])
+        slope = np.diff(waves, axis=1, append=waves[:, -1:]) * sign[:, None]
+        turn = (slope <= 0) & (samples >= first[:, None])
+        extremum = np.argmax(turn, axis=1)
+        peak_polarity[start:start+chunk] = np.where(
+            found, waves[rows, extremum], 0)
     
     return peak_polarity
     
    
-def compute_peak_polarity(ae_json_file, method='MANUAL'):
-    """ Determine peak polarity for AE waveforms """
-    dataset = load_json_file(ae_json_file)
-    waves=dataset['waves']
-    waves = [list(waveform) for waveform in waves]
-    event=dataset['event'].tolist()
-    parent_txt=dataset['parent_txt'].tolist()
-    sensor=dataset['sensor'].tolist()
-    toa=dataset['toa'].tolist()
-    if method == 'MANUAL':
-        peak_polarity=manual_peak_polarity_selection(waves, event, sensor)
+def compute_peak_polarity(ae_dataset_file, method='MANUAL', fmt=None,
+                          dt=None, waves='waves'):
+    """ Determine peak polarity for AE waveforms, on the waves column
+        ('waves' raw, 'waves_filtered' from preprocess.py), dt from the
+        dataset fs if not given """
+    with stage('file read'):
+        dataset = AEDataset.load(ae_dataset_file)
+    dt = dt or dataset.dt()
+    with stage('peak polarity labeling'):
+        if method == 'MANUAL':
+            # manual picks survive a crash, a rerun resumes where it stopped
+            journal = DecisionJournal(ae_dataset_file, 'peak_polarity')
+            peak_polarity=manual_peak_polarity_selection(dataset, journal,
+                                                         waves)
+        elif method == 'AUTO': # driven by the toa picked in the previous stage
+            start = time.perf_counter()
+            peak_polarity=automatic_peak_polarity_selection(dataset[waves],
+                                                            dataset['toa'], dt)
+            print("AUTO peak polarity of {:>5d} waveforms in {:.3f} s".format(
+                len(peak_polarity), time.perf_counter() - start))
+            print("num without peak : {:>5d}".format(
+                np.sum(peak_polarity == 0)))
     
-    peak_polarity_dataset={'waves': waves,
-                             'sensor': sensor,
-                             'event': event,
-                             'parent_txt': parent_txt,     
-                             'toa': toa,
-                             'peak_polarity': peak_polarity}
+    dataset['peak_polarity'] = peak_polarity
     
-    save_dict_as_json(ae_json_file, peak_polarity_dataset, 'peak_polarity')
+    if fmt is None: # keep the format of the input dataset
+        fmt = os.path.splitext(ae_dataset_file)[1]
+    with stage('save'):
+        peak_polarity_file = dataset.save(ae_dataset_file, 'peak_polarity',
+                                          fmt)
+    if method == 'MANUAL': # picks are in the saved dataset now
+        journal.compact()
     
-    return
+    return peak_polarity_file
 
 def select_json_file():
     """ User selects a .json file to load in """
     # Create a Tkinter window for file selection
     root = Tk()
     root.filename = filedialog.askopenfilename(
-        title="Select a .json file", filetypes=(("Json files", "*.json"),
-                                               ("All files", "*.*")))
+        title="Select a dataset file", filetypes=(("Datasets", "*.npz *.json"),
+                                                  ("All files", "*.*")))
     json_file=root.filename
     root.destroy()
         
@@ -154,7 +177,7 @@ def save_dict_as_json(ae_json_file, dataset, label):
     """ save dictionary as .json file """
     dataset_name = ae_json_file.replace('.json', '_' + label + '.json')
     with open(dataset_name, "w") as outfile:
-        json.dump(dataset, outfile)
+        json.dump(dataset, outfile, default=json_default)
     print("dataset .json saved  : {:>5s}".format(dataset_name))
 
     return
@@ -162,18 +185,18 @@ def save_dict_as_json(ae_json_file, dataset, label):
 
 if __name__ == '__main__':
     
-    SIG_LEN = 1024
-    DT = 10**-7
-    DURATION = SIG_LEN*DT*10**6 # convert to us
-    TIME = np.linspace(0,DURATION,SIG_LEN) # discretization of signal time
     VERSION='1.0'
-    METHOD = 'MANUAL'
+    METHOD = 'MANUAL' # 'MANUAL' or 'AUTO'
+    WAVES = 'waves' # or 'waves_filtered' after preprocess.py
+    PROFILE = False # cProfile the run, *_profile.prof next to the log
+    TRACE_MEMORY = False # tracemalloc peak per stage in *_metrics.json
 
     # Create a StringIO object to capture the output
     output_buffer = io.StringIO()
     
-    # Redirect the standard output to the buffer
-    with redirect_stdout(output_buffer):
+    # Redirect the standard output to the buffer, time the stages
+    metrics = RunMetrics('compute_peak_polarity', PROFILE, TRACE_MEMORY)
+    with redirect_stdout(output_buffer), metrics:
         # header
         current_datetime = datetime.datetime.now()
         print(current_datetime)
@@ -187,14 +210,15 @@ if __name__ == '__main__':
         print('')
         
         print("INPUTS")
-        ae_json_file = select_json_file()
-        print(f'selected .json file: {ae_json_file}')
+        ae_dataset_file = select_json_file()
+        print(f'selected dataset file: {ae_dataset_file}')
         print(f'selected peak polarity method: {METHOD}')
         print('')
            
         print('PEAK POLARITY')
-        peak_polarity_dataset = compute_peak_polarity(ae_json_file, 
-                                                      method='MANUAL')
+        peak_polarity_dataset = compute_peak_polarity(ae_dataset_file, 
+                                                      method=METHOD,
+                                                      waves=WAVES)
         print('')
         
         
@@ -205,6 +229,7 @@ if __name__ == '__main__':
     log_name = current_datetime.strftime("%Y-%m-%d_%H-%M-%S")
     with open(log_name+'_log.txt', 'w') as file:
         file.write(captured_output)
+    metrics.save(log_name) # timing / memory sidecar of the log
     
    
    
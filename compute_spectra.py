@@ -0,0 +1,318 @@
+"""
+daly_lab_ae_pipeline
+compute_spectra
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Run this code after filtering (or preprocessing).
+
+Summary of code:
+    1. User prompted to select ae .npz/.json file of filtered waveforms
+    2. The rFFT magnitude spectrum of all waveforms is computed chunk by
+       chunk, and from it the peak frequency, frequency centroid and the
+       partial power in each of PARTIAL_POWER_BANDS (fraction of the total)
+    3. Optionally the STFT magnitude or a Morlet wavelet scalogram (CWT by
+       FFT, no PyWavelets needed) of every waveform, computed in chunks
+       along the waveform axis so memory stays bounded
+    4. Spectra, STFTs and scalograms are written as .npy files to the
+       spectra folder of the ae_cache directory, keyed by a hash of the
+       waveforms and the parameters, and memory mapped on the next call.
+       They count against the size bound of the cache (ae_cache eviction)
+    5. Dataset is saved with the spectral feature columns
+
+Frequencies are in kHz and times in us, as in the rest of the pipeline.
+
+"""
+import numpy as np
+import matplotlib.pyplot as plt
+import hashlib
+import io
+import json
+import os
+from contextlib import redirect_stdout
+import datetime
+import time
+from scipy import fft, signal
+from ae_cache import CACHE_DIR, evict_derived
+from ae_dataset import AEDataset
+from ae_io import array_chunks
+from ae_metrics import RunMetrics, stage
+from compute_toa import select_json_file
+
+
+PARTIAL_POWER_BANDS = [(0, 150), (150, 300), (300, 450), (450, 600),
+                       (600, 1200)] # kHz
+STFT_SEGMENT = 128 # samples per STFT segment
+STFT_OVERLAP = 96 # samples shared by neighbouring segments
+CWT_FREQUENCIES = np.geomspace(50, 1500, 48) # kHz
+MORLET_W0 = 6 # cycles of the Morlet wavelet (time / frequency trade-off)
+CHUNK_ELEMENTS = 2**24 # bounds the temporaries of one chunk
+
+
+def chunk_rows(row_elements, max_elements=CHUNK_ELEMENTS):
+    """ waveforms per chunk when each one needs row_elements values """
+    return max(1, max_elements // max(int(row_elements), 1))
+
+
+def transform_key(waves, kind, params):
+    """ hash of the waveform values, their shape and the parameters """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps([kind, list(np.shape(waves)), params],
+                        sort_keys=True).encode())
+    for part in array_chunks(np.asarray(waves, dtype=np.float64)):
+        h.update(part.tobytes())
+
+    return h.hexdigest()
+
+
+def cached_transform(waves, kind, params, transform, chunk,
+                     cache_dir=CACHE_DIR):
+    """ [waveform][...] float32 result of transform on all waveforms,
+        computed chunk by chunk into a memory mapped .npy on the first
+        call and memory mapped from the cache after that """
+    name = os.path.join(cache_dir, 'spectra', '{:s}_{:s}.npy'.format(
+        kind, transform_key(waves, kind, params)))
+    if os.path.exists(name):
+        os.utime(name) # recently used, evicted last
+        print("{:s} reused : {:s}".format(kind, name))
+        return np.load(name, mmap_mode='r')
+    os.makedirs(os.path.dirname(name), exist_ok=True)
+    tmp_file = name + f'.{os.getpid()}.tmp'
+    start = time.perf_counter()
+    result = None
+    try:
+        for first in range(0, len(waves), chunk):
+            part = transform(np.asarray(waves[first:first+chunk],
+                                        dtype=np.float64))
+            if result is None: # shape of one row known from the first chunk
+                result = np.lib.format.open_memmap(
+                    tmp_file, 'w+', np.float32,
+                    (len(waves),) + part.shape[1:])
+            result[first:first+len(part)] = part
+        if result is None: # no waveforms
+            return np.zeros((0, 0), dtype=np.float32)
+        result.flush()
+        result = None # file closed before it is moved
+        os.replace(tmp_file, name)
+    finally: # a failed transform leaves no partial file behind
+        result = None
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    evict_derived(name, cache_dir)
+    print("{:s} of {:>5d} waveforms in {:.3f} s".format(
+        kind, len(waves), time.perf_counter() - start))
+
+    return np.load(name, mmap_mode='r')
+
+
+def spectrum_frequencies(sig_length, fs):
+    """ frequencies (kHz) of the rFFT bins """
+    return fft.rfftfreq(sig_length, 1 / fs) / 1000
+
+
+def magnitude_spectra(waves, fs, cache_dir=CACHE_DIR, workers=None):
+    """ frequencies (kHz) and |rFFT| [waveform][frequency] of all waves """
+    sig_length = np.shape(waves)[1]
+    transform = lambda x: np.abs(fft.rfft(x, axis=1, workers=workers))
+    spectra = cached_transform(waves, 'spectrum', {'fs': float(fs)},
+                               transform, chunk_rows(sig_length),
+                               cache_dir)
+
+    return spectrum_frequencies(sig_length, fs), spectra
+
+
+def spectral_features(frequencies, spectra, bands=PARTIAL_POWER_BANDS):
+    """ peak frequency, frequency centroid (kHz) and partial powers (power
+        in each band / total power) of every spectrum, in chunks """
+    n = len(spectra)
+    features = {'peak_frequency': np.zeros(n),
+                'frequency_centroid': np.zeros(n)}
+    for band_idx in range(len(bands)):
+        features['partial_power_{:d}'.format(band_idx+1)] = np.zeros(n)
+    in_band = [(frequencies >= low) & (frequencies < high)
+               for low, high in bands]
+    chunk = chunk_rows(spectra.shape[1])
+    for start in range(0, n, chunk):
+        power = np.asarray(spectra[start:start+chunk], dtype=np.float64)**2
+        stop = start + len(power)
+        total = power.sum(axis=1)
+        safe_total = np.where(total > 0, total, 1)
+        features['peak_frequency'][start:stop] = frequencies[
+            np.argmax(power, axis=1)]
+        features['frequency_centroid'][start:stop] = \
+            power @ frequencies / safe_total
+        for band_idx, mask in enumerate(in_band):
+            features['partial_power_{:d}'.format(band_idx+1)][start:stop] = \
+                power[:, mask].sum(axis=1) / safe_total
+
+    return features
+
+
+def stft_magnitude(waves, fs, nperseg=STFT_SEGMENT, noverlap=STFT_OVERLAP,
+                   cache_dir=CACHE_DIR):
+    """ frequencies (kHz), times (us) and |STFT| [waveform][frequency][time]
+        of all waves """
+    sig_length = np.shape(waves)[1]
+    nperseg = min(nperseg, sig_length)
+    noverlap = min(noverlap, nperseg - 1)
+    stft = lambda x: signal.stft(x, fs, nperseg=nperseg, noverlap=noverlap,
+                                 axis=-1)
+    frequencies, times, _ = stft(np.zeros((1, sig_length)))
+    row_elements = 4 * len(frequencies) * len(times) # complex temporaries
+    magnitude = cached_transform(
+        waves, 'stft', {'fs': float(fs), 'nperseg': nperseg,
+                        'noverlap': noverlap},
+        lambda x: np.abs(stft(x)[2]), chunk_rows(row_elements), cache_dir)
+
+    return frequencies / 1000, times * 10**6, magnitude
+
+
+def morlet_kernels(frequencies, fs, nfft, w0=MORLET_W0):
+    """ [frequency][bin] FFT of analytic Morlet wavelets, scaled so a sine
+        of amplitude A at a frequency gives |W| = A there """
+    omega = 2 * np.pi * fft.fftfreq(nfft, 1 / fs)
+    scales = w0 / (2 * np.pi * np.asarray(frequencies) * 1000)
+    kernels = 2 * np.exp(-0.5 * (scales[:, None] * omega[None, :] - w0)**2)
+
+    return kernels * (omega > 0)
+
+
+def cwt_magnitude(waves, fs, frequencies=CWT_FREQUENCIES, w0=MORLET_W0,
+                  cache_dir=CACHE_DIR, workers=None):
+    """ times (us) and Morlet scalogram |W| [waveform][frequency][time] of
+        all waves, frequencies in kHz. Convolutions are done by FFT, zero
+        padded so the ends of a waveform do not wrap around. """
+    sig_length = np.shape(waves)[1]
+    nfft = fft.next_fast_len(2 * sig_length)
+    kernels = morlet_kernels(frequencies, fs, nfft, w0)
+
+    def transform(x):
+        spectra = fft.fft(x, nfft, axis=1, workers=workers)
+        coefficients = fft.ifft(spectra[:, None, :] * kernels[None],
+                                axis=2, workers=workers)
+        return np.abs(coefficients[:, :, :sig_length])
+
+    magnitude = cached_transform(
+        waves, 'cwt', {'fs': float(fs), 'frequencies': list(
+            map(float, frequencies)), 'w0': float(w0)}, transform,
+        chunk_rows(2 * len(frequencies) * nfft), cache_dir)
+
+    return np.arange(sig_length) / fs * 10**6, magnitude
+
+
+def plot_time_frequency(dataset, event, sensor, kind='stft', waves='waves'):
+    """ waveform and STFT / scalogram of one hit, only that waveform is
+        transformed """
+    row = dataset.row(event, sensor)
+    if row < 0:
+        raise KeyError(f'event {event} has no sensor {sensor}')
+    fs = 1 / dataset.dt()
+    wave = dataset[waves][row:row+1]
+    if kind == 'stft':
+        frequencies, times, magnitude = stft_magnitude(wave, fs)
+    else:
+        frequencies = CWT_FREQUENCIES
+        times, magnitude = cwt_magnitude(wave, fs, frequencies)
+    fig, (ax_wave, ax_tf) = plt.subplots(2, 1, sharex=True, figsize=(10, 8))
+    ax_wave.plot(dataset.time(waves), dataset[waves][row], 'b')
+    ax_wave.set_ylabel('Amplitude')
+    ax_tf.pcolormesh(times, frequencies, magnitude[0], shading='auto')
+    ax_tf.set_ylabel('Frequency (kHz)')
+    ax_tf.set_xlabel('Time ($\\mu$s)')
+    fig.suptitle(f'Event: {event}  Sensor: {sensor}')
+    plt.show()
+
+    return fig
+
+
+def compute_spectra(ae_dataset_file, waves='waves',
+                    bands=PARTIAL_POWER_BANDS, stft=False, cwt=False,
+                    fmt=None, cache_dir=CACHE_DIR):
+    """ Add spectral feature columns to a dataset, optionally fill the
+        STFT / scalogram cache for later analysis and plots """
+    with stage('file read'):
+        dataset = AEDataset.load(ae_dataset_file)
+    fs = 1 / dataset.dt()
+    print("spectra of {:s}, fs {:.0f} kHz, bands (kHz) : {}".format(
+        waves, fs / 1000, bands))
+
+    start = time.perf_counter()
+    with stage('spectra'):
+        frequencies, spectra = magnitude_spectra(dataset[waves], fs,
+                                                 cache_dir)
+        features = spectral_features(frequencies, spectra, bands)
+    seconds = time.perf_counter() - start
+    print("spectral features of {:>5d} waveforms in {:.3f} s".format(
+        len(dataset), seconds))
+    for key, value in features.items():
+        dataset[key] = value
+    if stft:
+        with stage('stft'):
+            print("stft shape : {}".format(
+                stft_magnitude(dataset[waves], fs,
+                               cache_dir=cache_dir)[2].shape))
+    if cwt:
+        with stage('cwt'):
+            print("scalogram shape : {}".format(
+                cwt_magnitude(dataset[waves], fs,
+                              cache_dir=cache_dir)[1].shape))
+
+    if fmt is None: # keep the format of the input dataset
+        fmt = os.path.splitext(ae_dataset_file)[1]
+    with stage('save'):
+        spectra_file = dataset.save(ae_dataset_file, 'spectra', fmt)
+
+    return spectra_file
+
+
+if __name__ == '__main__':
+
+    VERSION='1.0'
+    WAVES = 'waves' # or 'waves_filtered' after preprocess.py
+    BANDS = PARTIAL_POWER_BANDS # kHz
+    STFT = False # also cache the STFT of every waveform
+    CWT = False # also cache the Morlet scalogram of every waveform
+    PROFILE = False # cProfile the run, *_profile.prof next to the log
+    TRACE_MEMORY = False # tracemalloc peak per stage in *_metrics.json
+
+    # Create a StringIO object to capture the output
+    output_buffer = io.StringIO()
+
+    # Redirect the standard output to the buffer, time the stages
+    metrics = RunMetrics('compute_spectra', PROFILE, TRACE_MEMORY)
+    with redirect_stdout(output_buffer), metrics:
+        # header
+        current_datetime = datetime.datetime.now()
+        print(current_datetime)
+        print('daly_lab_ae_pipeline')
+        print('compute_spectra')
+        print(f"version: {VERSION}")
+        print("Nick Tulshibagwale")
+        print("Daly Lab, Mechanical Eng. Department")
+        print("University of California, Santa Barbara")
+        print('')
+        print('')
+
+        print("INPUTS")
+        ae_dataset_file = select_json_file()
+        print(f'selected dataset file: {ae_dataset_file}')
+        print(f'selected bands (kHz): {BANDS}')
+        print(f'STFT: {STFT}, CWT: {CWT}')
+        print('')
+
+        print('SPECTRA')
+        spectra_dataset = compute_spectra(ae_dataset_file, WAVES, BANDS,
+                                          STFT, CWT)
+        print('')
+
+
+        print('PROGRAM END')
+
+    # Output log
+    captured_output = output_buffer.getvalue()
+    log_name = current_datetime.strftime("%Y-%m-%d_%H-%M-%S")
+    with open(log_name+'_log.txt', 'w') as file:
+        file.write(captured_output)
+    metrics.save(log_name) # timing / memory sidecar of the log
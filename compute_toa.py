@@ -7,8 +7,9 @@ Author: Nick Tulshibagwale
 Date: October 13, 2023
 
 Summary of code:
-    1. User prompted to select ae .json file of filtered waveforms
-    2. User loops through all waveforms and selects TOA
+    1. User prompted to select ae .npz/.json file of filtered waveforms
+    2. User loops through all waveforms and selects TOA, or TOAs are picked
+       automatically (AIC or STA/LTA) with a confidence for each pick
     3. Dataset is saved along with TOAs
 
 Make sure to do %matplotlib auto
@@ -20,19 +21,15 @@ from tkinter import filedialog
 from tkinter import Tk
 import json 
 import io
+import os
 from contextlib import redirect_stdout
 import datetime
-
-def load_json_file(json_file):
-    """ Loads in .json file from file path. """
-    print(f"Loading in Dataset from {json_file}")
-    with open(json_file) as file:
-        data = json.load(file)
-    for key in data.keys():
-        data[key]  = np.array(data[key])
-    print("Successfully loaded in .json file.\n")
-    
-    return data
+import time
+from ae_io import json_default
+from ae_dataset import AEDataset
+from ae_journal import DecisionJournal
+from ae_metrics import RunMetrics, stage
+from ae_viewer import EventViewer, Prefetcher, prepare_traces
 
 
 def tellme(s): # print statements to user for instructions
@@ -40,96 +37,192 @@ def tellme(s): # print statements to user for instructions
     plt.draw()
     
         
-def manual_toa_selection(signals, event, sensor):
-    """ User selects TOA on all signals """
-    toa=[]
+def manual_toa_selection(dataset, journal=None, waves='waves', window=300):
+    """ User selects TOA on all signals, waves column to show, only the
+        first window samples are shown """
+    signals = dataset[waves]
+    time_us = dataset.time(waves) # from the fs of the dataset
+    window = min(window, len(time_us))
     
     # create toa array of same dimension 
     toa=np.zeros(len(signals))
 
-    for ii, ev in enumerate(list(set(event))): # loop through all events once
-        # obtain the indices for that event
-        indices = [jj for jj,x in enumerate(event) if x == ev]
-                            
-        plt.figure(figsize=(10,10))
-        ax1 = plt.subplot(211)
-        ax1.plot(TIME[0:300],signals[indices[0]][0:300],'b')
-        ax1.set_xlabel('Time ($\mu$s)', fontsize=30)
-        ax1.set_ylabel('Amplitude', fontsize=30)
-        ax1.tick_params(axis='x', labelsize=30) 
-        ax1.tick_params(axis='y', labelsize=30) 
-        ax1.set_xlim([0,TIME[300]])
-        #ax1.set_ylim([-0.03,0.03])
-        
-        ax2 = plt.subplot(212)
-        ax2.plot(TIME[0:300],signals[indices[1]][0:300],'b')
-        ax2.set_xlabel('Time ($\mu$s)', fontsize=30)
-        ax2.set_ylabel('Amplitude', fontsize=30)
-        ax2.tick_params(axis='x', labelsize=30) 
-        ax2.tick_params(axis='y', labelsize=30) 
-        ax2.set_xlim([0,TIME[300]])
-        #ax2.set_ylim([-0.03,0.03])
-        plt.tight_layout()
-        
-        figManager = plt.get_current_fig_manager()
-        figManager.window.showMaximized() 
-        
-        for index, ax in enumerate([ax1, ax2]):
-            plt.sca(ax)  # Set the current axis for ginput
-        
-            # Compute TOA for the current subplot
-            while True:
-                pts = []
-                while len(pts) < 1:
-                    #tellme('Select signal start time with mouse')
-                    tellme("")
-                    pts = np.asarray(plt.ginput(1, timeout=-1))
+    # events labeled before a restart come from the journal, not the screen
+    pending = []
+    for ev in dataset.events:
+        if journal is not None and int(ev) in journal:
+            toa[dataset.event_rows(ev)] = journal[int(ev)]
+        else:
+            pending.append(ev)
+    if journal is not None:
+        print("num events from journal : {:>5d}".format(
+            len(dataset.events) - len(pending)))
+    if not pending:
+        return toa
+
+    # one figure for the whole session, next events prepared in background
+    viewer = EventViewer(len(dataset.sensors), marker='vline',
+                         xlim=[0, time_us[window-1]])
+    prefetcher = Prefetcher(lambda ev: prepare_traces(
+        time_us[:window], signals[dataset.event_rows(ev)][:, :window]),
+        pending)
+    try:
+        for ii, ev in enumerate(pending): # loop through all events once
+            # obtain the indices for that event, ordered by sensor
+            indices = dataset.event_rows(ev)
+            viewer.show(f'Event: {ev}', *prefetcher.get(ii))
         
-                w_start = pts[:, 0][0]
-                ph = ax.axvline(w_start, color='b', linestyle='--', label=f'time = {np.round(w_start, 2)} $\mu$s')
-                ax.legend(fontsize=34)
-                #tellme('Hit spacebar to accept. Left click to repeat selection.')
-                tellme("")
-                if plt.waitforbuttonpress():
-                    break
-                ph.remove()
-
-            # if user selected super far to the left
-            if w_start < 2:
-                toa[indices[index]]=(0) # indicating unknown start value
-            else:
-                toa[indices[index]]=(w_start)
-            print("event : {:>5d}  channel : {:>5d}  toa : {:>5f}".format(ev, index+1, w_start))
-            
-        plt.close('all')
+            for index, row in enumerate(indices):
+                # Compute TOA for the current subplot
+                while True:
+                    w_start, _ = viewer.select_point(index)
+                    viewer.set_marker(index, w_start,
+                                      f'time = {np.round(w_start, 2)} $\mu$s')
+                    #Hit any key to accept. Left click to repeat selection.
+                    if viewer.wait_button():
+                        break
+                    viewer.hide_marker(index)
+
+                # if user selected super far to the left
+                if w_start < 2:
+                    toa[row]=(0) # indicating unknown start value
+                else:
+                    toa[row]=(w_start)
+                print("event : {:>5d}  channel : {:>5d}  toa : {:>5f}".format(ev, index+1, w_start))
+            if journal is not None: # on disk before the next event
+                journal.record(int(ev), toa[indices])
+    finally: # closed window / Ctrl-C, recorded events stay on disk
+        prefetcher.close()
+        viewer.close()
+        if journal is not None:
+            journal.close()
             
-    toa=list(toa)
-    
     return toa
     
    
-def compute_toa(ae_json_file, method='MANUAL'):
-    """ Determine time of arrival for AE waveforms """
-    dataset = load_json_file(ae_json_file)
+def aic_picker(waves, margin=10):
+    """ Akaike information criterion onset, all waveforms at once """
+    # AIC(k) = k log(var(x[:k])) + (N-k-1) log(var(x[k:])), with both
+    # variances from running sums so there is no loop over samples
+    N = waves.shape[1]
+    cs = np.cumsum(waves, axis=1)
+    cs2 = np.cumsum(waves**2, axis=1)
+    k = np.arange(margin, N-margin) # split points, first sample of x[k:]
+    n1, n2 = k, N-k
+    s1, s1_2 = cs[:, k-1], cs2[:, k-1]
+    s2, s2_2 = cs[:, -1:] - s1, cs2[:, -1:] - s1_2
+    var1 = np.maximum(s1_2/n1 - (s1/n1)**2, 1e-30)
+    var2 = np.maximum(s2_2/n2 - (s2/n2)**2, 1e-30)
+    aic = n1*np.log(var1) + (n2-1)*np.log(var2)
+    # onset has to come before the largest peak, later minima are coda
+    peak = np.argmax(np.abs(waves), axis=1)
+    aic[k[None, :] > np.maximum(peak, margin)[:, None]] = np.inf
+    
+    return k[np.argmin(aic, axis=1)]
+
+
+def stalta_picker(waves, sta=20, lta=200, threshold=4):
+    """ STA/LTA trigger onset, all waveforms at once (-1 if no trigger).
+        Records shorter than sta + lta samples have no full window, every
+        row is -1 then. """
+    if waves.shape[1] < sta + lta:
+        return np.full(len(waves), -1)
+    # Running energy sums, c[:, i] = sum of x**2 over samples [0, i)
+    c = np.zeros((waves.shape[0], waves.shape[1]+1))
+    np.cumsum(waves**2, axis=1, out=c[:, 1:])
+    i = np.arange(sta+lta-1, waves.shape[1]) # last sample of sta window
+    sta_energy = (c[:, i+1] - c[:, i+1-sta]) / sta
+    lta_energy = (c[:, i+1-sta] - c[:, i+1-sta-lta]) / lta
+    ratio = sta_energy / np.maximum(lta_energy, 1e-30)
+    triggered = ratio >= threshold
     
-    waves=dataset['waves']
-    waves = [list(waveform) for waveform in waves]
-    event=dataset['event'].tolist()
-    parent_txt=dataset['parent_txt'].tolist()
-    sensor=dataset['sensor'].tolist()
-
-    if method == 'MANUAL':
-        toa=manual_toa_selection(waves, event, sensor)
+    return np.where(triggered.any(axis=1), i[np.argmax(triggered, axis=1)],
+                    -1)
+
+
+def pick_confidence(waves, picks, window=50):
+    """ 1 - rms before / rms after the pick, 0 (noise) to 1 (clean) """
+    c = np.zeros((waves.shape[0], waves.shape[1]+1))
+    np.cumsum(waves**2, axis=1, out=c[:, 1:])
+    N = waves.shape[1]
+    pre_start = np.clip(picks-window, 0, N)
+    post_stop = np.clip(picks+window, 0, N)
+    rows = np.arange(len(waves))
+    pre = (c[rows, picks] - c[rows, pre_start]) / np.maximum(picks-pre_start,
+                                                             1)
+    post = (c[rows, post_stop] - c[rows, picks]) / \
+        np.maximum(post_stop-picks, 1)
+    confidence = 1 - np.sqrt(pre / np.maximum(post, 1e-30))
     
-    toa_dataset={'waves': waves,
-                 'sensor': sensor,
-                 'event': event,
-                 'parent_txt': parent_txt,                 
-                 'toa': toa}
+    return np.clip(confidence, 0, 1)
+
+
+def automatic_toa_selection(signals, method='AIC', dt=10**-7, min_toa=2,
+                            chunk=4096, **picker_kwargs):
+    """ Batched TOA picking, returns toa (us, 0 = unknown) and confidence """
+    signals = np.asarray(signals, dtype=np.float64)
+    picker = {'AIC': aic_picker, 'STALTA': stalta_picker}[method]
+    toa = np.zeros(len(signals))
+    confidence = np.zeros(len(signals))
+    for start in range(0, len(signals), chunk): # bounds memory
+        waves = signals[start:start+chunk]
+        picks = picker(waves, **picker_kwargs)
+        found = picks >= 0
+        picks = np.maximum(picks, 0)
+        toa[start:start+chunk] = np.where(found, picks * dt * 10**6, 0)
+        confidence[start:start+chunk] = np.where(
+            found, pick_confidence(waves, picks), 0)
+    # same convention as the manual picker, very early picks are unknown
+    unknown = toa < min_toa
+    toa[unknown] = 0
+    confidence[unknown] = 0
     
-    save_dict_as_json(ae_json_file, toa_dataset, 'toa')
+    return toa, confidence
     
-    return
+   
+def compute_toa(ae_dataset_file, method='MANUAL', fmt=None, dt=None,
+                review_below=None, waves='waves'):
+    """ Determine time of arrival for AE waveforms, picked on the waves
+        column ('waves' raw, 'waves_filtered' from preprocess.py), dt from
+        the dataset fs if not given """
+    with stage('file read'):
+        dataset = AEDataset.load(ae_dataset_file)
+    dt = dt or dataset.dt()
+    # manual picks survive a crash, a rerun resumes where it stopped
+    journal = None
+    if method == 'MANUAL' or review_below is not None:
+        journal = DecisionJournal(ae_dataset_file, 'toa')
+
+    with stage('toa labeling'):
+        if method == 'MANUAL':
+            dataset['toa']=manual_toa_selection(dataset, journal, waves)
+        else: # AIC or STALTA
+            start = time.perf_counter()
+            toa, toa_confidence = automatic_toa_selection(dataset[waves],
+                                                          method, dt)
+            print("{:s} picked {:>5d} waveforms in {:.3f} s".format(
+                method, len(toa), time.perf_counter() - start))
+            print("num unknown toa : {:>5d}".format(np.sum(toa == 0)))
+            if review_below is not None: # user checks low confidence events
+                review = dataset.mask(
+                    event=dataset['event'][toa_confidence < review_below])
+                print("num waveforms for manual review : {:>5d}".format(
+                    np.sum(review)))
+                if review.any():
+                    toa[review] = manual_toa_selection(dataset.select(
+                        event=dataset['event'][review]), journal, waves)
+                    toa_confidence[review] = 1
+            dataset['toa'] = toa
+            dataset['toa_confidence'] = toa_confidence
+    
+    if fmt is None: # keep the format of the input dataset
+        fmt = os.path.splitext(ae_dataset_file)[1]
+    with stage('save'):
+        toa_file = dataset.save(ae_dataset_file, 'toa', fmt)
+    if journal is not None: # picks are in the saved dataset now
+        journal.compact()
+    
+    return toa_file
 
 
 def select_json_file():
@@ -137,8 +230,8 @@ def select_json_file():
     # Create a Tkinter window for file selection
     root = Tk()
     root.filename = filedialog.askopenfilename(
-        title="Select a .json file", filetypes=(("Json files", "*.json"),
-                                               ("All files", "*.*")))
+        title="Select a dataset file", filetypes=(("Datasets", "*.npz *.json"),
+                                                  ("All files", "*.*")))
     json_file=root.filename
     root.destroy()
         
@@ -149,7 +242,7 @@ def save_dict_as_json(ae_json_file, dataset, label):
     """ save dictionary as .json file """
     dataset_name = ae_json_file.replace('.json', '_' + label + '.json')
     with open(dataset_name, "w") as outfile:
-        json.dump(dataset, outfile)
+        json.dump(dataset, outfile, default=json_default)
     print("dataset .json saved  : {:>5s}".format(dataset_name))
 
     return
@@ -157,18 +250,19 @@ def save_dict_as_json(ae_json_file, dataset, label):
 
 if __name__ == '__main__':
     
-    SIG_LEN = 1024
-    DT = 10**-7
-    DURATION = SIG_LEN*DT*10**6 # convert to us
-    TIME = np.linspace(0,DURATION,SIG_LEN) # discretization of signal time
     VERSION='1.0'
-    METHOD = 'MANUAL'
+    METHOD = 'MANUAL' # 'MANUAL', 'AIC' or 'STALTA'
+    REVIEW_BELOW = None # e.g. 0.5, manually re-pick low confidence events
+    WAVES = 'waves' # or 'waves_filtered' after preprocess.py
+    PROFILE = False # cProfile the run, *_profile.prof next to the log
+    TRACE_MEMORY = False # tracemalloc peak per stage in *_metrics.json
 
     # Create a StringIO object to capture the output
     output_buffer = io.StringIO()
     
-    # Redirect the standard output to the buffer
-    with redirect_stdout(output_buffer):
+    # Redirect the standard output to the buffer, time the stages
+    metrics = RunMetrics('compute_toa', PROFILE, TRACE_MEMORY)
+    with redirect_stdout(output_buffer), metrics:
         # header
         current_datetime = datetime.datetime.now()
         print(current_datetime)
@@ -182,13 +276,14 @@ if __name__ == '__main__':
         print('')
         
         print("INPUTS")
-        ae_json_file = select_json_file()
-        print(f'selected .json file: {ae_json_file}')
+        ae_dataset_file = select_json_file()
+        print(f'selected dataset file: {ae_dataset_file}')
         print(f'selected TOA method: {METHOD}')
         print('')
            
         print('TIME-OF-ARRIVAL')
-        toa_dataset = compute_toa(ae_json_file, method='MANUAL')
+        toa_dataset = compute_toa(ae_dataset_file, method=METHOD,
+                                  review_below=REVIEW_BELOW, waves=WAVES)
         print('')
         
         
@@ -199,6 +294,7 @@ if __name__ == '__main__':
     log_name = current_datetime.strftime("%Y-%m-%d_%H-%M-%S")
     with open(log_name+'_log.txt', 'w') as file:
         file.write(captured_output)
+    metrics.save(log_name) # timing / memory sidecar of the log
     
    
    
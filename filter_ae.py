@@ -9,39 +9,60 @@ Date: October 13, 2023
 Summary of code:
     1. User prompted to select ae .txt file, that is obtained from DW testing.
     2. User shown each AE event, choose between filter event or noise event.
-    3. Filtered and noisy events are separate into two .json files.
+       Or events are split automatically by feature rules (AUTO), with only
+       borderline events shown to the user (HYBRID), or all events are
+       triaged page by page on cached thumbnails (GALLERY, ae_gallery).
+       With a trained noise model (train_noise_model.py) confident events
+       are labeled by the model and only the uncertain ones are shown,
+       most uncertain first.
+    3. Filtered and noisy events are separate into two .npz (or .json) files.
     4. A record of the filtering process is saved in a .txt file.
 
 """
 import numpy as np
-import matplotlib.pyplot as plt
 import json
 from tkinter import filedialog
 from tkinter import Tk
 import datetime
 import io
+import itertools
+import shutil
+import tempfile
 from contextlib import redirect_stdout
+from ae_cache import (cache_content, load_cached_signals,
+                      store_cached_signals)
+from ae_dataset import AEDataset
+from ae_gallery import cached_thumbnails, gallery_review
+from noise_model import load_noise_model, noise_probability
+from ae_journal import DecisionJournal
+from ae_metrics import RunMetrics, stage
+from ae_viewer import EventViewer, Prefetcher, prepare_traces
+from ae_io import (FORMAT_VERSION, NpzWriter, dataset_name, json_default,
+                   save_dataset)
 
 
-def create_dataset(ae_file, ev, signals):
-    """ separate multi-channel signals into one array, put into dict """
-    waves, event, sensor = [], [], []    
-    # Append waves with corresponding event number and sensor channel
-    for channel_idx, channel in enumerate(signals):
-        waves.append(channel)
-        event.append([int(item) for item in ev])
-        sensor.append([(channel_idx+1) for i in range(len(ev))])
-    # Remove a dimension 
-    waves = flatten(waves)
-    event = flatten(event)
-    sensor = flatten(sensor)
-    waves = [list(waveform) for waveform in waves] # np array not .json compat.
-    parent_txt = [ae_file for _ in range(len(waves))]
+def create_dataset(ae_file, ev, signals, fs=None, sig_length=None):
+    """ separate multi-channel signals into one array, put into dataset,
+        with the acquisition parameters of the header if given """
+    # signals is [channel][event][sample], rows of waves are channel major
+    signals = np.asarray(signals, dtype=np.float64)
+    if signals.ndim < 3: # no events, [[], []] has no sample axis
+        signals = np.empty((len(signals), 0, sig_length or 0))
+    waves = signals.reshape(signals.shape[0] * signals.shape[1],
+                            *signals.shape[2:])
+    event = np.tile(np.asarray(ev, dtype=np.int64), len(signals))
+    sensor = np.repeat(np.arange(1, len(signals)+1), len(ev))
+    # one file name viewed once per waveform, no per row copies
+    parent_txt = np.broadcast_to(np.array(ae_file), (len(waves),))
     # Create dataset in appropriate folder
-    dataset = {'parent_txt' : parent_txt,
-               'waves' : waves,
-               'event' : event, 
-               'sensor': sensor}
+    dataset = AEDataset({'parent_txt' : parent_txt,
+                         'waves' : waves,
+                         'event' : event, 
+                         'sensor': sensor})
+    if fs is not None: # one value for the whole dataset, not per row
+        dataset.columns['fs'] = np.array(float(fs))
+    if sig_length is not None:
+        dataset.columns['sig_length'] = np.array(int(sig_length))
     
     return dataset
 
@@ -50,25 +71,49 @@ def save_dict_as_json(ae_file, dataset, label):
     """ save dictionary as .json file """
     dataset_name = ae_file.replace('.txt', '_' + label + '.json')
     with open(dataset_name, "w") as outfile:
-        json.dump(dataset, outfile)
+        json.dump(dict(dataset), outfile, default=json_default)
     print("dataset .json saved  : {:>5s}".format(dataset_name))
 
     return
     
 
-def filter_ae_txt_file(ae_file, method='MANUAL'):
-    """ loads in ae .txt file and separate events into noise and filtered """
-    signals, ev, fs, channel_num, sig_length = read_ae_file(ae_file)
+def filter_ae_txt_file(ae_file, method='MANUAL', use_cache=False,
+                       journal=None, model=None):
+    """ loads in ae .txt file and separate events into noise and filtered,
+        manual decisions are recorded in journal (ae_journal) if given, a
+        noise model (noise_model) decides the confident MANUAL / GALLERY
+        events """
+    with stage('file read'):
+        signals, ev, fs, channel_num, sig_length = read_ae_file(ae_file,
+                                                                use_cache)
     print('ae file loaded succesfully.')
     print("num channels  : {:>5d}".format(len(signals)))
     print("num signals   : {:>5d}".format(len(ev)))
     print("sampling freq : {:>5d}".format(fs))
     print("signal length : {:>5d}".format(sig_length))
     print(f'begin {method} filtering...')
-    if method == 'MANUAL': # Filter via visual inspection
-        noise_ev, noise_idx, filter_ev, filter_idx,\
-            noise_signals, filter_signals = manual_filtering(signals, ev, fs,
-                                                       channel_num, sig_length)
+    with stage('filter labeling'):
+        if model is not None and method in ('MANUAL', 'GALLERY'):
+            noise_ev, noise_idx, filter_ev, filter_idx,\
+                noise_signals, filter_signals = model_filtering(
+                    ae_file, signals, ev, fs, sig_length, model, journal,
+                    gallery=(method == 'GALLERY'))
+        elif method == 'MANUAL': # Filter via visual inspection
+            noise_ev, noise_idx, filter_ev, filter_idx,\
+                noise_signals, filter_signals = manual_filtering(
+                    signals, ev, fs, channel_num, sig_length, journal)
+        elif method in ('AUTO', 'HYBRID'): # Filter via feature rules
+            noise_ev, noise_idx, filter_ev, filter_idx,\
+                noise_signals, filter_signals = auto_filtering(
+                    signals, ev, fs, sig_length, hybrid=(method == 'HYBRID'),
+                    journal=journal)
+        elif method == 'GALLERY': # Filter pages of pre-rendered thumbnails
+            noise_ev, noise_idx, filter_ev, filter_idx,\
+                noise_signals, filter_signals = gallery_filtering(
+                    ae_file, signals, ev, journal)
+        else:
+            raise ValueError(f'unknown filter method {method}, use MANUAL, '
+                             'AUTO, HYBRID or GALLERY')
     
     print('filtering completed.')
     print("num noise events : {:>5d}".format(len(noise_ev)))
@@ -77,30 +122,278 @@ def filter_ae_txt_file(ae_file, method='MANUAL'):
     print(f'filter events: {", ".join(map(str, filter_ev))}')
 
     # separate signals into noise and filtered dictionaries
-    noise_dataset = create_dataset(ae_file, noise_ev, noise_signals)
-    filter_dataset = create_dataset(ae_file, filter_ev, filter_signals)
+    with stage('dataset build'):
+        noise_dataset = create_dataset(ae_file, noise_ev, noise_signals, fs,
+                                       sig_length)
+        filter_dataset = create_dataset(ae_file, filter_ev, filter_signals,
+                                        fs, sig_length)
         
     return noise_dataset, filter_dataset
 
 
-def manual_filtering(signals, ev, fs, channel_num, sig_length):
+def stream_filter_ae_txt_file(ae_file, method='MANUAL', chunk_events=256,
+                              fmt='.npz', model=None):
+    """ filters ae .txt file event by event, writing datasets as it goes.
+        With a noise model only the MANUAL events it is uncertain about are
+        shown, in file order (no ranking while streaming). """
+    if method == 'GALLERY':
+        raise ValueError('GALLERY triage needs all events, use STREAM = False')
+    fs, sig_length, channel_num = read_ae_header(ae_file)
+    # manual decisions survive a crash, a rerun resumes where it stopped
+    journal = DecisionJournal(ae_file, 'filter') if method != 'AUTO' else None
+    print('ae file opened for streaming.')
+    print("num channels  : {:>5d}".format(channel_num))
+    print("sampling freq : {:>5d}".format(fs))
+    print("signal length : {:>5d}".format(sig_length))
+    print(f'begin {method} filtering...')
+    noise_ev, filter_ev = [], []
+    auto_decided = 0 # confident noise model decisions
+    viewer = None # opened on the first event that needs a look
+    noise_writer = DatasetWriter(ae_file, 'noise', channel_num, fmt, fs)
+    filter_writer = DatasetWriter(ae_file, 'filter', channel_num, fmt, fs)
+    with stage('stream filtering'), noise_writer, filter_writer:
+        for event, event_signals in iter_ae_events(ae_file, chunk_events):
+            if method == 'MANUAL' and model is not None: # model decides
+                p_noise = noise_probability(model, event_features(
+                    event_signals[:, None, :], fs, model['threshold']))[0]
+                is_noise = p_noise >= 0.5
+                review = model['accept'] < p_noise < model['reject']
+                auto_decided += not review
+            elif method == 'MANUAL': # Filter via visual inspection
+                review = True
+            elif method in ('AUTO', 'HYBRID'): # Filter via feature rules
+                features = event_features(event_signals[:, None, :], fs)
+                is_noise, borderline = apply_filter_rules(features)
+                review = method == 'HYBRID' and borderline[0]
+                is_noise = is_noise[0]
+            else:
+                raise ValueError(f'unknown filter method {method}, use '
+                                 'MANUAL, AUTO or HYBRID')
+            if review and event in journal: # labeled before a restart
+                is_noise = journal[event]
+            elif review:
+                viewer = viewer or filter_viewer(channel_num)
+                is_noise = manual_filter_event(event, event_signals, fs,
+                                               sig_length, viewer)
+                journal.record(int(event), bool(is_noise))
+            if is_noise:
+                noise_ev.append(event)
+                noise_writer.append(event, event_signals)
+                print("event : {:>5d}  NOISE".format(event))
+            else:
+                filter_ev.append(event)
+                filter_writer.append(event, event_signals)
+                print("event : {:>5d}  FILTER".format(event))
+
+    if viewer is not None:
+        viewer.close()
+    if journal is not None: # decisions are in the written datasets now
+        journal.compact()
+    print('filtering completed.')
+    if model is not None:
+        print("num decided by noise model : {:>5d}".format(auto_decided))
+    print("num signals   : {:>5d}".format(len(noise_ev) + len(filter_ev)))
+    print("num noise events : {:>5d}".format(len(noise_ev)))
+    print("num filter events : {:>5d}".format(len(filter_ev)))
+    print(f'noise events: {", ".join(map(str, noise_ev))}')
+    print(f'filter events: {", ".join(map(str, filter_ev))}')
+
+    return noise_writer.dataset_name, filter_writer.dataset_name
+
+
+def stream_dataset(ae_file, events, label, channel_num, fmt='.npz', fs=None):
+    """ write (event, signals) pairs from a generator straight to disk """
+    with DatasetWriter(ae_file, label, channel_num, fmt, fs) as writer:
+        for event, event_signals in events:
+            writer.append(event, event_signals)
+
+    return writer.dataset_name
+
+
+class DatasetWriter:
+    """
+    Writes the same dataset as create_dataset + save_dataset, but one event
+    at a time. Waveforms are spooled to one temporary file per channel so
+    the channel-major row order of create_dataset is preserved while only
+    the event numbers are kept in memory.
+    """
+    def __init__(self, ae_file, label, channel_num, fmt='.npz', fs=None):
+        self.ae_file = ae_file
+        self.fs = fs
+        self.fmt = fmt
+        self.dataset_name = dataset_name(ae_file, label, fmt)
+        self.channel_num = channel_num
+        self.sig_length = 0
+        self.event = []
+        mode = 'w+b' if fmt == '.npz' else 'w+'
+        self.spools = [tempfile.TemporaryFile(mode)
+                       for _ in range(channel_num)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else: # don't leave a half written dataset behind
+            for spool in self.spools:
+                spool.close()
+
+    def append(self, event, event_signals):
+        """ add one event, event_signals is [channel][sample] """
+        event_signals = np.asarray(event_signals, dtype=np.float64)
+        self.sig_length = event_signals.shape[1]
+        if self.fmt == '.npz':
+            for spool, waveform in zip(self.spools, event_signals):
+                spool.write(waveform.tobytes())
+        else:
+            sep = ', ' if self.event else ''
+            for spool, waveform in zip(self.spools, event_signals):
+                spool.write(sep + json.dumps(waveform.tolist()))
+        self.event.append(int(event))
+
+    def close(self):
+        """ assemble the spooled channels into the final dataset file """
+        if self.fmt == '.npz':
+            self.close_npz()
+        else:
+            self.close_json()
+        for spool in self.spools:
+            spool.close()
+        print("dataset {:s} saved  : {:>5s}".format(self.fmt,
+                                                    self.dataset_name))
+
+    def close_npz(self):
+        """ write spools as the waves member of a .npz dataset """
+        event_num = len(self.event)
+        with NpzWriter(self.dataset_name) as npz:
+            npz.write_array('format_version', np.array(FORMAT_VERSION))
+            npz.write_array('parent_txt', np.array(self.ae_file))
+            npz.write_spooled('waves', (event_num * self.channel_num,
+                                        self.sig_length),
+                              np.float64, self.spools, quantize=True)
+            npz.write_array('event', np.tile(np.array(self.event,
+                                                      dtype=np.int64),
+                                             self.channel_num))
+            npz.write_array('sensor', np.repeat(
+                np.arange(1, self.channel_num+1), event_num))
+            if self.fs is not None: # acquisition metadata, as create_dataset
+                npz.write_array('fs', np.array(float(self.fs)))
+                npz.write_array('sig_length', np.array(self.sig_length))
+
+    def close_json(self):
+        """ write spools as the waves list of a .json dataset """
+        event_num = len(self.event)
+        with open(self.dataset_name, "w") as outfile:
+            outfile.write('{"parent_txt": [')
+            write_repeated(outfile, json.dumps(self.ae_file),
+                           event_num * self.channel_num)
+            outfile.write('], "waves": [')
+            for ch_idx, spool in enumerate(self.spools):
+                if ch_idx > 0 and event_num:
+                    outfile.write(', ')
+                spool.seek(0)
+                shutil.copyfileobj(spool, outfile)
+            outfile.write('], "event": [')
+            for ch_idx in range(self.channel_num):
+                if ch_idx > 0 and event_num:
+                    outfile.write(', ')
+                outfile.write(json.dumps(self.event)[1:-1])
+            outfile.write('], "sensor": [')
+            for ch_idx in range(self.channel_num):
+                if ch_idx > 0 and event_num:
+                    outfile.write(', ')
+                write_repeated(outfile, str(ch_idx+1), event_num)
+            outfile.write(']')
+            if self.fs is not None:
+                outfile.write(', "fs": {:s}, "sig_length": {:d}'.format(
+                    json.dumps(float(self.fs)), self.sig_length))
+            outfile.write('}')
+
+
+def write_repeated(outfile, item, count, chunk=10000):
+    """ write item count times as a json list body, without a huge string """
+    for start in range(0, count, chunk):
+        if start > 0:
+            outfile.write(', ')
+        outfile.write(', '.join([item] * min(chunk, count - start)))
+
+
+def filter_viewer(channel_num):
+    """ reusable figure for manual filtering, one subplot per channel """
+    viewer = EventViewer(channel_num, xlabel='Time (s)', ylabel='',
+                         fontsize=14, figsize=(15, 10))
+    for ch_idx, ax in enumerate(viewer.axes):
+        ax.set_title(f'Channel {ch_idx+1}')
+
+    return viewer
+
+
+def filter_traces(event_signals, fs, sig_length):
+    """ decimated traces and limits of one event for the filter viewer """
+    return prepare_traces(np.arange(0, sig_length) * 1/fs, event_signals)
+
+
+def manual_filter_event(event, event_signals, fs, sig_length, viewer=None,
+                        traces=None):
+    """ show one event's waveforms, returns True if user marks it noise """
+    close = viewer is None
+    if viewer is None:
+        viewer = filter_viewer(len(event_signals))
+    if traces is None:
+        traces = filter_traces(event_signals, fs, sig_length)
+    #User indicates whether to keep, key press in the figure window
+    viewer.show(f"Event: {event} | To DISCARD press 'n/N' | "+
+                "To KEEP press any key", *traces)
+    key = viewer.wait_key()
+    if close:
+        viewer.close()
+
+    return key.lower() == 'n'
+
+
+def review_events(signals, ev, review, fs, sig_length, journal=None):
+    """ manual noise decision for events ev[review], events already in the
+        journal are not shown again, new decisions are appended to it """
+    is_noise = {}
+    if journal is not None:
+        for ev_idx in review:
+            if int(ev[ev_idx]) in journal:
+                is_noise[ev_idx] = journal[int(ev[ev_idx])]
+        print("num events from journal : {:>5d}".format(len(is_noise)))
+    pending = [ev_idx for ev_idx in review if ev_idx not in is_noise]
+    if not pending:
+        return is_noise
+    # one figure for the whole session, next events prepared in background
+    viewer = filter_viewer(len(signals))
+    prefetcher = Prefetcher(lambda ev_idx: filter_traces(
+        signals[:, ev_idx], fs, sig_length), pending)
+    try:
+        for ii, ev_idx in enumerate(pending):
+            is_noise[ev_idx] = manual_filter_event(
+                ev[ev_idx], signals[:, ev_idx], fs, sig_length, viewer,
+                prefetcher.get(ii))
+            if journal is not None:
+                journal.record(int(ev[ev_idx]), bool(is_noise[ev_idx]))
+    finally: # closed window / Ctrl-C, recorded decisions stay on disk
+        prefetcher.close()
+        viewer.close()
+        if journal is not None:
+            journal.close()
+
+    return is_noise
+
+
+def manual_filtering(signals, ev, fs, channel_num, sig_length, journal=None):
     """ Split events into noise and actual events by visual inspection """
     noise_ev, noise_idx, filter_ev, filter_idx = [], [], [], []
     noise_signals = [[] for _ in range(channel_num)]
     filter_signals = [[] for _ in range(channel_num)]
+    # Plot waveforms, user indicates whether to keep
+    is_noise = review_events(signals, ev, range(len(ev)), fs, sig_length,
+                             journal)
     for ev_idx, event in enumerate(ev):
-        # Plot waveforms
-        fig, axes = plt.subplots(channel_num, 1, figsize=(15, 10), sharex=True)
-        fig.suptitle(f'Event: {ev[ev_idx]}', fontsize=20)    
-        for ch_idx, ax in enumerate(axes): 
-            ax.plot(np.arange(0, sig_length) * 1/fs, signals[ch_idx][ev_idx])
-            ax.set_title(f'Channel {ch_idx+1}')
-            ax.tick_params(labelsize=14)
-        plt.show()
-        #User indicates whether to keep
-        inp = input(f"To DISCARD event #{ev[ev_idx]} press 'n/N' | "+
-                    f"To KEEP event #{ev[ev_idx]} press any key | \n")
-        if inp.lower() == 'n' or inp.lower() == 'N':
+        if is_noise[ev_idx]:
             noise_ev.append(event)
             noise_idx.append(ev_idx)
             for ch_idx,_ in enumerate(signals): # signals is [channel][events]
@@ -118,42 +411,292 @@ def manual_filtering(signals, ev, fs, channel_num, sig_length):
             filter_signals
 
 
+# Rules for AUTO filtering, an event is kept if it passes all of them.
+# Amplitudes in V, energy in V^2 us, times in us. Set a rule to None to skip.
+AUTO_FILTER_RULES = {'threshold': 0.01, # crossing level for counts/arrival
+                     'min_amplitude': 0.04, # weakest channel peak
+                     'review_amplitude': 0.99, # clipped: kept, HYBRID review
+                     'min_energy': 0.003, # weakest channel energy
+                     'min_counts': 4, # weakest channel crossings
+                     'max_rise_time': 100, # slowest channel rise time
+                     'max_arrival_spread': 20} # first to last channel arrival
+
+
+def event_features(signals, fs, threshold=AUTO_FILTER_RULES['threshold'],
+                   chunk=1024):
+    """ per event features over all channels, signals [channel][event] """
+    signals = np.asarray(signals, dtype=np.float64)
+    channel_num, event_num, sig_length = signals.shape
+    dt = 10**6 / fs # us
+    features = {key: np.zeros(event_num) for key in
+                ['amplitude', 'max_amplitude', 'energy', 'counts',
+                 'rise_time', 'arrival_spread']}
+    for start in range(0, event_num, chunk): # bounds memory
+        x = signals[:, start:start+chunk]
+        stop = start + x.shape[1]
+        peak = np.abs(x).max(axis=2) # [channel][event]
+        energy = np.sum(x**2, axis=2) * dt
+        above = np.abs(x) > threshold
+        crossed = above.any(axis=2)
+        arrival = np.where(crossed, np.argmax(above, axis=2), sig_length)
+        counts = np.sum((x[..., 1:] > threshold) & (x[..., :-1] <= threshold),
+                        axis=2)
+        rise = np.where(crossed, (np.argmax(np.abs(x), axis=2) - arrival)
+                        * dt, np.inf)
+        # weakest channel decides, a real hit has to reach every sensor
+        features['amplitude'][start:stop] = peak.min(axis=0)
+        features['max_amplitude'][start:stop] = peak.max(axis=0)
+        features['energy'][start:stop] = energy.min(axis=0)
+        features['counts'][start:stop] = counts.min(axis=0)
+        features['rise_time'][start:stop] = rise.max(axis=0)
+        features['arrival_spread'][start:stop] = np.where(
+            crossed.all(axis=0), (arrival.max(axis=0) - arrival.min(axis=0))
+            * dt, np.inf)
+
+    return features
+
+
+def apply_filter_rules(features, rules=AUTO_FILTER_RULES, margin=0.25):
+    """ noise flag per event, borderline if a margin could flip the result """
+    rule_features = {'min_amplitude': 'amplitude',
+                     'min_energy': 'energy',
+                     'min_counts': 'counts',
+                     'max_rise_time': 'rise_time',
+                     'max_arrival_spread': 'arrival_spread'}
+    event_num = len(features['amplitude'])
+    is_noise = np.zeros(event_num, dtype=bool)
+    clear_noise = np.zeros(event_num, dtype=bool) # fails a rule by > margin
+    clear_keep = np.ones(event_num, dtype=bool) # passes all rules by > margin
+    for rule, key in rule_features.items():
+        limit = rules.get(rule)
+        if limit is None:
+            continue
+        value = features[key]
+        if rule.startswith('min'):
+            is_noise |= value < limit
+            clear_noise |= value < limit * (1 - margin)
+            clear_keep &= value > limit * (1 + margin)
+        else:
+            is_noise |= value > limit
+            clear_noise |= value > limit * (1 + margin)
+            clear_keep &= value < limit * (1 - margin)
+    # clipped at the DAQ range, the strongest real hits are too, so not
+    # noise but never kept without a look in HYBRID
+    if rules.get('review_amplitude') is not None:
+        clear_keep &= features['max_amplitude'] < rules['review_amplitude']
+
+    return is_noise, ~clear_noise & ~clear_keep
+
+
+def auto_filtering(signals, ev, fs, sig_length, rules=AUTO_FILTER_RULES,
+                   hybrid=False, journal=None):
+    """ Split events into noise and actual events by feature rules """
+    features = event_features(signals, fs, rules['threshold'])
+    is_noise, borderline = apply_filter_rules(features, rules)
+    if hybrid and borderline.any(): # only borderline events shown to user
+        print("num borderline events : {:>5d}".format(np.sum(borderline)))
+        reviewed = review_events(signals, ev, np.flatnonzero(borderline),
+                                 fs, sig_length, journal)
+        for ev_idx, noise in reviewed.items():
+            is_noise[ev_idx] = noise
+
+    return split_events(signals, ev, is_noise)
+
+
+def gallery_filtering(ae_file, signals, ev, journal=None, workers=None):
+    """ Split events into noise and actual events on a thumbnail grid """
+    reviewed = gallery_events(ae_file, signals, ev, range(len(ev)), journal,
+                              workers)
+    is_noise = np.array([reviewed[ev_idx] for ev_idx in range(len(ev))],
+                        dtype=bool)
+
+    return split_events(signals, ev, is_noise)
+
+
+def gallery_events(ae_file, signals, ev, review, journal=None, workers=None):
+    """ gallery noise decisions of events ev[review], in that order """
+    thumbs = cached_thumbnails(ae_file, signals, workers=workers)
+    peaks = np.abs(signals).max(axis=(0, 2)) if signals.size else None
+
+    return gallery_review(thumbs, ev, review, len(signals), peaks, journal)
+
+
+def model_filtering(ae_file, signals, ev, fs, sig_length, model,
+                    journal=None, gallery=False):
+    """ Split events by noise model score, the uncertain events are shown
+        to the user (viewer or gallery), most uncertain first """
+    features = event_features(signals, fs, model['threshold'])
+    p_noise = noise_probability(model, features)
+    is_noise = p_noise >= 0.5
+    uncertain = np.flatnonzero((p_noise > model['accept']) &
+                               (p_noise < model['reject']))
+    review = uncertain[np.argsort(np.abs(p_noise[uncertain] - 0.5),
+                                  kind='stable')]
+    print("num auto-rejected (noise) : {:>5d}".format(
+        np.sum(p_noise >= model['reject'])))
+    print("num auto-accepted (filter) : {:>5d}".format(
+        np.sum(p_noise <= model['accept'])))
+    print("num uncertain, to review : {:>5d}".format(len(review)))
+    if len(review):
+        if gallery:
+            reviewed = gallery_events(ae_file, signals, ev, review, journal)
+        else:
+            reviewed = review_events(signals, ev, review, fs, sig_length,
+                                     journal)
+        for ev_idx, noise in reviewed.items():
+            is_noise[ev_idx] = noise
+
+    return split_events(signals, ev, is_noise)
+
+
+def split_events(signals, ev, is_noise):
+    """ noise / filter events, indices and signals from a noise flag """
+    for event, noise in zip(ev, is_noise):
+        print("event : {:>5d}  {:s}".format(event,
+                                            'NOISE' if noise else 'FILTER'))
+    noise_idx = np.flatnonzero(is_noise)
+    filter_idx = np.flatnonzero(~is_noise)
+
+    return list(ev[noise_idx]), list(noise_idx), list(ev[filter_idx]), \
+        list(filter_idx), signals[:, noise_idx], signals[:, filter_idx]
+
+
 def flatten(t): # flattens out a list of lists (CHECK)
     return [item for sublist in t for item in sublist]
 
-def read_ae_file(ae_file):
-    """ function loads in experimental AE data from .txt files from DW """
-    # Read in .txt file generated from Digital Wave DAQ / Software
-    f = open(ae_file)
-    data = f.readlines()
-    f.close()
+def read_ae_header(ae_file):
+    """ reads signal processing parameters from the DW .txt header line """
+    with open(ae_file) as f:
+        header = f.readline().split()
+    fs = int(header[0]) * 10**6  # DAQ sampling freq (usually 10 MHz)
+    sig_length = int(header[2])  # Number of samples in waveform event
+    channel_num = int(header[3]) # Number of AE sensors used
     
+    return fs, sig_length, channel_num
+
+
+def parse_ae_rows(ae_file, channel_num):
+    """ [row][channel] samples of a DW .txt file, a cut off last line
+        (file still being written) is dropped """
+    try:
+        return np.loadtxt(ae_file, delimiter='\t', skiprows=1, ndmin=2,
+                          usecols=range(channel_num))
+    except ValueError: # slower, only the complete lines are parsed
+        with open(ae_file, 'rb') as f:
+            f.readline() # skip header
+            body = f.read()
+        lines = body[:body.rfind(b'\n')+1].splitlines()
+        if not lines or len(lines[-1].split()) < channel_num:
+            lines = lines[:-1]
+        if not lines: # no complete row yet
+            return np.empty((0, channel_num))
+        return np.loadtxt(lines, delimiter='\t', ndmin=2,
+                          usecols=range(channel_num))
+
+
+def read_ae_file(ae_file, use_cache=False):
+    """ function loads in experimental AE data from .txt files from DW """
     # Get the signal processing parameters from header
-    header = data[0]
-    fs = int(header.split()[0]) * 10**6  # DAQ sampling freq (usually 10 MHz)
-    sig_length = int(header.split()[2])  # Number of samples in waveform event
-    channel_num = int(header.split()[3]) # Number of AE sensors used
+    fs, sig_length, channel_num = read_ae_header(ae_file)
     
-    # Read in waveform data and turn into list of sensors pointing to AE hits
-    lines = data[1:]
-    signals = [] 
+    if use_cache: # memory map a previous parse of the same file
+        content = cache_content(ae_file) # hashed once, also for the store
+        signals = load_cached_signals(ae_file, content=content)
+        if signals is not None:
+            ev = np.arange(signals.shape[1])+1
+            return signals, ev, fs, channel_num, sig_length
     
-    # Loop through the columns taken from .txt file (waves from each sensor)
-    for channel in range(0,channel_num):
-        # Get data from the sensor's respective column
-        v = np.array([float(line.split()[channel]) for line in lines])
-        # Turn the long appended column into separate AE hits using sample num
-        z = []
-        for i in range(0,len(v),sig_length):
-            z.append(v[i:i+sig_length])    
-        signals.append(z)
+    # Read in the whole numeric block with the C parser of loadtxt, one
+    # row per sample with a column per sensor (lines end in a tab)
+    v = parse_ae_rows(ae_file, channel_num).ravel()
+    
+    # Only keep complete rows (every channel sampled) and complete events
+    row_num = len(v) // channel_num
+    event_num = row_num // sig_length
+    if event_num * sig_length != row_num or row_num * channel_num != len(v):
+        print("WARNING: incomplete last event dropped "+
+              f"({row_num - event_num*sig_length} of {sig_length} samples)")
+    v = v[:event_num * sig_length * channel_num]
+    
+    # Columns are sensors, rows are stacked AE hits of sig_length samples,
+    # reorder into one contiguous array of shape [channel][event][sample]
+    signals = np.ascontiguousarray(
+        v.reshape(event_num, sig_length, channel_num).transpose(2, 0, 1))
     
     # Create array of corresponding event numbers 
-    ev = np.arange(len(signals[0]))+1 # all sensors have same number of events
+    ev = np.arange(event_num)+1 # all sensors have same number of events
+    
+    if use_cache:
+        store_cached_signals(ae_file, signals, fs, channel_num, sig_length,
+                             content=content)
 
     return signals, ev, fs, channel_num, sig_length
 
 
+def iter_ae_events(ae_file, chunk_events=256):
+    """ generator yielding (event number, [channel][sample]) per AE event """
+    # Header gives the fixed event block size, so the file can be consumed
+    # in chunks of whole events and memory stays bounded by chunk_events
+    fs, sig_length, channel_num = read_ae_header(ae_file)
+    event = 0
+    with open(ae_file, 'rb') as f:
+        f.readline() # skip header
+        while True:
+            lines = list(itertools.islice(f, chunk_events * sig_length))
+            if not lines:
+                break
+            v = np.array(b''.join(lines).split(), dtype=np.float64)
+            row_num = len(v) // channel_num
+            event_num = row_num // sig_length
+            if event_num * sig_length != row_num or \
+                    row_num * channel_num != len(v):
+                print("WARNING: incomplete last event dropped "+
+                      f"({row_num - event_num*sig_length} of {sig_length}"+
+                      " samples)")
+            v = v[:event_num * sig_length * channel_num]
+            block = v.reshape(event_num, sig_length, channel_num)
+            for ev_idx in range(event_num):
+                event += 1
+                yield event, block[ev_idx].T
+            if event_num < chunk_events:
+                break
+
+
+def read_new_ae_events(ae_file, offset, sig_length, channel_num,
+                       max_bytes=2**26):
+    """ parses complete events appended to ae_file after byte offset,
+        returns [channel][event][sample] signals and the offset after them """
+    with open(ae_file, 'rb') as f:
+        if offset == 0: # header line first, it may still be being written
+            header = f.readline()
+            if not header.endswith(b'\n'):
+                return np.zeros((channel_num, 0, sig_length)), 0
+            offset = f.tell()
+        f.seek(offset)
+        buf = f.read(max_bytes)
+        while True:
+            # an event ends with the newline of its sig_length-th row, a row
+            # or event the DAQ is still writing is left for the next call
+            newlines = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) ==
+                                      ord('\n'))
+            event_num = len(newlines) // sig_length
+            more = f.read(max_bytes) if event_num == 0 else b''
+            if not more:
+                break
+            buf += more # bigger than max_bytes, read until one full event
+    if event_num == 0:
+        return np.zeros((channel_num, 0, sig_length)), offset
+    end = newlines[event_num * sig_length - 1] + 1
+    v = np.array(buf[:end].split(), dtype=np.float64)
+    if len(v) != event_num * sig_length * channel_num:
+        raise ValueError(f'{ae_file}: rows after byte {offset} do not have '
+                         f'{channel_num} channels')
+    signals = np.ascontiguousarray(
+        v.reshape(event_num, sig_length, channel_num).transpose(2, 0, 1))
+
+    return signals, offset + int(end)
+
+
 def select_txt_file():
     """ User selects a .txt file to load in """
     # Create a Tkinter window for file selection
@@ -169,14 +712,21 @@ def select_txt_file():
 if __name__ == '__main__':
     
     VERSION='1.0'
-    METHOD = 'MANUAL'
+    METHOD = 'MANUAL' # 'MANUAL', 'AUTO', 'HYBRID' or 'GALLERY'
+    NOISE_MODEL = None # e.g. 'noise_model.json', only review uncertain events
+    STREAM = False # filter event by event, for files larger than memory
+    USE_CACHE = True # reuse parsed waveforms from ae_cache.CACHE_DIR
+    FORMAT = '.npz' # dataset format, '.npz' or '.json'
+    PROFILE = False # cProfile the run, *_profile.prof next to the log
+    TRACE_MEMORY = False # tracemalloc peak per stage in *_metrics.json
 
 
     # Create a StringIO object to capture the output
     output_buffer = io.StringIO()
     
-    # Redirect the standard output to the buffer
-    with redirect_stdout(output_buffer):
+    # Redirect the standard output to the buffer, time the stages
+    metrics = RunMetrics('filter_ae', PROFILE, TRACE_MEMORY)
+    with redirect_stdout(output_buffer), metrics:
         # header
         current_datetime = datetime.datetime.now()
         print(current_datetime)
@@ -194,16 +744,35 @@ if __name__ == '__main__':
         #ae_file=r'C:\Users\nt\Desktop\in_situ_xct\230905_xctd\raw_data\ae\02_txt_files\02_loading.txt'
         print(f'selected .txt file: {ae_file}')
         print(f'selected filter method: {METHOD}')
+        print(f'noise model: {NOISE_MODEL}')
         print('')
            
         print('FILTERING')
-        noise_dataset, filter_dataset = filter_ae_txt_file(ae_file, 
-                                                           method='MANUAL')
+        # manual decisions survive a crash, a rerun resumes where it stopped
+        journal = DecisionJournal(ae_file, 'filter') \
+            if METHOD != 'AUTO' and not STREAM else None
+        model = load_noise_model(NOISE_MODEL) \
+            if NOISE_MODEL is not None else None
+        if STREAM:
+            noise_name, filter_name = stream_filter_ae_txt_file(ae_file,
+                                                                method=METHOD,
+                                                                fmt=FORMAT,
+                                                                model=model)
+        else:
+            noise_dataset, filter_dataset = filter_ae_txt_file(ae_file, 
+                                                               method=METHOD,
+                                                           use_cache=USE_CACHE,
+                                                           journal=journal,
+                                                           model=model)
         print('')
         
         print('OUTPUT')
-        save_dict_as_json(ae_file, noise_dataset, 'noise')
-        save_dict_as_json(ae_file, filter_dataset, 'filter')
+        if not STREAM: # streamed datasets are written during filtering
+            with stage('save'):
+                save_dataset(ae_file, noise_dataset, 'noise', FORMAT)
+                save_dataset(ae_file, filter_dataset, 'filter', FORMAT)
+        if journal is not None: # decisions are in the saved datasets now
+            journal.compact()
         print('noise and filter data saved succesfully.')
         print('')
         
@@ -214,4 +783,5 @@ if __name__ == '__main__':
     log_name = current_datetime.strftime("%Y-%m-%d_%H-%M-%S")
     with open(log_name+'_log.txt', 'w') as file:
         file.write(captured_output)
+    metrics.save(log_name) # timing / memory sidecar of the log
     
@@ -0,0 +1,215 @@
+"""
+daly_lab_ae_pipeline
+live_tail
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Summary of code:
+    1. Follows a Digital Wave .txt file while the DAQ is still appending
+       events to it during a live mechanical test (like tail -f).
+    2. Each poll parses only the complete events written since the last one,
+       starting at the byte offset reached so far. Event boundaries come from
+       sig_length and channel_num in the header, a partly written event is
+       left for the next poll.
+    3. New events go through AUTO filtering, automatic TOA and automatic peak
+       polarity and are appended to .npd datasets (*_noise.npd and
+       *_filter_toa_peak_polarity.npd), so a poll costs only the new data.
+       After each append the row count and the event ids of the new rows
+       are checked, a poll that would lose earlier rows stops the tail.
+    4. The byte offset and number of ingested events are kept in *_tail.json,
+       a stopped tail continues where it left off. Stage output is written
+       to *_tail_log.txt, the console gets one line per poll.
+
+Example:
+    python live_tail.py "D:/test/ae/02_loading.txt" --poll 2
+
+"""
+import matplotlib
+matplotlib.use('Agg') # headless, must come before pyplot is imported
+import argparse
+import datetime
+import io
+import json
+import os
+import time
+import numpy as np
+from contextlib import redirect_stdout
+from filter_ae import (AUTO_FILTER_RULES, auto_filtering, create_dataset,
+                       read_new_ae_events)
+from compute_toa import automatic_toa_selection
+from compute_peak_polarity import automatic_peak_polarity_selection
+from ae_cache import write_atomic
+from ae_io import (append_column_dataset, column_dataset_rows, column_file,
+                   dataset_name, truncate_column_dataset)
+from batch_process import none_if_off
+
+
+class AETail:
+    """ incremental ingest of a growing DW .txt file into .npd datasets """
+    def __init__(self, ae_file, toa_method='AIC', peak_polarity_method='AUTO',
+                 rules=AUTO_FILTER_RULES):
+        self.ae_file = ae_file
+        self.toa_method = toa_method
+        self.peak_polarity_method = peak_polarity_method if toa_method \
+            else None # polarity is driven by the toa
+        self.rules = rules
+        label = 'filter'
+        if self.toa_method is not None:
+            label += '_toa'
+        if self.peak_polarity_method is not None:
+            label += '_peak_polarity'
+        self.noise_name = dataset_name(ae_file, 'noise', '.npd')
+        self.filter_name = dataset_name(ae_file, label, '.npd')
+        self.state_file = dataset_name(ae_file, 'tail', '.json')
+        self.offset, self.events = 0, 0
+        self.header = None # (fs, sig_length, channel_num) once written
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                state = json.load(f)
+            self.offset, self.events = state['offset'], state['events']
+            print("resuming tail at event {:d} (byte {:d})".format(
+                self.events, self.offset))
+        self.trim_datasets()
+
+    def trim_datasets(self):
+        """ drop rows appended after the last saved state, e.g. on a crash """
+        for name in (self.noise_name, self.filter_name):
+            rows = column_dataset_rows(name)
+            if rows is None:
+                continue
+            event = np.load(column_file(name, 'event'), mmap_mode='r')[:rows]
+            truncate_column_dataset(name, int(np.sum(event <= self.events)))
+
+    def read_header(self):
+        """ header of the DW .txt file, None until the DAQ has written it """
+        with open(self.ae_file) as f:
+            line = f.readline()
+        if not line.endswith('\n'):
+            return None
+        header = line.split()
+        # same fields as filter_ae.read_ae_header
+        return int(header[0]) * 10**6, int(header[2]), int(header[3])
+
+    def save_state(self):
+        write_atomic(self.state_file, json.dumps({
+            'source': os.path.abspath(self.ae_file),
+            'offset': self.offset,
+            'events': self.events}))
+
+    def poll(self):
+        """ ingest events appended since the last poll, returns
+            (new events, new noise events, new filter events) """
+        if os.path.getsize(self.ae_file) < self.offset:
+            raise ValueError(f'{self.ae_file} is shorter than the tail offset,'
+                             f' remove {self.state_file} to start over')
+        if self.header is None:
+            self.header = self.read_header()
+            if self.header is None:
+                return 0, 0, 0
+        fs, sig_length, channel_num = self.header
+        signals, offset = read_new_ae_events(self.ae_file, self.offset,
+                                             sig_length, channel_num)
+        event_num = signals.shape[1]
+        if event_num == 0:
+            return 0, 0, 0
+        ev = np.arange(self.events+1, self.events+event_num+1)
+
+        print('FILTERING')
+        noise_ev, _, filter_ev, _, noise_signals, filter_signals = \
+            auto_filtering(signals, ev, fs, sig_length, self.rules)
+        noise_dataset = create_dataset(self.ae_file, noise_ev, noise_signals,
+                                       fs, sig_length)
+        filter_dataset = create_dataset(self.ae_file, filter_ev,
+                                        filter_signals, fs, sig_length)
+        if self.toa_method is not None and len(filter_dataset):
+            print('TIME-OF-ARRIVAL')
+            toa, toa_confidence = automatic_toa_selection(
+                filter_dataset['waves'], self.toa_method, 1/fs)
+            filter_dataset['toa'] = toa
+            filter_dataset['toa_confidence'] = toa_confidence
+            if self.peak_polarity_method is not None:
+                print('PEAK POLARITY')
+                filter_dataset['peak_polarity'] = \
+                    automatic_peak_polarity_selection(
+                        filter_dataset['waves'], toa, 1/fs)
+
+        print('OUTPUT')
+        for name, dataset in ((self.noise_name, noise_dataset),
+                              (self.filter_name, filter_dataset)):
+            if len(dataset):
+                rows = column_dataset_rows(name) or 0
+                append_column_dataset(name, dataset)
+                check_appended(name, rows, dataset['event'])
+                print("dataset .npd appended : {:s} (+{:d} rows)".format(
+                    name, len(dataset)))
+        self.offset, self.events = offset, self.events + event_num
+        self.save_state()
+
+        return event_num, len(noise_ev), len(filter_ev)
+
+
+def check_appended(name, rows, event):
+    """ earlier rows of a .npd dataset are kept and the new rows are at
+        its end, raises if an append lost or reordered rows """
+    new_rows = column_dataset_rows(name)
+    appended = np.load(column_file(name, 'event'), mmap_mode='r')[rows:]
+    if new_rows != rows + len(event) or \
+            not np.array_equal(appended[:len(event)], event):
+        raise RuntimeError(f'{name} has {new_rows} rows after appending '
+                           f'{len(event)} to {rows}, events not preserved')
+
+
+def tail_ae_file(ae_file, poll=2.0, idle_stop=None, **kwargs):
+    """ follow ae_file until Ctrl-C, or idle_stop seconds without new data """
+    tail = AETail(ae_file, **kwargs)
+    log_name = os.path.splitext(ae_file)[0] + '_tail_log.txt'
+    print(f'following {ae_file}, Ctrl-C to stop')
+    last_data = time.monotonic()
+    try:
+        while True:
+            start = time.perf_counter()
+            output_buffer = io.StringIO()
+            with redirect_stdout(output_buffer):
+                print(datetime.datetime.now())
+                new, noise, filtered = tail.poll()
+            if new:
+                with open(log_name, 'a') as file:
+                    file.write(output_buffer.getvalue() + '\n')
+                last_data = time.monotonic()
+                print("{:s}  +{:>5d} events  noise {:>5d}  filter {:>5d}  "
+                      "total {:>7d}  ({:.2f} s)".format(
+                          datetime.datetime.now().strftime("%H:%M:%S"),
+                          new, noise, filtered, tail.events,
+                          time.perf_counter() - start), flush=True)
+                continue # more may be waiting, poll again at once
+            if idle_stop is not None and \
+                    time.monotonic() - last_data >= idle_stop:
+                print(f'no new events for {idle_stop} s, tail stopped')
+                break
+            time.sleep(poll)
+    except KeyboardInterrupt:
+        print('tail stopped')
+
+    return tail
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Process a Digital Wave .txt file while it is written')
+    parser.add_argument('ae_file', help='.txt file the DAQ is writing')
+    parser.add_argument('--poll', type=float, default=2.0,
+                        help='seconds between checks for new events')
+    parser.add_argument('--idle-stop', type=float, default=None,
+                        help='stop after this many seconds without new data')
+    parser.add_argument('--toa', default='AIC',
+                        help='TOA method: AIC, STALTA or NONE')
+    parser.add_argument('--peak-polarity', default='AUTO',
+                        help='peak polarity method: AUTO or NONE')
+    args = parser.parse_args()
+
+    tail_ae_file(args.ae_file, poll=args.poll, idle_stop=args.idle_stop,
+                 toa_method=none_if_off(args.toa),
+                 peak_polarity_method=none_if_off(args.peak_polarity))
@@ -6,53 +6,56 @@ version: 1.0
 Author: Nick Tulshibagwale
 Date: 8/18/26 - Added to code to show example.
 
-Code loads in filtered and processed .json file where ToA and Peak Polarity
-has been selected. Waveforms can be paired according to event # and sensor #.
+Code loads in filtered and processed .npz (or .json) file where ToA and Peak
+Polarity has been selected. Waveforms are paired according to event # and
+sensor # by AEDataset. Only the needed columns / rows can be loaded, the
+waveforms are memory mapped and read on demand.
 
 """
-import numpy as np
 import matplotlib.pyplot as plt
-import json 
-
-
-def load_json_file(json_file):
-    """ Loads in .json file from file path. """
-    print(f"Loading in Dataset from {json_file}")
-    with open(json_file) as file:
-        data = json.load(file)
-    for key in data.keys():
-        data[key]  = np.array(data[key])
-    print("Successfully loaded in .json file.\n")
-    
-    return data
+from ae_dataset import AEDataset
 
           
 if __name__ == '__main__':
     
-    SIG_LEN = 1024
-    DT = 10**-7
-    DURATION = SIG_LEN*DT*10**6 # convert to us
-    TIME = np.linspace(0,DURATION,SIG_LEN) # discretization of signal time
     VERSION='1.0'
        
-    ae_json_file = r'3_filtered_AE_toa_peak_polarity\acoustic_data_2_channel_filter_toa_peak_polarity.json'
-    dataset = load_json_file(ae_json_file)
-    waves=dataset['waves']
-    waves = [list(waveform) for waveform in waves]
-    event=dataset['event'].tolist()
-    parent_txt=dataset['parent_txt'].tolist()
-    sensor=dataset['sensor'].tolist()
-    toa=dataset['toa'].tolist()
-    peak_polarity=dataset['peak_polarity'].tolist()
+    # .json datasets load the same way, convert them with ae_io.py
+    ae_dataset_file = r'3_filtered_AE_toa_peak_polarity\acoustic_data_2_channel_filter_toa_peak_polarity.json'
+    dataset = AEDataset.load(ae_dataset_file)
+    waves=dataset['waves'] # [waveform][sample] array
+    event=dataset['event']
+    parent_txt=dataset['parent_txt']
+    sensor=dataset['sensor']
+    toa=dataset['toa']
+    peak_polarity=dataset['peak_polarity']
+    time=dataset.time() # us, from the fs stored with the dataset
     
     plt.scatter(event,toa)
     plt.xlabel("Event #")
     plt.ylabel("Time of Arrival")
     plt.show()
     
+    # metadata only, the waveforms are never read
+    toa_dataset = AEDataset.load(ae_dataset_file,
+                                 columns=['toa', 'peak_polarity'])
+    # waveforms of sensor 1 of the first 100 events
+    sensor_1_waves = AEDataset.load(ae_dataset_file, columns=['waves'],
+                                    event=(1, 100), sensor=1)['waves']
+    
     # ... Processing of Data
-    # Note the list is flattened, use the event # and the sensor # to 
-    # determine the pairs of waveforms...
+    # Rows are flattened, the dataset pairs them by event # and sensor #
+    event_waves = dataset.event_waves() # [event][sensor][sample], no copy
+    event_toa = dataset.event_column('toa') # [event][sensor]
+    print(f'events: {dataset.events}')
+    print(f'sensors: {dataset.sensors}')
+    print(f'toa of event {dataset.events[0]}: {event_toa[0]}')
+    # waveform of one event and sensor, or a subset of the dataset
+    first_wave = waves[dataset.row(dataset.events[0], dataset.sensors[0])]
+    plt.plot(time, first_wave)
+    plt.xlabel("Time ($\\mu$s)")
+    plt.show()
+    sensor_1 = dataset.select(sensor=1)
     
     
    
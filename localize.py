@@ -0,0 +1,189 @@
+"""
+daly_lab_ae_pipeline
+localize
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Run this code after computing the TOAs.
+
+Summary of code:
+    1. User prompted to select ae .npz/.json file with a toa column
+    2. Rows are grouped by event into an [event][sensor] TOA array, sensors
+       with toa == 0 (unknown) are left out of that event's solution
+    3. Two sensors on a line: 1-D linear location from the TOA difference.
+       More sensors: least-squares 1-D/2-D/3-D location (source position and
+       emission time), solved for all events in one batched Gauss-Newton
+    4. Dataset is saved with the event's location and its residual (RMS TOA
+       misfit in us, for quality filtering) on every row of the event
+
+"""
+import numpy as np
+import io
+import os
+from contextlib import redirect_stdout
+import datetime
+from ae_dataset import AEDataset
+from ae_metrics import RunMetrics, stage
+from compute_toa import select_json_file
+
+
+def event_toa(dataset):
+    """ toa as [event][sensor], 0 where unknown or the sensor has no row """
+    grid = dataset.grid
+
+    return np.where(grid >= 0, dataset['toa'][grid], 0)
+
+
+def linear_location(toa, positions, wave_speed):
+    """ 1-D location between two sensors, toa [event][2] in us, positions
+        of the two sensors, wave_speed in position units per us """
+    toa = np.asarray(toa, dtype=np.float64)
+    x1, x2 = np.ravel(positions)
+    known = (toa > 0).all(axis=1)
+    travel = abs(x2 - x1) / wave_speed
+    # arrives first at the closer sensor: t1 - t2 = (2x - x1 - x2)/v sign
+    delta = (toa[:, 0] - toa[:, 1]) * np.sign(x2 - x1)
+    x = (x1 + x2) / 2 + np.clip(delta, -travel, travel) * wave_speed / 2
+    # a difference longer than the travel time between sensors is misfit
+    residual = np.maximum(np.abs(delta) - travel, 0)
+
+    return np.where(known, x, np.nan)[:, None], \
+        np.where(known, residual, np.nan)
+
+
+def least_squares_location(toa, positions, wave_speed, iterations=50,
+                           damping=10**-6):
+    """ least-squares location for [event][sensor] toa (us), positions
+        [sensor][dim]. Unknowns are position and emission time, all events
+        are solved together. Returns location [event][dim], residual [event]
+        (RMS misfit in us, nan if too few known sensors) """
+    toa = np.asarray(toa, dtype=np.float64)
+    positions = np.asarray(positions, dtype=np.float64)
+    event_num, sensor_num = toa.shape
+    dim = positions.shape[1]
+    w = (toa > 0).astype(np.float64) # unknown toa carries no weight
+    known = w.sum(axis=1)
+    solvable = known >= dim + 1
+    # start at the centroid of the known sensors, emitted before first hit
+    p = (w @ positions) / np.maximum(known, 1)[:, None]
+    t0 = np.where(w > 0, toa, np.inf).min(axis=1)
+    t0 = np.where(np.isfinite(t0), t0, 0)
+    eye = np.eye(dim + 1)
+    for _ in range(iterations):
+        diff = p[:, None, :] - positions[None, :, :] # [event][sensor][dim]
+        dist = np.sqrt(np.sum(diff**2, axis=2)) + 10**-12
+        r = (toa - t0[:, None] - dist / wave_speed) * w
+        # Jacobian of the predicted toa, [event][sensor][dim + 1]
+        jac = np.concatenate([diff / (dist * wave_speed)[..., None],
+                              np.ones((event_num, sensor_num, 1))], axis=2)
+        jac *= w[..., None]
+        jtj = np.einsum('esi,esj->eij', jac, jac)
+        jtr = np.einsum('esi,es->ei', jac, r)
+        scale = np.trace(jtj, axis1=1, axis2=2)[:, None, None] / (dim + 1)
+        jtj += eye * (damping * scale + 10**-12)
+        step = np.linalg.solve(jtj, jtr[..., None])[..., 0]
+        p += step[:, :dim]
+        t0 += step[:, dim]
+        if np.nanmax(np.abs(step[solvable]), initial=0) < 10**-9:
+            break
+    dist = np.sqrt(np.sum((p[:, None, :] - positions[None])**2, axis=2))
+    r = (toa - t0[:, None] - dist / wave_speed) * w
+    residual = np.sqrt(np.sum(r**2, axis=1) / np.maximum(known, 1))
+    p[~solvable] = np.nan
+    residual[~solvable] = np.nan
+
+    return p, residual
+
+
+def localize_events(toa, positions, wave_speed):
+    """ linear location for two sensors on a line, least squares otherwise """
+    positions = np.asarray(positions, dtype=np.float64)
+    if positions.ndim == 1:
+        positions = positions[:, None]
+    if positions.shape == (2, 1):
+        return linear_location(toa, positions, wave_speed)
+
+    return least_squares_location(toa, positions, wave_speed)
+
+
+def localize(ae_dataset_file, sensor_positions, wave_speed, fmt=None):
+    """ Locate AE sources, sensor_positions {sensor: coordinates} """
+    with stage('file read'):
+        dataset = AEDataset.load(ae_dataset_file)
+    positions = np.array([np.atleast_1d(sensor_positions[sensor])
+                          for sensor in dataset.sensors.tolist()],
+                         dtype=np.float64)
+    with stage('localization'):
+        location, residual = localize_events(event_toa(dataset), positions,
+                                             wave_speed)
+    located = ~np.isnan(residual)
+    print("num events located : {:>5d} of {:>5d}".format(np.sum(located),
+                                                         len(located)))
+    for ev, loc, res in zip(dataset.events, location, residual):
+        print("event : {:>5d}  location : {:s}  residual : {:>8.3f} us".format(
+            ev, np.array2string(loc, precision=2), res))
+
+    # every row of an event carries the event's location
+    event_idx = np.searchsorted(dataset.events, dataset['event'])
+    dataset['location'] = location[event_idx]
+    dataset['location_residual'] = residual[event_idx]
+
+    if fmt is None: # keep the format of the input dataset
+        fmt = os.path.splitext(ae_dataset_file)[1]
+    with stage('save'):
+        location_file = dataset.save(ae_dataset_file, 'location', fmt)
+
+    return location_file
+
+
+if __name__ == '__main__':
+
+    VERSION='1.0'
+    # sensor number -> coordinates (mm), one value per sensor for a line
+    SENSOR_POSITIONS = {1: [0.0],
+                        2: [50.0]}
+    WAVE_SPEED = 5.0 # mm/us, measured with pencil lead breaks
+    PROFILE = False # cProfile the run, *_profile.prof next to the log
+    TRACE_MEMORY = False # tracemalloc peak per stage in *_metrics.json
+
+    # Create a StringIO object to capture the output
+    output_buffer = io.StringIO()
+
+    # Redirect the standard output to the buffer, time the stages
+    metrics = RunMetrics('localize', PROFILE, TRACE_MEMORY)
+    with redirect_stdout(output_buffer), metrics:
+        # header
+        current_datetime = datetime.datetime.now()
+        print(current_datetime)
+        print('daly_lab_ae_pipeline')
+        print('localize')
+        print(f"version: {VERSION}")
+        print("Nick Tulshibagwale")
+        print("Daly Lab, Mechanical Eng. Department")
+        print("University of California, Santa Barbara")
+        print('')
+        print('')
+
+        print("INPUTS")
+        ae_dataset_file = select_json_file()
+        print(f'selected dataset file: {ae_dataset_file}')
+        print(f'sensor positions: {SENSOR_POSITIONS}')
+        print(f'wave speed: {WAVE_SPEED}')
+        print('')
+
+        print('LOCALIZATION')
+        location_dataset = localize(ae_dataset_file, SENSOR_POSITIONS,
+                                    WAVE_SPEED)
+        print('')
+
+
+        print('PROGRAM END')
+
+    # Output log
+    captured_output = output_buffer.getvalue()
+    log_name = current_datetime.strftime("%Y-%m-%d_%H-%M-%S")
+    with open(log_name+'_log.txt', 'w') as file:
+        file.write(captured_output)
+    metrics.save(log_name) # timing / memory sidecar of the log
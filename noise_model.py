@@ -0,0 +1,112 @@
+"""
+daly_lab_ae_pipeline
+noise_model
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Summary of code:
+    1. A small logistic regression (numpy only) on the event features of
+       filter_ae.event_features gives the probability that an event is
+       noise. Amplitudes and energy are used on a log scale, features are
+       standardized with the statistics of the training set.
+    2. The model is fit with Newton iterations (IRLS) and an L2 penalty,
+       noise and filter events weighted equally, and saved as a small .json
+       file (train_noise_model.py).
+    3. Events with a noise probability below ACCEPT are kept, above REJECT
+       they are noise, the ones in between are left for manual review.
+
+"""
+import numpy as np
+import json
+
+
+FEATURE_KEYS = ['amplitude', 'max_amplitude', 'energy', 'counts',
+                'rise_time', 'arrival_spread']
+ACCEPT = 0.05 # kept without review below this noise probability
+REJECT = 0.95 # noise without review above this noise probability
+
+
+def feature_matrix(features, time_cap):
+    """ [event][feature] model inputs from an event_features dict, times
+        (inf when a channel never crossed the threshold) capped at time_cap """
+    log = lambda v, floor: np.log10(np.maximum(v, floor))
+    rise = np.minimum(features['rise_time'], time_cap)
+    spread = features['arrival_spread']
+
+    return np.column_stack([log(features['amplitude'], 1e-6),
+                            log(features['max_amplitude'], 1e-6),
+                            log(features['energy'], 1e-12),
+                            np.log1p(features['counts']),
+                            rise,
+                            np.minimum(spread, time_cap),
+                            np.isinf(spread)]).astype(np.float64)
+
+
+def sigmoid(z):
+    return 1 / (1 + np.exp(-np.clip(z, -500, 500)))
+
+
+def fit_logistic(X, y, l2=1e-2, iterations=50, tol=1e-8):
+    """ weights (bias last) of an L2 logistic regression, classes balanced """
+    X = np.column_stack([X, np.ones(len(X))])
+    y = np.asarray(y, dtype=np.float64)
+    # each class weighs as much as the other, whatever the label counts
+    weight = np.where(y > 0, 0.5 / max(y.sum(), 1),
+                      0.5 / max((1 - y).sum(), 1)) * len(y)
+    penalty = l2 * np.eye(X.shape[1])
+    penalty[-1, -1] = 0 # bias is not shrunk
+    w = np.zeros(X.shape[1])
+    for _ in range(iterations): # Newton / IRLS steps
+        p = sigmoid(X @ w)
+        grad = X.T @ (weight * (p - y)) + penalty @ w
+        hessian = (X * (weight * p * (1 - p))[:, None]).T @ X + penalty
+        step = np.linalg.solve(hessian, grad)
+        w -= step
+        if np.max(np.abs(step)) < tol:
+            break
+
+    return w
+
+
+def fit_noise_model(features, is_noise, time_cap, threshold, l2=1e-2):
+    """ model dict from event_features of labeled events """
+    X = feature_matrix(features, time_cap)
+    mean, std = X.mean(axis=0), X.std(axis=0)
+    std = np.where(std > 0, std, 1)
+    w = fit_logistic((X - mean) / std, is_noise, l2)
+
+    return {'features': FEATURE_KEYS,
+            'time_cap': float(time_cap),
+            'threshold': float(threshold),
+            'mean': mean.tolist(),
+            'std': std.tolist(),
+            'weights': w[:-1].tolist(),
+            'bias': float(w[-1]),
+            'accept': ACCEPT,
+            'reject': REJECT}
+
+
+def noise_probability(model, features):
+    """ probability that each event is noise, all events in one pass """
+    X = feature_matrix(features, model['time_cap'])
+    z = ((X - model['mean']) / model['std']) @ np.asarray(model['weights'])
+
+    return sigmoid(z + model['bias'])
+
+
+def save_noise_model(model, model_file):
+    with open(model_file, 'w') as f:
+        json.dump(model, f, indent=1)
+    print(f'noise model saved : {model_file}')
+
+    return model_file
+
+
+def load_noise_model(model_file):
+    with open(model_file) as f:
+        model = json.load(f)
+    print(f'noise model loaded : {model_file}')
+
+    return model
@@ -0,0 +1,176 @@
+"""
+daly_lab_ae_pipeline
+preprocess
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Run this code after filtering, before computing the TOAs.
+
+Summary of code:
+    1. User prompted to select ae .npz/.json file of filtered waveforms
+    2. All waveforms are band-pass filtered at once: Butterworth SOS filter
+       applied forward and backward (zero phase) along the sample axis, the
+       band is set as a fraction of the sampling frequency fs
+    3. Optional wavelet denoising (soft universal threshold, needs pywt)
+    4. Dataset is saved with the raw waves and the conditioned waves in a
+       waves_filtered column, so the viewers and pickers can use either one
+       (WAVES setting in compute_toa / compute_peak_polarity) without
+       filtering again. A rerun with the same settings reuses the column.
+
+"""
+import numpy as np
+import io
+import json
+import os
+from contextlib import redirect_stdout
+import datetime
+import time
+from scipy import signal
+from ae_dataset import AEDataset
+from ae_metrics import RunMetrics, stage
+from compute_toa import select_json_file
+try:
+    import pywt
+except ImportError: # wavelet denoising is optional
+    pywt = None
+
+
+BAND = (0.01, 0.1) # pass band as fraction of fs, 100 kHz - 1 MHz at 10 MHz
+
+
+def bandpass_sos(fs, band=BAND, order=4):
+    """ Butterworth band-pass in second order sections, band relative to fs """
+    low, high = band[0] * fs, min(band[1], 0.499) * fs
+
+    return signal.butter(order, [low, high], btype='bandpass', fs=fs,
+                         output='sos')
+
+
+def bandpass_filter(waves, fs, band=BAND, order=4, chunk=4096):
+    """ zero phase band-pass of every waveform (rows of waves) """
+    waves = np.asarray(waves, dtype=np.float64)
+    sos = bandpass_sos(fs, band, order)
+    filtered = np.empty_like(waves)
+    for start in range(0, len(waves), chunk): # bounds memory
+        filtered[start:start+chunk] = signal.sosfiltfilt(
+            sos, waves[start:start+chunk], axis=1)
+
+    return filtered
+
+
+def wavelet_denoise(waves, wavelet='db4', level=None, chunk=4096):
+    """ soft universal-threshold wavelet denoising of every waveform """
+    if pywt is None:
+        raise ImportError('wavelet denoising needs PyWavelets (pywt)')
+    waves = np.asarray(waves, dtype=np.float64)
+    denoised = np.empty_like(waves)
+    for start in range(0, len(waves), chunk):
+        x = waves[start:start+chunk]
+        coeffs = pywt.wavedec(x, wavelet, level=level, axis=1)
+        # noise level from the finest details, one threshold per waveform
+        sigma = np.median(np.abs(coeffs[-1]), axis=1) / 0.6745
+        threshold = (sigma * np.sqrt(2 * np.log(x.shape[1])))[:, None]
+        coeffs[1:] = [np.sign(c) * np.maximum(np.abs(c) - threshold, 0)
+                      for c in coeffs[1:]] # soft threshold of the details
+        denoised[start:start+chunk] = pywt.waverec(
+            coeffs, wavelet, axis=1)[:, :x.shape[1]]
+
+    return denoised
+
+
+def preprocess_waves(waves, fs, band=BAND, order=4, wavelet=None):
+    """ band-pass, then wavelet denoising if a wavelet is given """
+    filtered = bandpass_filter(waves, fs, band, order)
+    if wavelet is not None:
+        filtered = wavelet_denoise(filtered, wavelet)
+
+    return filtered
+
+
+def preprocess(ae_dataset_file, fs=None, band=BAND, order=4, wavelet=None,
+               fmt=None):
+    """ Add band-passed (and denoised) waveforms as waves_filtered, fs from
+        the dataset if not given """
+    if wavelet is not None and pywt is None: # fail before loading
+        raise ImportError('wavelet denoising needs PyWavelets (pywt)')
+    with stage('file read'):
+        dataset = AEDataset.load(ae_dataset_file)
+    fs = fs or 1 / dataset.dt()
+    settings = json.dumps({'fs': float(fs), 'band': list(band), 'order': order,
+                           'wavelet': wavelet})
+
+    # waves_filtered without settings (older file) is stale, made again
+    if 'waves_filtered' in dataset and 'preprocess_settings' in dataset \
+            and str(dataset['preprocess_settings']) == settings:
+        print('waves_filtered already made with these settings, reused')
+        return ae_dataset_file
+    print("band-pass : {:.0f} - {:.0f} kHz, order {:d}".format(
+        band[0] * fs / 1000, min(band[1], 0.499) * fs / 1000, order))
+    start = time.perf_counter()
+    with stage('preprocessing'):
+        dataset['waves_filtered'] = preprocess_waves(dataset['waves'], fs,
+                                                     band, order, wavelet)
+    print("preprocessed {:>5d} waveforms in {:.3f} s".format(
+        len(dataset), time.perf_counter() - start))
+    # one value for the whole dataset, not a per row column
+    dataset.columns['preprocess_settings'] = np.array(settings)
+
+    if fmt is None: # keep the format of the input dataset
+        fmt = os.path.splitext(ae_dataset_file)[1]
+    with stage('save'):
+        preprocessed_file = dataset.save(ae_dataset_file, 'preprocessed', fmt)
+
+    return preprocessed_file
+
+
+if __name__ == '__main__':
+
+    VERSION='1.0'
+    BAND_FRACTION = BAND # pass band as fraction of the dataset fs
+    ORDER = 4
+    WAVELET = None # e.g. 'db4' to also wavelet denoise (needs pywt)
+    PROFILE = False # cProfile the run, *_profile.prof next to the log
+    TRACE_MEMORY = False # tracemalloc peak per stage in *_metrics.json
+
+    # Create a StringIO object to capture the output
+    output_buffer = io.StringIO()
+
+    # Redirect the standard output to the buffer, time the stages
+    metrics = RunMetrics('preprocess', PROFILE, TRACE_MEMORY)
+    with redirect_stdout(output_buffer), metrics:
+        # header
+        current_datetime = datetime.datetime.now()
+        print(current_datetime)
+        print('daly_lab_ae_pipeline')
+        print('preprocess')
+        print(f"version: {VERSION}")
+        print("Nick Tulshibagwale")
+        print("Daly Lab, Mechanical Eng. Department")
+        print("University of California, Santa Barbara")
+        print('')
+        print('')
+
+        print("INPUTS")
+        ae_dataset_file = select_json_file()
+        print(f'selected dataset file: {ae_dataset_file}')
+        print(f'band (fraction of fs): {BAND_FRACTION}, order: {ORDER}')
+        print(f'wavelet denoising: {WAVELET}')
+        print('')
+
+        print('PREPROCESSING')
+        preprocessed_dataset = preprocess(ae_dataset_file,
+                                          band=BAND_FRACTION, order=ORDER,
+                                          wavelet=WAVELET)
+        print('')
+
+
+        print('PROGRAM END')
+
+    # Output log
+    captured_output = output_buffer.getvalue()
+    log_name = current_datetime.strftime("%Y-%m-%d_%H-%M-%S")
+    with open(log_name+'_log.txt', 'w') as file:
+        file.write(captured_output)
+    metrics.save(log_name) # timing / memory sidecar of the log
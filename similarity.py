@@ -0,0 +1,247 @@
+"""
+daly_lab_ae_pipeline
+similarity
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Run this code on a filtered (or preprocessed) dataset.
+
+Summary of code:
+    1. User prompted to select ae .npz/.json file of filtered waveforms
+    2. The similarity of two events is the normalized cross-correlation
+       maximum of their waveforms, averaged over the sensors. It is found
+       for all event pairs from rFFT spectra, a batch of query events
+       against all later events in one vectorized call, batches sized so
+       memory stays bounded and spread over threads (numpy / scipy.fft
+       release the GIL)
+    3. Only the top-k most similar events of each event are kept, events
+       linked by a similarity above a threshold are clustered (connected
+       components) into multiplets, i.e. hits from a repeating source
+    4. Dataset is saved with cluster (-1 = no multiplet), neighbors and
+       neighbor_similarity columns
+
+"""
+import numpy as np
+import io
+import os
+from contextlib import redirect_stdout
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from scipy import fft
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from ae_dataset import AEDataset
+from ae_metrics import RunMetrics, stage
+from compute_toa import select_json_file
+
+
+CHUNK_ELEMENTS = 2**24 # cross-correlation values of one query batch
+
+def sensor_waves(dataset, waves='waves', length=None):
+    """ waveforms as [event][sensor][sample], zeros where a sensor is missing,
+        only the first length samples if given """
+    grid = dataset.grid
+    w = dataset[waves][:, :length] if length else dataset[waves]
+    stacked = w[np.maximum(grid, 0)]
+
+    return np.where((grid >= 0)[..., None], stacked, 0)
+
+
+def normalized_spectra(waves, nfft):
+    """ rFFT of zero-mean, unit-norm waveforms (last axis), single precision
+        halves the memory of the spectra of all events """
+    waves = np.asarray(waves, dtype=np.float32)
+    waves = waves - waves.mean(axis=-1, keepdims=True)
+    norm = np.sqrt(np.sum(waves**2, axis=-1, keepdims=True))
+    waves = waves / np.where(norm > 0, norm, 1)
+
+    return fft.rfft(waves, nfft, axis=-1)
+
+
+def ncc_max(spec_a, spec_b, nfft, max_lag=None):
+    """ max normalized cross-correlation of every a / b pair of one sensor,
+        spec_a [a][freq], spec_b [b][freq] -> [a][b] """
+    cc = fft.irfft(spec_a[:, None, :] * np.conj(spec_b[None, :, :]), nfft,
+                   axis=-1)
+    if max_lag is not None: # positive lags first, negative wrap around
+        cc = np.concatenate([cc[..., :max_lag+1], cc[..., nfft-max_lag:]],
+                            axis=-1)
+
+    return cc.max(axis=-1)
+
+
+def merge_top_k(best_sim, best_idx, sim, first, k):
+    """ keep the k largest of the running top-k and a block of similarities
+        sim [row][col], col numbered from event index first """
+    cand_sim = np.concatenate([best_sim, sim], axis=1)
+    cand_idx = np.concatenate([best_idx, np.broadcast_to(
+        np.arange(first, first + sim.shape[1]), sim.shape)], axis=1)
+    keep = np.argpartition(-cand_sim, k - 1, axis=1)[:, :k]
+
+    return np.take_along_axis(cand_sim, keep, axis=1), \
+        np.take_along_axis(cand_idx, keep, axis=1)
+
+
+def top_k_similarity(waves, k=10, max_lag=None, workers=None,
+                     max_elements=CHUNK_ELEMENTS):
+    """ waves [event][sensor][sample] -> neighbors [event][k] (event index)
+        and similarity [event][k], most similar first, self excluded """
+    event_num, sensor_num, sig_length = waves.shape
+    k = min(k, event_num - 1)
+    neighbors = np.zeros((event_num, max(k, 0)), dtype=np.int64)
+    similarity = np.zeros((event_num, max(k, 0)))
+    if k <= 0:
+        return neighbors, similarity
+    if max_lag is None:
+        nfft = fft.next_fast_len(2 * sig_length - 1)
+    else: # shorter FFTs, lags up to max_lag do not wrap around
+        max_lag = min(max_lag, sig_length - 1)
+        nfft = fft.next_fast_len(sig_length + max_lag)
+    # [sensor][event][freq], each sensor's spectra contiguous
+    spectra = np.ascontiguousarray(
+        normalized_spectra(waves, nfft).transpose(1, 0, 2))
+    # query rows per batch, their correlations with all events fit in
+    # max_elements
+    batch = max(1, max_elements // (event_num * nfft))
+
+    def row_strip(start):
+        """ similarity of a batch of query rows to itself and all later
+            events, one call per sensor """
+        stop = min(start + batch, event_num)
+        strip = sum(ncc_max(spectra[s, start:stop], spectra[s, start:], nfft,
+                            max_lag) for s in range(sensor_num)) / sensor_num
+        np.fill_diagonal(strip, -np.inf) # not its own neighbour
+        return start, strip
+
+    # the similarity is symmetric: only the part on / above the diagonal is
+    # computed, each strip updates the top-k of its rows and of its columns
+    similarity[:] = -np.inf
+    workers = workers or os.cpu_count()
+    starts = range(0, event_num, batch)
+    # a few strips in flight per thread, so finished strips do not pile up
+    batches = [starts[i:i + 2 * workers]
+               for i in range(0, len(starts), 2 * workers)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start, strip in (result for batch in batches
+                             for result in pool.map(row_strip, batch)):
+            stop = start + len(strip)
+            similarity[start:], neighbors[start:] = merge_top_k(
+                similarity[start:], neighbors[start:], strip.T, start, k)
+            similarity[start:stop], neighbors[start:stop] = merge_top_k(
+                similarity[start:stop], neighbors[start:stop],
+                strip[:, len(strip):], stop, k)
+    order = np.argsort(-similarity, axis=1)
+
+    return np.take_along_axis(neighbors, order, axis=1), \
+        np.take_along_axis(similarity, order, axis=1)
+
+
+def cluster_neighbors(neighbors, similarity, threshold=0.8, min_size=2):
+    """ connected components of the top-k graph with edges above threshold,
+        cluster ids by size (largest 0), -1 for events in no multiplet """
+    event_num = len(neighbors)
+    keep = similarity >= threshold
+    rows = np.repeat(np.arange(event_num), neighbors.shape[1])[keep.ravel()]
+    graph = coo_matrix((np.ones(len(rows)), (rows, neighbors[keep])),
+                       shape=(event_num, event_num))
+    _, labels = connected_components(graph, directed=False)
+    sizes = np.bincount(labels)
+    # renumber multiplets by size, singletons and small groups -> -1
+    order = np.argsort(-sizes, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    cluster = rank[labels]
+    cluster[sizes[labels] < min_size] = -1
+
+    return cluster
+
+
+def find_multiplets(ae_dataset_file, k=10, threshold=0.8, waves=None,
+                    length=None, max_lag=None, workers=None, fmt=None):
+    """ Cluster events of a dataset into multiplets by waveform similarity """
+    with stage('file read'):
+        dataset = AEDataset.load(ae_dataset_file)
+    if waves is None: # band-passed waves when preprocess.py was run
+        waves = 'waves_filtered' if 'waves_filtered' in dataset else 'waves'
+    print(f'similarity of {waves}, top {k} neighbours, threshold {threshold}')
+
+    start = time.perf_counter()
+    with stage('similarity'):
+        neighbors, similarity = top_k_similarity(
+            sensor_waves(dataset, waves, length), k, max_lag=max_lag,
+            workers=workers)
+        cluster = cluster_neighbors(neighbors, similarity, threshold)
+    seconds = time.perf_counter() - start
+    event_num = len(dataset.events)
+    print("{:>5d} events in {:.3f} s ({:.0f} pairs/s)".format(
+        event_num, seconds, event_num**2 / max(seconds, 10**-9)))
+    print("num multiplets : {:>5d}".format(cluster.max() + 1))
+    print("num events in multiplets : {:>5d}".format(np.sum(cluster >= 0)))
+    for ev, c in zip(dataset.events, cluster):
+        if c >= 0:
+            print("event : {:>5d}  cluster : {:>5d}".format(ev, c))
+
+    # every row of an event carries the event's cluster and neighbours
+    event_idx = np.searchsorted(dataset.events, dataset['event'])
+    dataset['cluster'] = cluster[event_idx]
+    dataset['neighbors'] = dataset.events[neighbors][event_idx]
+    dataset['neighbor_similarity'] = similarity[event_idx]
+
+    if fmt is None: # keep the format of the input dataset
+        fmt = os.path.splitext(ae_dataset_file)[1]
+    with stage('save'):
+        cluster_file = dataset.save(ae_dataset_file, 'cluster', fmt)
+
+    return cluster_file
+
+
+if __name__ == '__main__':
+
+    VERSION='1.0'
+    TOP_K = 10 # neighbours kept per event
+    THRESHOLD = 0.8 # similarity linking two events of a multiplet
+    LENGTH = None # e.g. 512, only compare the first samples of each wave
+    MAX_LAG = None # e.g. 100, largest shift (samples) between two waves
+    PROFILE = False # cProfile the run, *_profile.prof next to the log
+    TRACE_MEMORY = False # tracemalloc peak per stage in *_metrics.json
+
+    # Create a StringIO object to capture the output
+    output_buffer = io.StringIO()
+
+    # Redirect the standard output to the buffer, time the stages
+    metrics = RunMetrics('similarity', PROFILE, TRACE_MEMORY)
+    with redirect_stdout(output_buffer), metrics:
+        # header
+        current_datetime = datetime.datetime.now()
+        print(current_datetime)
+        print('daly_lab_ae_pipeline')
+        print('similarity')
+        print(f"version: {VERSION}")
+        print("Nick Tulshibagwale")
+        print("Daly Lab, Mechanical Eng. Department")
+        print("University of California, Santa Barbara")
+        print('')
+        print('')
+
+        print("INPUTS")
+        ae_dataset_file = select_json_file()
+        print(f'selected dataset file: {ae_dataset_file}')
+        print('')
+
+        print('SIMILARITY')
+        cluster_dataset = find_multiplets(ae_dataset_file, TOP_K, THRESHOLD,
+                                          length=LENGTH, max_lag=MAX_LAG)
+        print('')
+
+
+        print('PROGRAM END')
+
+    # Output log
+    captured_output = output_buffer.getvalue()
+    log_name = current_datetime.strftime("%Y-%m-%d_%H-%M-%S")
+    with open(log_name+'_log.txt', 'w') as file:
+        file.write(captured_output)
+    metrics.save(log_name) # timing / memory sidecar of the log
@@ -0,0 +1,106 @@
+"""
+daly_lab_ae_pipeline
+synthetic_ae
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Summary of code:
+    1. Writes Digital Wave format .txt files (header line, one tab separated
+       row per sample, CRLF) with any number of events, channels and
+       sig_length, for testing and benchmarking the pipeline at scale.
+    2. AE hits are decaying bursts (rise, ring down, random frequency and
+       amplitude) that reach each sensor with a different delay, noise
+       events are short spikes that hit every channel at the same time.
+       Every waveform has background noise and is rounded to 4 decimals.
+    3. Events are generated and written in chunks, so memory stays bounded
+       for 1e6 events. The true arrival times and noise flags are saved in
+       *_truth.npz next to the .txt file.
+
+Example:
+    python synthetic_ae.py synthetic_1e4.txt --events 10000 --channels 4
+
+"""
+import argparse
+import os
+import numpy as np
+
+
+def synthetic_signals(rng, event_num, channel_num=2, sig_length=1024,
+                      fs=10**7, noise_fraction=0.3, pretrigger=10):
+    """ [channel][event][sample] waveforms (V), true toa (us, 0 for noise
+        events) as [channel][event] and the noise flag of each event """
+    t = np.arange(sig_length) / fs * 10**6 # us
+    is_noise = rng.random(event_num) < noise_fraction
+    # hits: arrival after the pretrigger plus a source dependent delay
+    toa = pretrigger + rng.uniform(0, 15, (channel_num, event_num))
+    amplitude = np.exp(rng.uniform(np.log(0.05), np.log(0.9), event_num))
+    freq = rng.uniform(0.15, 0.4, event_num) # MHz
+    rise = rng.uniform(1, 10, event_num) # us
+    decay = rng.uniform(10, 60, event_num) # us
+    # noise events: a short spike on every channel at once
+    toa[:, is_noise] = rng.uniform(5, t[-1] / 2, is_noise.sum())
+    amplitude[is_noise] = rng.uniform(0.01, 0.05, is_noise.sum())
+    rise[is_noise], decay[is_noise] = 0.2, 1
+
+    tau = t[None, None, :] - toa[..., None] # [channel][event][sample]
+    on = tau >= 0
+    tau = np.where(on, tau, 0)
+    attenuation = rng.uniform(0.5, 1, (channel_num, event_num))
+    envelope = (amplitude * attenuation)[..., None] * on * \
+        (1 - np.exp(-tau / rise[None, :, None])) * \
+        np.exp(-tau / decay[None, :, None])
+    phase = rng.uniform(0, 2*np.pi, (channel_num, event_num))
+    signals = envelope * np.sin(2*np.pi * freq[None, :, None] * tau +
+                                phase[..., None])
+    signals += rng.normal(0, 0.0005, signals.shape) # background noise
+    signals = np.round(np.clip(signals, -0.9999, 0.9999), 4)
+    toa = np.round(toa, 1)
+    toa[:, is_noise] = 0
+
+    return signals, toa, is_noise
+
+
+def write_ae_txt(ae_file, event_num, channel_num=2, sig_length=1024,
+                 fs_mhz=10, noise_fraction=0.3, seed=0, chunk_events=500):
+    """ write a synthetic Digital Wave .txt file, returns the truth file """
+    rng = np.random.default_rng(seed)
+    row = '%.4f\t' * channel_num + '\r\n'
+    toa, is_noise = [], []
+    with open(ae_file, 'w', newline='') as f:
+        f.write(f'{fs_mhz}\t{event_num}\t{sig_length}\t{channel_num}\r\n')
+        for start in range(0, event_num, chunk_events):
+            n = min(chunk_events, event_num - start)
+            signals, chunk_toa, chunk_noise = synthetic_signals(
+                rng, n, channel_num, sig_length, fs_mhz * 10**6,
+                noise_fraction)
+            toa.append(chunk_toa)
+            is_noise.append(chunk_noise)
+            # rows are samples of consecutive events, columns are channels
+            values = signals.transpose(1, 2, 0).reshape(-1)
+            f.write((row * (n * sig_length)) % tuple(values.tolist()))
+    truth_file = os.path.splitext(ae_file)[0] + '_truth.npz'
+    np.savez(truth_file, toa=np.concatenate(toa, axis=1),
+             is_noise=np.concatenate(is_noise))
+    print("synthetic .txt written : {:s} ({:d} events, {:d} channels)".format(
+        ae_file, event_num, channel_num))
+
+    return truth_file
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic Digital Wave .txt file')
+    parser.add_argument('ae_file', help='.txt file to write')
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--sig-length', type=int, default=1024)
+    parser.add_argument('--fs-mhz', type=int, default=10)
+    parser.add_argument('--noise-fraction', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    write_ae_txt(args.ae_file, args.events, args.channels, args.sig_length,
+                 args.fs_mhz, args.noise_fraction, args.seed)
@@ -0,0 +1,132 @@
+"""
+daly_lab_ae_pipeline
+train_noise_model
+version: 1.0
+
+Author: Nick Tulshibagwale
+Date: October 18, 2026
+
+Summary of code:
+    1. Finds the labeled *_filter / *_noise dataset pairs (.json, .npz or
+       .npd) left behind by earlier filter_ae.py sessions.
+    2. Computes the event features of all their events in batches
+       (filter_ae.event_features), only the waves column is loaded.
+    3. Fits the noise_model logistic regression, reports its accuracy on a
+       held out 20% of the events and how many events it would decide
+       without review, then refits on all events and saves the model.
+
+Example:
+    python train_noise_model.py 1_filtered_AE_json "D:/campaign/*" --output noise_model.json
+
+"""
+import argparse
+import glob
+import os
+import numpy as np
+from ae_dataset import AEDataset
+from filter_ae import AUTO_FILTER_RULES, event_features
+from noise_model import (fit_noise_model, noise_probability,
+                         save_noise_model)
+
+
+def find_labeled_pairs(paths):
+    """ (filter dataset, noise dataset) pairs in directories / glob patterns """
+    candidates = []
+    for path in paths:
+        if os.path.isdir(path):
+            candidates += glob.glob(os.path.join(path, '*_filter.*'))
+        else:
+            candidates += glob.glob(path)
+    pairs = []
+    for filter_file in sorted(set(candidates)):
+        base, ext = os.path.splitext(filter_file)
+        noise_file = base[:-len('_filter')] + '_noise' + ext
+        if base.endswith('_filter') and ext in ('.json', '.npz', '.npd') \
+                and os.path.exists(noise_file):
+            pairs.append((filter_file, noise_file))
+
+    return pairs
+
+
+def dataset_signals(dataset_file):
+    """ [channel][event][sample] waveforms of a dataset, zeros for missing,
+        and the sampling frequency of the dataset """
+    dataset = AEDataset.load(dataset_file, columns=['waves', 'fs'])
+    grid = dataset.grid
+    waves = dataset['waves'][np.maximum(grid, 0)] # [event][channel][sample]
+    waves[grid < 0] = 0
+
+    return waves.transpose(1, 0, 2), 1 / dataset.dt()
+
+
+def labeled_features(pairs, fs, threshold):
+    """ event features and noise labels of all events of all pairs, fs of
+        each dataset if fs is None, and the longest record duration (s) """
+    features, is_noise, duration = [], [], 0
+    for filter_file, noise_file in pairs:
+        for dataset_file, noise in ((filter_file, False), (noise_file, True)):
+            signals, dataset_fs = dataset_signals(dataset_file)
+            dataset_fs = fs or dataset_fs
+            # longest record, the time cap does not depend on file order
+            duration = max(duration, signals.shape[2] / dataset_fs)
+            features.append(event_features(signals, dataset_fs, threshold))
+            is_noise.append(np.full(signals.shape[1], noise))
+            print("{:>6d} {:s} events : {:s}".format(
+                signals.shape[1], 'noise ' if noise else 'filter', dataset_file))
+    features = {key: np.concatenate([f[key] for f in features])
+                for key in features[0]}
+
+    return features, np.concatenate(is_noise), duration
+
+
+def evaluate(model, features, is_noise):
+    """ accuracy of all decisions and of the ones made without review """
+    p = noise_probability(model, features)
+    confident = (p <= model['accept']) | (p >= model['reject'])
+    correct = (p >= 0.5) == is_noise
+    print("accuracy : {:.3f}".format(correct.mean()))
+    print("decided without review : {:.3f} of events, accuracy {:.3f}".format(
+        confident.mean(), correct[confident].mean() if confident.any()
+        else np.nan))
+
+
+def train_noise_model(paths, output='noise_model.json', fs=None,
+                      threshold=AUTO_FILTER_RULES['threshold'], seed=0):
+    """ fit and save a noise model on every labeled pair found in paths,
+        fs from the datasets if not given """
+    pairs = find_labeled_pairs(paths)
+    if not pairs:
+        raise FileNotFoundError(f'no *_filter / *_noise pairs in {paths}')
+    features, is_noise, duration = labeled_features(pairs, fs, threshold)
+    time_cap = duration * 10**6 # us
+    print("num events : {:>6d} ({:d} noise)".format(len(is_noise),
+                                                     is_noise.sum()))
+
+    # held out events for an honest estimate, then fit on everything
+    test = np.random.default_rng(seed).random(len(is_noise)) < 0.2
+    if test.any() and (~test).any():
+        subset = lambda mask: {key: value[mask]
+                               for key, value in features.items()}
+        model = fit_noise_model(subset(~test), is_noise[~test], time_cap,
+                                threshold)
+        print('held out 20% of the events:')
+        evaluate(model, subset(test), is_noise[test])
+    model = fit_noise_model(features, is_noise, time_cap, threshold)
+    model['trained_on'] = [os.path.abspath(f) for pair in pairs for f in pair]
+
+    return save_noise_model(model, output)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Train the noise model on archived filter/noise datasets')
+    parser.add_argument('paths', nargs='+',
+                        help='directories and/or glob patterns of datasets')
+    parser.add_argument('--output', default='noise_model.json')
+    parser.add_argument('--fs', type=float, default=None,
+                        help='sampling frequency of the datasets (Hz), '
+                        'default from the datasets')
+    args = parser.parse_args()
+
+    train_noise_model(args.paths, args.output, args.fs)